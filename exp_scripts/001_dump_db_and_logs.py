@@ -10,6 +10,7 @@ from webnorm_gpt import logger
 from webnorm_gpt.file_types.binlog_file import process_binlog_file
 from webnorm_gpt.file_types.log_file import LogFile
 from webnorm_gpt.file_types.merge_query_orders import train_ticket_db_merge_info
+from webnorm_gpt.schema_induction.column_store import pack_dump
 from webnorm_gpt.schema_induction.db import DbDump, DbSchema, db_merge_logs_and_db
 from webnorm_gpt.schema_induction.expansion import DbExpander
 from webnorm_gpt.schema_induction.from_log import dump_log_dump_schema
@@ -52,6 +53,9 @@ def main():
     logger.info("Merging db and logs")
     db = db_merge_logs_and_db(log_db, db_dump)
 
+    logger.info("Packing primitive columns")
+    pack_dump(db)
+
     logger.info("Processing binlog file")
     binlog_path = os.path.join(
         cur_path, "../traffic-new-collect/binlogs/binlog-train-ticket-new.pkl.zst"
@@ -16,11 +16,15 @@ from webnorm_gpt import logger
 from webnorm_gpt.file_types.log_file import LogFile, LogItem
 from webnorm_gpt.file_types.proj_desc_file import ProjDescFile
 from webnorm_gpt.gen_inv.inv_gens import InvGeneratorCommonSenseNewJsonFormat
+from webnorm_gpt.gen_inv.verdict_cache import VerdictCache
 from webnorm_gpt.gpt_invoker import GPTInvoker
 from webnorm_gpt.schema_induction.join_all import join_all
 from webnorm_gpt.schema_induction.relation_induction import infer_relations_in_table
 
 N_SAMPLES_IN_GEN = 10
+# verdicts of candidates on the training logs, reused by reruns; None to
+# disable
+VERDICT_CACHE_PATH = "../gen-inv-dump/verdict-cache.sqlite"
 
 
 def load_dataflow_map():
@@ -161,6 +165,9 @@ def main():
                 f.write(json.dumps(inv))
                 f.write("\n")
 
+    pool.close()
+    pool.join()
+
 
 def run_child(idx):
     (
@@ -174,6 +181,19 @@ def run_child(idx):
         focal_apis,
     ) = share_between_processes
 
+    verdict_cache = None
+    if VERDICT_CACHE_PATH is not None:
+        cur_path = os.path.abspath(os.path.dirname(__file__))
+        verdict_cache = VerdictCache(os.path.join(cur_path, VERDICT_CACHE_PATH))
+
+    def report(result):
+        # the parent may exit as soon as it has every result, so the cached
+        # responses and verdicts behind one are committed before it is sent
+        gpt_invoker.gpt_cache.flush()
+        if verdict_cache is not None:
+            verdict_cache.flush()
+        qback.put(result)
+
     while True:
         api_idx = queue.get()
         if api_idx is None:
@@ -182,15 +202,15 @@ def run_child(idx):
         api = proj_desc_file.apis[api_idx]
 
         if api.name not in training_logs:
-            qback.put((api_idx, None, []))
+            report((api_idx, None, []))
             continue
 
         if len(training_logs[api.name].log_items) < 5:
-            qback.put((api_idx, None, []))
+            report((api_idx, None, []))
             continue
 
         if api.name not in focal_apis:
-            qback.put((api_idx, None, []))
+            report((api_idx, None, []))
             continue
 
         # use logs to predict
@@ -214,6 +234,7 @@ def run_child(idx):
                 f,
                 log_schema=log_schema,
                 db_schema=db_schema,
+                verdict_cache=verdict_cache,
             )
 
             try:
@@ -225,12 +246,25 @@ def run_child(idx):
                 logger.error(
                     "Error in generating invariants for %s\n%s", api.name, exc_info
                 )
-                qback.put((api_idx, None, []))
+                report((api_idx, None, []))
                 continue
 
             invs = [inv.save_to_json() for inv in invariants]
 
-            qback.put((api_idx, invs, prompts))
+            report((api_idx, invs, prompts))
+
+    logger.info(
+        "GPT cache of worker %d: %s",
+        idx,
+        json.dumps(gpt_invoker.gpt_cache.stats.to_json()),
+    )
+    if verdict_cache is not None:
+        logger.info(
+            "Verdict cache of worker %d: %s",
+            idx,
+            json.dumps(verdict_cache.stats.to_json()),
+        )
+        verdict_cache.close()
 
 
 if __name__ == "__main__":
@@ -1,11 +1,12 @@
+import functools
 import json
 import os
 import pickle
 import sys
+import typing
 from collections import defaultdict
 
 import mysql.connector
-import tqdm
 import zstandard
 
 sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
@@ -13,7 +14,6 @@ sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
 
 from webnorm_gpt import logger
 from webnorm_gpt.file_types.binlog_file import process_binlog_file
-from webnorm_gpt.file_types.compute_context import compute_context_train_ticket_log
 from webnorm_gpt.file_types.log_file import (
     LogFile,
     load_from_log_receiver_file,
@@ -21,138 +21,259 @@ from webnorm_gpt.file_types.log_file import (
     split_attacks,
 )
 from webnorm_gpt.file_types.proj_desc_file import ProjDescFile
-from webnorm_gpt.gen_inv.base import Invariant
-from webnorm_gpt.gen_inv.check_inv import run_py_predicate_new_json_format
-from webnorm_gpt.schema_induction.db import DbDump, DbSchema, db_merge_logs_and_db
-from webnorm_gpt.schema_induction.expansion import DbExpander
+from webnorm_gpt.gen_inv.base import Invariant, RelatedFields
+from webnorm_gpt.gen_inv.check_inv import PredicateLimits, PredicateVerdicts
+from webnorm_gpt.gen_inv.eval_engine import InvariantEvaluator
+from webnorm_gpt.gen_inv.inv_set import InvariantSet, load_invariants_file
+from webnorm_gpt.gen_inv.predicate_cache import predicate_cache_path
+from webnorm_gpt.gen_inv.profiler import InvariantProfiler
+from webnorm_gpt.gen_inv.results_store import (
+    ResultsStore,
+    files_digest,
+    invariant_digest,
+    shard_digest,
+)
+from webnorm_gpt.gen_inv.verdict_cache import VerdictCache
 from webnorm_gpt.schema_induction.from_db import dump_tables_with_schema
-from webnorm_gpt.schema_induction.from_log import dump_log_with_schema
-from webnorm_gpt.schema_induction.join_all import join_all
-
-
-def load_log_file(logs: LogFile, schema: DbSchema) -> DbDump:
-    for log in logs.log_items:
-        compute_context_train_ticket_log(log)
-
-    db = dump_log_with_schema(logs, schema)
-
-    expander = DbExpander()
-    for table in db.tables:
-        expander.expand_table(table)
+from webnorm_gpt.schema_induction.prepared_check import PreparedCheck
+
+# worker processes evaluating predicates, 0 evaluates them in this process
+NUM_EVAL_WORKERS = 8
+PREDICATE_LIMITS = PredicateLimits(cpu_time=2.0, memory=2 << 30, max_overruns=3)
+# verdicts of predicates on payloads, reused by reruns; None to disable
+VERDICT_CACHE_PATH = "../find-bug-dump/verdict-cache.sqlite"
+# failures of invariants per checked window, a rerun only evaluates new
+# invariants and windows; None to check everything from scratch
+RESULTS_STORE_PATH = "../find-bug-dump/results-store.sqlite"
+# invariant files checked together, name -> path relative to this folder, e.g.
+# {"gpt-4o": "../exp-results/train-ticket/gpt-4o/ivn_gen_output.jsonl", ...};
+# all sets are joined and evaluated in one pass and reported side by side.
+# None checks ivn_gen_output.jsonl alone
+INVARIANT_SETS: dict[str, str] | None = None
+# what an attack on an api without invariants is dumped with
+ATTACK_DUMP_FIELDS = RelatedFields(include_arguments=True)
+
+
+def evaluate_logs(
+    logs: dict[str, LogFile],
+    evaluator: InvariantEvaluator,
+    only: typing.Callable[[str, int], frozenset[int] | None] = lambda api, row: None,
+) -> dict[tuple[int, str, int], tuple[str, str | None]]:
+    # verdict of every invariant on every log of its api, keyed by
+    # (invariant index, api, log index in logs[api]); `only(api, row)` limits
+    # which invariants are evaluated on a log, None for all of them
+    log_keys = []
+    tasks_by_only: dict[frozenset[int] | None, list] = defaultdict(list)
+    for api in evaluator.inv_set:
+        log_target = logs.get(api, None)
+        if log_target is None:
+            continue
+        for row, log_item in enumerate(log_target.log_items):
+            assert log_item.api == api
+            tasks_by_only[only(api, row)].append((len(log_keys), log_item))
+            log_keys.append((api, row))
 
-    return db
+    verdicts = {}
+    for inv_ids, tasks in tasks_by_only.items():
+        for inv_id, log_idx, verdict, err in evaluator.evaluate(tasks, inv_ids):
+            api, row = log_keys[log_idx]
+            verdicts[inv_id, api, row] = (verdict, err)
+    return verdicts
 
 
 def check_inv_in(
     log_file: LogFile,
-    db_dump: DbDump,
-    log_schema: DbSchema,
-    foreign_key_results,
-    dataflow_map,
+    prepare: typing.Callable[[], PreparedCheck],
     invariants,
     attack_file_name: str,
-    binlog_file,
+    evaluator: InvariantEvaluator | None = None,
+    store: ResultsStore | None = None,
+    context: bytes = b"",
 ) -> bool:
-    cur_path = os.path.dirname(os.path.abspath(__file__))
-
-    output_file_idx = 0
+    return check_inv_in_batch(
+        [log_file],
+        prepare,
+        invariants,
+        [attack_file_name],
+        evaluator,
+        store,
+        context,
+    )[0]
 
-    # logger.info("Loading log file...")
-    log_db = load_log_file(log_file, log_schema)
 
-    # logger.info("Merging log and db...")
-    db = db_merge_logs_and_db(log_db, db_dump)
+def check_inv_in_batch(
+    log_files: list[LogFile],
+    prepare: typing.Callable[[], PreparedCheck],
+    invariants,
+    attack_file_names: list[str],
+    evaluator: InvariantEvaluator | None = None,
+    store: ResultsStore | None = None,
+    context: bytes = b"",
+) -> list[bool]:
+    failing = find_failing_invariants(
+        log_files, prepare, invariants, attack_file_names, evaluator, store, context
+    )
+    return [len(inv_ids) > 0 for inv_ids in failing]
 
-    # logger.info("Do join all...")
-    logs, _ = join_all(db, foreign_key_results, dataflow_map, binlog_file)
 
-    detected = False
+def find_failing_invariants(
+    log_files: list[LogFile],
+    prepare: typing.Callable[[], PreparedCheck],
+    invariants,
+    attack_file_names: list[str],
+    evaluator: InvariantEvaluator | None = None,
+    store: ResultsStore | None = None,
+    context: bytes = b"",
+) -> list[set[int]]:
+    # the invariants failing on some log of each window
+    #
+    # all windows are joined and checked in one pass, dumps are numbered per
+    # window exactly as if each window was checked on its own
+    #
+    # With a `store`, only the (invariant, window) pairs it has no results
+    # for are evaluated, windows it has all results for are not even joined
+    # (and their dumps are left as the run which checked them wrote them).
+    # `context` is a digest of everything besides the logs the joins read.
+    if evaluator is None:
+        evaluator = InvariantEvaluator(invariants)
+
+    all_inv_ids = frozenset(range(len(invariants)))
+    # invariants to evaluate per window, None for all of them
+    missing: list[frozenset[int] | None] = [None] * len(log_files)
+    stored: list[dict[int, list]] = [{} for _ in log_files]
+    if store is not None:
+        inv_digests = [invariant_digest(inv) for inv in invariants]
+        shard_digests = [shard_digest(log_file, context) for log_file in log_files]
+        for window, digest in enumerate(shard_digests):
+            results = store.get_shard(digest)
+            for inv_id, inv_digest in enumerate(inv_digests):
+                if inv_digest in results:
+                    stored[window][inv_id] = results[inv_digest]
+            window_missing = all_inv_ids - frozenset(stored[window])
+            missing[window] = (
+                window_missing if len(window_missing) < len(all_inv_ids) else None
+            )
 
-    os.makedirs(
-        os.path.join(
-            cur_path,
-            f"../find-bug-dump/{attack_file_name}/",
-        ),
-        exist_ok=True,
+    def to_evaluate(window: int) -> frozenset[int]:
+        window_missing = missing[window]
+        return window_missing if window_missing is not None else all_inv_ids
+
+    work = [window for window in range(len(log_files)) if len(to_evaluate(window)) > 0]
+    failing = [
+        {inv_id for inv_id, failures in stored[window].items() if len(failures) > 0}
+        for window in range(len(log_files))
+    ]
+    if len(work) == 0:
+        return failing
+
+    if len(work) > 1 and not prepare().can_batch:
+        for window in work:
+            failing[window] = find_failing_invariants(
+                [log_files[window]],
+                prepare,
+                invariants,
+                [attack_file_names[window]],
+                evaluator,
+                store,
+                context,
+            )[0]
+        return failing
+
+    logs, work_windows = prepare().join_logs([log_files[window] for window in work])
+    windows = {api: [work[w] for w in ws] for api, ws in work_windows.items()}
+
+    # rows of every api in every window, a stored position is an index in it
+    window_rows: dict[tuple[str, int], list[int]] = defaultdict(list)
+    for api, ws in windows.items():
+        for row, window in enumerate(ws):
+            window_rows[api, window].append(row)
+
+    verdicts = evaluate_logs(
+        logs, evaluator, lambda api, row: missing[windows[api][row]]
     )
 
-    processed_apis = set()
-
-    for inv in invariants:
-        api = inv.domain[0].api
-        processed_apis.add(api)
-
-        log_target: LogFile = logs.get(api, None)  # type: ignore
-        if log_target is None:
-            continue
+    for window in work:
+        for inv_id, failures in stored[window].items():
+            api = invariants[inv_id].domain[0].api
+            for row in window_rows[api, window]:
+                verdicts[inv_id, api, row] = (PredicateVerdicts.Pass, None)
+            for api, pos, err in failures:
+                verdicts[inv_id, api, window_rows[api, window][pos]] = (
+                    PredicateVerdicts.Fail,
+                    err,
+                )
 
-        for log_item in log_target.log_items:
-            assert log_item.api == api
+    if store is not None:
+        results = []
+        for window in work:
+            for inv_id in to_evaluate(window):
+                api = invariants[inv_id].domain[0].api
+                failures = []
+                conclusive = True
+                for pos, row in enumerate(window_rows[api, window]):
+                    verdict, err = verdicts.get(
+                        (inv_id, api, row), (PredicateVerdicts.Pass, None)
+                    )
+                    if verdict == PredicateVerdicts.Fail:
+                        failures.append((api, pos, err))
+                    elif verdict != PredicateVerdicts.Pass:
+                        conclusive = False
+                if conclusive:
+                    results.append(
+                        (inv_digests[inv_id], shard_digests[window], failures)
+                    )
+        store.put_many(results)
 
-            is_atack = False
+    cur_path = os.path.dirname(os.path.abspath(__file__))
 
-            headers = log_item.headers
-            attack_name = None
-            if "x-att-int" in headers:
-                if "x-att-file" in headers:
-                    attack_name = headers["x-att-file"]
-                else:
-                    attack_name = headers["x-att-name"]
-                # print(f"ATTACK: {api} {attack_name}")
-                # print(f"Arguments: {log_item.arguments}")
-                is_atack = True
+    output_file_idx = [0] * len(log_files)
 
-            check_res, e = run_py_predicate_new_json_format(
-                inv.predicate, [log_item], [inv.domain[0].related_fields]  # type: ignore
-            )
+    for attack_file_name in attack_file_names:
+        os.makedirs(
+            os.path.join(
+                cur_path,
+                f"../find-bug-dump/{attack_file_name}/",
+            ),
+            exist_ok=True,
+        )
 
-            if not check_res:
-                detected = True
-                os.makedirs(
-                    os.path.join(
-                        cur_path,
-                        f"../find-bug-dump/{attack_file_name}/detected",
-                    ),
-                    exist_ok=True,
-                )
+    def dump(
+        window, log_item, related_fields, inv_code, attack_name, is_atack, check_res, e
+    ):
+        attack_file_name = attack_file_names[window]
+        dump_file_name = f"{output_file_idx[window]:04d}.md"
+        output_file_idx[window] += 1
+        dump_file_path = os.path.join(
+            os.path.dirname(__file__),
+            f"../find-bug-dump/{attack_file_name}/",
+            dump_file_name,
+        )
 
-            if (
-                not check_res
-                or is_atack
-                or (not check_res and attack_file_name == "NORMAL")
-            ):
-                dump_file_name = f"{output_file_idx:04d}.md"
-                output_file_idx += 1
-                dump_file_path = os.path.join(
-                    os.path.dirname(__file__),
-                    f"../find-bug-dump/{attack_file_name}/",
-                    dump_file_name,
-                )
+        os.makedirs(os.path.dirname(dump_file_path), exist_ok=True)
+
+        arguments = json.dumps(log_item.to_execute_json(related_fields), indent=4)
+        out_txt = DUMP_TEMPLATE.format(
+            api=log_item.api,
+            arguments=arguments,
+            inv=inv_code,
+            attack_name=attack_name,
+            is_attack=is_atack,
+            detected=not check_res,
+            err=e,
+        )
 
-                os.makedirs(os.path.dirname(dump_file_path), exist_ok=True)
+        with open(dump_file_path, "wt") as f:
+            f.write(out_txt)
 
-                api = log_item.api
-                arguments = json.dumps(
-                    log_item.to_execute_json(inv.domain[0].related_fields), indent=4  # type: ignore
-                )
-                inv_code = inv.predicate.py_code
-                out_txt = DUMP_TEMPLATE.format(
-                    api=api,
-                    arguments=arguments,
-                    inv=inv_code,
-                    attack_name=attack_name,
-                    is_attack=is_atack,
-                    detected=not check_res,
-                    err=e,
-                )
+    for api, log_target in logs.items():
+        entries = evaluator.inv_set.get(api, [])
 
-                with open(dump_file_path, "wt") as f:
-                    f.write(out_txt)
+        for row, (log_item, window) in enumerate(
+            zip(log_target.log_items, windows[api])
+        ):
+            assert log_item.api == api
+            attack_file_name = attack_file_names[window]
 
-    for api, log_target in logs.items():
-        if api in processed_apis:
-            continue
-        for log_item in log_target.log_items:
             is_atack = False
 
             headers = log_item.headers
@@ -162,40 +283,51 @@ def check_inv_in(
                     attack_name = headers["x-att-file"]
                 else:
                     attack_name = headers["x-att-name"]
-                # print(f"ATTACK: {api} {attack_name}")
-                # print(f"Arguments: {log_item.arguments}")
                 is_atack = True
 
-            if is_atack:
-                dump_file_name = f"{output_file_idx:04d}.md"
-                output_file_idx += 1
-                dump_file_path = os.path.join(
-                    os.path.dirname(__file__),
-                    f"../find-bug-dump/{attack_file_name}/",
-                    dump_file_name,
-                )
-
-                os.makedirs(os.path.dirname(dump_file_path), exist_ok=True)
-
-                api = log_item.api
-                arguments = json.dumps(
-                    log_item.to_execute_json(inv.domain[0].related_fields), indent=4  # type: ignore
-                )
-                inv_code = ""
-                out_txt = DUMP_TEMPLATE.format(
-                    api=api,
-                    arguments=arguments,
-                    inv=inv_code,
-                    attack_name=attack_name,
-                    is_attack=is_atack,
-                    detected=False,
-                    err=None,
-                )
-
-                with open(dump_file_path, "wt") as f:
-                    f.write(out_txt)
-
-    return detected
+            if len(entries) == 0:
+                # no invariant covers this api, still record the attack
+                if is_atack:
+                    dump(
+                        window,
+                        log_item,
+                        ATTACK_DUMP_FIELDS,
+                        "",
+                        attack_name,
+                        is_atack,
+                        True,
+                        None,
+                    )
+                continue
+
+            for entry in entries:
+                verdict, e = verdicts[entry.inv_id, api, row]
+                # a predicate that overran its budget did not find a violation
+                check_res = verdict != PredicateVerdicts.Fail
+
+                if not check_res:
+                    failing[window].add(entry.inv_id)
+                    os.makedirs(
+                        os.path.join(
+                            cur_path,
+                            f"../find-bug-dump/{attack_file_name}/detected",
+                        ),
+                        exist_ok=True,
+                    )
+
+                if not check_res or is_atack:
+                    dump(
+                        window,
+                        log_item,
+                        entry.related_fields,
+                        entry.invariant.predicate.py_code,
+                        attack_name,
+                        is_atack,
+                        check_res,
+                        e,
+                    )
+
+    return failing
 
 
 DUMP_TEMPLATE = """
@@ -246,21 +378,34 @@ def load_dataflow_map():
     return results
 
 
-def load_invariants():
-    inv_path = os.path.join(
+def get_inv_path():
+    return os.path.join(
         os.path.dirname(os.path.abspath(__file__)),
         "ivn_gen_output.jsonl",
     )
 
-    invariants: list[Invariant] = []
-    with open(inv_path, "rt") as f:
-        for line in f:
-            inv = json.loads(line)
-            i = Invariant()
-            i.load_from_json(inv)
-            invariants.append(i)
 
-    return invariants
+def load_invariants():
+    return load_invariants_file(get_inv_path())
+
+
+def load_invariant_sets(
+    inv_paths: dict[str, str],
+) -> tuple[list[Invariant], dict[str, list[int]]]:
+    # the invariants of all sets, an invariant in several sets only once, and
+    # the indexes of every set's invariants among them
+    invariants: list[Invariant] = []
+    members: dict[str, list[int]] = {}
+    inv_ids: dict[bytes, int] = {}
+    for name, inv_path in inv_paths.items():
+        members[name] = []
+        for inv in load_invariants_file(inv_path):
+            digest = invariant_digest(inv)
+            if digest not in inv_ids:
+                inv_ids[digest] = len(invariants)
+                invariants.append(inv)
+            members[name].append(inv_ids[digest])
+    return invariants, members
 
 
 def get_splitted_attacks() -> list[LogFile]:
@@ -300,19 +445,6 @@ def get_splitted_attacks() -> list[LogFile]:
 def main():
     cur_path = os.path.dirname(os.path.abspath(__file__))
 
-    logger.info("Loading db and schemas...")
-    with zstandard.open(os.path.join(cur_path, "db_and_schemas.pickle.zst"), "rb") as f:
-        _, db_schema, log_schema, db_binlogs = pickle.load(f)
-
-    with zstandard.open(
-        os.path.join(cur_path, "current_db_and_schemas.pkl.zst"), "rb"
-    ) as f:
-        db_dump, _, table_keys = pickle.load(f)
-
-    expander = DbExpander()
-    for table in db_dump.tables:
-        expander.expand_table(table)
-
     logger.info("Loading training data...")
     training = os.path.join(
         os.path.dirname(os.path.abspath(__file__)),
@@ -321,74 +453,153 @@ def main():
     with zstandard.open(training, "rb") as f:
         training_logs = pickle.load(f)
 
-    logger.info("Loading foreign keys...")
-    with zstandard.open(
+    if INVARIANT_SETS is not None:
+        inv_paths = {
+            name: os.path.join(cur_path, path) for name, path in INVARIANT_SETS.items()
+        }
+    else:
+        inv_paths = {"ivn_gen_output": get_inv_path()}
+    logger.info("Loading invariants...")
+    invariants, members = load_invariant_sets(inv_paths)
+    logger.info("Loaded %d invariants of %d sets", len(invariants), len(inv_paths))
+
+    db_files = [
+        os.path.join(cur_path, "db_and_schemas.pickle.zst"),
+        os.path.join(cur_path, "current_db_and_schemas.pkl.zst"),
+        os.path.join(cur_path, "sql-foreign-keys.json.zst"),
         os.path.join(
-            os.path.dirname(os.path.abspath(__file__)),
-            "sql-foreign-keys.json.zst",
+            cur_path, "../generated/hmm_deduction_result_pred_filtered.json.zst"
         ),
-        "rt",
-    ) as f:
-        foreign_key_results = json.load(f)
+    ]
+
+    # the db side is only loaded when some window has to be joined
+    @functools.cache
+    def prepare() -> PreparedCheck:
+        logger.info("Loading db and schemas...")
+        with zstandard.open(db_files[0], "rb") as f:
+            _, db_schema, log_schema, db_binlogs = pickle.load(f)
+
+        with zstandard.open(db_files[1], "rb") as f:
+            db_dump, _, table_keys = pickle.load(f)
+
+        logger.info("Loading foreign keys...")
+        with zstandard.open(db_files[2], "rt") as f:
+            foreign_key_results = json.load(f)
+
+        logger.info("Loading dataflow map...")
+        dataflow_map = load_dataflow_map()
+
+        logger.info("Preparing db side...")
+        return PreparedCheck(
+            db_dump,
+            log_schema,
+            foreign_key_results,
+            dataflow_map,
+            db_binlogs,
+            InvariantSet(invariants).reached_joins_by_api(),
+        )
 
-    logger.info("Loading dataflow map...")
-    dataflow_map = load_dataflow_map()
-    logger.info("Loading invariants...")
-    invariants = load_invariants()
-
-    logger.info("Detecting invariants in training data...")
-    detected = check_inv_in(
-        training_logs,
-        db_dump,
-        log_schema,
-        foreign_key_results,
-        dataflow_map,
+    store = None
+    context = b""
+    if RESULTS_STORE_PATH is not None:
+        store_path = os.path.join(cur_path, RESULTS_STORE_PATH)
+        os.makedirs(os.path.dirname(store_path), exist_ok=True)
+        store = ResultsStore(store_path)
+        context = files_digest(db_files)
+
+    verdict_cache = None
+    if VERDICT_CACHE_PATH is not None:
+        verdict_cache_path = os.path.join(cur_path, VERDICT_CACHE_PATH)
+        os.makedirs(os.path.dirname(verdict_cache_path), exist_ok=True)
+        verdict_cache = VerdictCache(verdict_cache_path)
+
+    with InvariantProfiler() as profiler, InvariantEvaluator(
         invariants,
-        "NONE",
-        db_binlogs,
-    )
-
-    if detected:
-        raise Exception("Invariant detected in training data")
-
-    attack_data = get_splitted_attacks()
+        NUM_EVAL_WORKERS,
+        limits=PREDICATE_LIMITS,
+        verdict_cache=verdict_cache,
+        predicate_cache_paths=[predicate_cache_path(p) for p in inv_paths.values()],
+    ) as evaluator:
+        profiler.register_invariants(invariants)
+
+        logger.info("Detecting invariants in training data...")
+        training_failing = find_failing_invariants(
+            [training_logs], prepare, invariants, ["NONE"], evaluator, store, context
+        )[0]
+
+        if len(inv_paths) == 1 and len(training_failing) > 0:
+            raise Exception("Invariant detected in training data")
+        for name, inv_ids in members.items():
+            if not training_failing.isdisjoint(inv_ids):
+                logger.error("Invariant set %s is violated by training data", name)
+
+        attack_data = get_splitted_attacks()
+
+        logger.info("Checking %d attack windows...", len(attack_data))
+        window_failing = find_failing_invariants(
+            attack_data,
+            prepare,
+            invariants,
+            [f"attack-{i:04d}" for i in range(len(attack_data))],
+            evaluator,
+            store,
+            context,
+        )
 
-    detected_num = 0
-    total_num = 0
+        for inv_id in evaluator.flagged():
+            logger.warning(
+                "Invariant %d of %s overran its budget %d times:\n%s",
+                inv_id,
+                invariants[inv_id].domain[0].api,
+                evaluator.overruns[inv_id],
+                invariants[inv_id].predicate.py_code,
+            )
 
-    t = tqdm.tqdm(attack_data, desc="0/0")
-    detected = set()
+    if store is not None:
+        store.close()
+
+    if verdict_cache is not None:
+        verdict_cache.close()
+        logger.info("Verdict cache: %s", json.dumps(verdict_cache.stats.to_json()))
+
+    profiler.save(os.path.join(cur_path, "../find-bug-dump/invariant-profile"))
+    logger.info("Slowest invariants:\n%s", profiler.text_report(top=20))
+
+    report = {}
+    for name, inv_ids in members.items():
+        inv_ids = set(inv_ids)
+        detected = [
+            i
+            for i, failing in enumerate(window_failing)
+            if not failing.isdisjoint(inv_ids)
+        ]
+        undetected = sorted(set(range(len(attack_data))) - set(detected))
+        recall = len(detected) / len(attack_data)
+        report[name] = {
+            "invariants": len(inv_ids),
+            "violated_by_training": not training_failing.isdisjoint(inv_ids),
+            "detected": detected,
+            "undetected": undetected,
+            "recall": recall,
+        }
+
+        logger.info(f"[{name}] Detected: {len(detected)}/{len(attack_data)}")
+        logger.info(f"[{name}] Recall: {recall:.03f}")
+        logger.info(f"[{name}] All detected: {detected}")
+        logger.info(f"[{name}] All undeteced: {undetected}")
+
+    table = ["| Set | Invariants | Training FP | Detected | Recall |"]
+    table.append("| --- | --- | --- | --- | --- |")
+    for name, r in report.items():
+        table.append(
+            f"| {name} | {r['invariants']} | {r['violated_by_training']} "
+            f"| {len(r['detected'])}/{len(attack_data)} | {r['recall']:.03f} |"
+        )
+    logger.info("Recall per invariant set:\n%s", "\n".join(table))
 
-    for i, file in enumerate(t):
-        try:
-            d = check_inv_in(
-                file,
-                db_dump,
-                log_schema,
-                foreign_key_results,
-                dataflow_map,
-                invariants,
-                f"attack-{i:04d}",
-                db_binlogs,
-            )
-        except Exception as e:
-            raise
-            d = False
-        if d:
-            detected_num += 1
-            detected.add(i)
-        total_num += 1
-
-        t.set_description(f"{detected_num}/{total_num} {detected_num/total_num:.03f}")
-
-    logger.info(f"Detected: {detected_num}/{total_num}")
-    logger.info(f"Recall: {detected_num/total_num:.03f}")
-
-    detected = sorted(detected)
-    logger.info(f"All detected: {detected}")
-    undeteced = set(range(len(attack_data))) - set(detected)
-    undeteced = sorted(undeteced)
-    logger.info(f"All undeteced: {undeteced}")
+    report_path = os.path.join(cur_path, "../find-bug-dump/recall-report.json")
+    with open(report_path, "wt") as f:
+        json.dump(report, f, indent=2)
 
 
 if __name__ == "__main__":
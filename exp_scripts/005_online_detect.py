@@ -0,0 +1,136 @@
+import json
+import os
+import pickle
+import sys
+from collections import defaultdict
+
+import zstandard
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+
+from webnorm_gpt import logger
+from webnorm_gpt.file_types.proj_desc_file import ProjDescFile
+from webnorm_gpt.gen_inv.check_inv import PredicateLimits
+from webnorm_gpt.online.detector import Detection, OnlineConfig, OnlineDetector
+from webnorm_gpt.online.sources import SocketLineSource, follow_file
+
+# events are read from a local socket when LISTEN_PORT is set, otherwise
+# LOG_TAIL_PATH is followed like `tail -F`
+LISTEN_PORT = None
+LOG_TAIL_PATH = "../traffic-new-collect/live/logs.jsonl"
+# worker processes evaluating predicates, 0 keeps latency lowest for the
+# small batches of live traffic
+NUM_EVAL_WORKERS = 0
+PREDICATE_LIMITS = PredicateLimits(cpu_time=2.0, memory=None, max_overruns=3)
+ONLINE_CONFIG = OnlineConfig()
+
+
+def load_dataflow_map():
+    cur_path = os.path.abspath(os.path.dirname(__file__))
+    with zstandard.open(
+        os.path.join(
+            cur_path, "../generated/hmm_deduction_result_pred_filtered.json.zst"
+        ),
+        "rt",
+    ) as f:
+        hmm_deduction_result_pred_filtered = json.load(f)
+
+    results = defaultdict(list)
+
+    for k, v in hmm_deduction_result_pred_filtered.items():
+        for t in v:
+            if t != k:
+                results[k].append(t)
+
+    return results
+
+
+def main():
+    cur_path = os.path.dirname(os.path.abspath(__file__))
+
+    logger.info("Loading db and schemas...")
+    with zstandard.open(os.path.join(cur_path, "db_and_schemas.pickle.zst"), "rb") as f:
+        _, _, log_schema, db_binlogs = pickle.load(f)
+
+    with zstandard.open(
+        os.path.join(cur_path, "current_db_and_schemas.pkl.zst"), "rb"
+    ) as f:
+        db_dump, _, _ = pickle.load(f)
+
+    logger.info("Loading foreign keys...")
+    with zstandard.open(
+        os.path.join(cur_path, "sql-foreign-keys.json.zst"),
+        "rt",
+    ) as f:
+        foreign_key_results = json.load(f)
+
+    proj_desc_file = ProjDescFile()
+    proj_desc_file.load_from_file_path(
+        os.path.join(cur_path, "../generated/train-ticket-projdesc.json.zst")
+    )
+
+    dump_path = os.path.join(cur_path, "../find-bug-dump/online-detections.jsonl")
+    os.makedirs(os.path.dirname(dump_path), exist_ok=True)
+    dump_file = open(dump_path, "at")
+
+    def on_detection(detection: Detection):
+        logger.warning(
+            "Invariant %d violated by %s at %s (%.1f ms)",
+            detection.inv_id,
+            detection.log_item.api,
+            detection.log_item.time,
+            detection.latency * 1000,
+        )
+        dump_file.write(
+            json.dumps(
+                {
+                    "inv_id": detection.inv_id,
+                    "api": detection.log_item.api,
+                    "time": detection.log_item.time,
+                    "latency_ms": detection.latency * 1000,
+                    "inv": detection.invariant.predicate.py_code,
+                    "err": detection.err,
+                    "log": json.loads(str(detection.log_item)),
+                }
+            )
+            + "\n"
+        )
+        dump_file.flush()
+
+    logger.info("Preparing detector...")
+    detector = OnlineDetector(
+        proj_desc_file,
+        os.path.join(cur_path, "ivn_gen_output.jsonl"),
+        db_dump,
+        log_schema,
+        foreign_key_results,
+        load_dataflow_map(),
+        db_binlogs,
+        config=ONLINE_CONFIG,
+        limits=PREDICATE_LIMITS,
+        num_workers=NUM_EVAL_WORKERS,
+        on_detection=on_detection,
+    )
+
+    with detector:
+        try:
+            if LISTEN_PORT is not None:
+                with SocketLineSource(port=LISTEN_PORT) as source:
+                    logger.info("Listening on %s:%d", *source.address)
+                    for _ in detector.run(source):
+                        pass
+            else:
+                tail_path = os.path.join(cur_path, LOG_TAIL_PATH)
+                logger.info("Following %s", tail_path)
+                for _ in detector.run(follow_file(tail_path)):
+                    pass
+        except KeyboardInterrupt:
+            logger.info("Stopping")
+
+    dump_file.close()
+    logger.info("Online detector: %s", json.dumps(detector.metrics.to_json()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+import hashlib
+import multiprocessing
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+
+from webnorm_gpt.gpt_cache import GPTCache
+
+# concurrent worker processes each run is measured with
+NUM_WORKERS_LIST = [8, 16, 32]
+# responses in the cache file before the run
+NUM_ENTRIES = 5000
+PROMPT_LENGTH = 4000
+RESPONSE_LENGTH = 1000
+# lookups per worker, of which this share misses and is put afterwards, like
+# an invoker asking GPT and caching the answer
+LOOKUPS_PER_WORKER = 4000
+MISS_RATIO = 0.02
+# lookups go to the first HOT_ENTRIES entries this often, the rest anywhere
+HOT_ENTRIES = 500
+HOT_RATIO = 0.8
+# "legacy" is the former invoker cache: one connection shared over the fork,
+# rollback journal, a commit after every insert and usage row
+MODES = ["legacy", "no-memory", "memory"]
+
+_cache: GPTCache | None = None
+_legacy_db: sqlite3.Connection | None = None
+_mode: str | None = None
+
+
+def make_entry(i: int) -> tuple[str, str, str]:
+    prompt = f"prompt {i} " + "x" * PROMPT_LENGTH
+    digest = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+    return digest, prompt, "r" * RESPONSE_LENGTH
+
+
+def fill(path: str, legacy: bool):
+    if not legacy:
+        with GPTCache(path, commit_batch=NUM_ENTRIES + 1) as cache:
+            for i in range(NUM_ENTRIES):
+                cache.put(*make_entry(i))
+        return
+
+    db = sqlite3.connect(path)
+    cursor = db.cursor()
+    cursor.execute(
+        "CREATE TABLE IF NOT EXISTS gpt_cache (cache_id PRIMARY KEY, cache_digest TEXT, cache_prompt TEXT, cache_response TEXT)"
+    )
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS cache_digest_index ON gpt_cache (cache_digest)"
+    )
+    cursor.execute(
+        "CREATE TABLE IF NOT EXISTS gpt_usage (input_tokens INT, output_tokens INT, timestamp TEXT, model TEXT)"
+    )
+    cursor.executemany(
+        "INSERT INTO gpt_cache (cache_digest, cache_prompt, cache_response) VALUES (?, ?, ?)",
+        (make_entry(i) for i in range(NUM_ENTRIES)),
+    )
+    db.commit()
+    db.close()
+
+
+def legacy_get(digest: str, prompt: str) -> str | None:
+    assert _legacy_db is not None
+    cursor = _legacy_db.cursor()
+    cursor.execute(
+        "SELECT cache_prompt, cache_response FROM gpt_cache WHERE cache_digest = ? ",
+        (digest,),
+    )
+    row = cursor.fetchone()
+    return row[1] if row and row[0] == prompt else None
+
+
+def legacy_put(digest: str, prompt: str, response: str):
+    assert _legacy_db is not None
+    cursor = _legacy_db.cursor()
+    cursor.execute(
+        "INSERT INTO gpt_cache (cache_digest, cache_prompt, cache_response) VALUES (?, ?, ?)",
+        (digest, prompt, response),
+    )
+    _legacy_db.commit()
+    cursor.execute(
+        "INSERT INTO gpt_usage (input_tokens, output_tokens, timestamp, model) VALUES (?, ?, ?, ?)",
+        (len(prompt), len(response), "", "bench"),
+    )
+    _legacy_db.commit()
+
+
+def worker(worker_id: int) -> tuple[int, int, float]:
+    rng = random.Random(worker_id)
+    hits = 0
+    start = time.perf_counter()
+    for n in range(LOOKUPS_PER_WORKER):
+        if rng.random() < MISS_RATIO:
+            i = NUM_ENTRIES + worker_id * LOOKUPS_PER_WORKER + n
+        elif rng.random() < HOT_RATIO:
+            i = rng.randrange(HOT_ENTRIES)
+        else:
+            i = rng.randrange(NUM_ENTRIES)
+        digest, prompt, response = make_entry(i)
+        if _mode == "legacy":
+            if legacy_get(digest, prompt) is not None:
+                hits += 1
+            else:
+                legacy_put(digest, prompt, response)
+            continue
+        assert _cache is not None
+        if _cache.get(digest, prompt) is not None:
+            hits += 1
+        else:
+            _cache.put(digest, prompt, response)
+            _cache.add_usage(len(prompt), len(response), "", "bench")
+    if _cache is not None:
+        _cache.flush()
+    return LOOKUPS_PER_WORKER, hits, time.perf_counter() - start
+
+
+def run(mode: str, num_workers: int, folder: str) -> tuple[float, float]:
+    # aggregate lookups/sec over all workers, and the slowest worker's seconds
+    global _cache, _legacy_db, _mode
+    path = os.path.join(folder, f"{mode}-{num_workers}.sqlite")
+    fill(path, legacy=mode == "legacy")
+    _mode = mode
+    if mode == "legacy":
+        _legacy_db = sqlite3.connect(path, timeout=60)
+    else:
+        _cache = GPTCache(path, memory_entries=0 if mode == "no-memory" else 4096)
+
+    # workers inherit the cache over the fork, as the 003_inv_gen.py pool does
+    ctx = multiprocessing.get_context("fork")
+    start = time.perf_counter()
+    with ctx.Pool(num_workers) as pool:
+        results = pool.map(worker, range(num_workers), chunksize=1)
+    elapsed = time.perf_counter() - start
+
+    if _cache is not None:
+        _cache.close()
+    if _legacy_db is not None:
+        _legacy_db.close()
+    _cache, _legacy_db = None, None
+    lookups = sum(r[0] for r in results)
+    return lookups / elapsed, max(r[2] for r in results)
+
+
+def main():
+    print(f"{'mode':>10} {'workers':>8} {'lookups/s':>12} {'slowest (s)':>12}")
+    with tempfile.TemporaryDirectory() as folder:
+        for num_workers in NUM_WORKERS_LIST:
+            for mode in MODES:
+                rate, slowest = run(mode, num_workers, folder)
+                print(f"{mode:>10} {num_workers:>8} {rate:>12.0f} {slowest:>12.2f}")
+
+
+if __name__ == "__main__":
+    main()
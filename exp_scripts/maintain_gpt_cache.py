@@ -0,0 +1,31 @@
+import json
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+
+from webnorm_gpt import file_names
+from webnorm_gpt.gpt_cache import GPTCache, GPTCacheLimits
+from webnorm_gpt.gpt_invoker import default_gpt_cache_limits
+
+GPT_CACHE_PATH = file_names.gpt_cache_sqlite
+# "stats" only reports the size of the cache; "vacuum" also evicts entries
+# beyond LIMITS, retrains the compression dictionary and shrinks the file
+ACTION = "stats"
+# None for the gpt_cache_* limits of openai_config.yml
+LIMITS: GPTCacheLimits | None = None
+
+
+def main():
+    limits = LIMITS if LIMITS is not None else default_gpt_cache_limits()
+    with GPTCache(GPT_CACHE_PATH, limits=limits) as cache:
+        print(json.dumps(cache.storage_stats(), indent=2))
+        if ACTION == "vacuum":
+            cache.vacuum()
+            print(json.dumps(cache.storage_stats(), indent=2))
+            print(json.dumps(cache.stats.to_json()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+import datetime
+import decimal
+import random
+
+from webnorm_gpt.schema_induction.db import DbColumn, DbDump, DbTable
+from webnorm_gpt.sql.dump_all import (
+    infer_constraints,
+    infer_foreign_key,
+    infer_not_null,
+    infer_unique,
+    profile_dump,
+)
+
+
+# the set based implementation profile_dump replaced, as the reference
+def reference_not_null(dump: DbDump) -> list[tuple[str, str]]:
+    return [
+        (table.name, column.name)
+        for table in dump.tables
+        for column in table.columns
+        if None not in column.values
+    ]
+
+
+def reference_unique(dump: DbDump) -> list[tuple[str, str]]:
+    return [
+        (table.name, column.name)
+        for table in dump.tables
+        for column in table.columns
+        if len(set(column.values)) == len(column.values)
+    ]
+
+
+def reference_foreign_key(dump: DbDump) -> list[tuple[str, str, str, str]]:
+    columns = [
+        (table.name, column.name, {v for v in column.values if v is not None})
+        for table in dump.tables
+        for column in table.columns
+    ]
+    results = []
+    for i, (table_i, column_i, set_i) in enumerate(columns):
+        for j, (table_j, column_j, set_j) in enumerate(columns):
+            if i != j and len(set_i) > 0 and len(set_j) > 0 and set_i <= set_j:
+                results.append((table_i, column_i, table_j, column_j))
+    return results
+
+
+def random_value(rng: random.Random, kind: str):
+    if rng.random() < 0.1:
+        return None
+    n = rng.randrange(6)
+    match kind:
+        case "int":
+            return n
+        case "float":
+            return rng.choice([n, n + 0.5, 0.1])
+        case "decimal":
+            return rng.choice(
+                [decimal.Decimal(n), decimal.Decimal(f"{n}.00"), decimal.Decimal("0.1")]
+            )
+        case "bool":
+            return bool(n % 2)
+        case "str":
+            return rng.choice(["1", "a", "b", str(n)])
+        case "datetime":
+            return datetime.datetime(2024, 1, 1 + n)
+        case "aware":
+            return datetime.datetime(
+                2024, 1, 1 + n, tzinfo=datetime.timezone(datetime.timedelta(hours=n))
+            ) + datetime.timedelta(hours=n)
+        case "date":
+            return datetime.date(2024, 1, 1 + n)
+    raise ValueError(kind)
+
+
+def random_dump(seed: int) -> DbDump:
+    rng = random.Random(seed)
+    kinds = ["int", "float", "decimal", "bool", "str", "datetime", "aware", "date"]
+    tables = []
+    for t in range(3):
+        rows = rng.randrange(1, 12)
+        columns = []
+        for c in range(4):
+            kind = rng.choice(kinds)
+            values = [random_value(rng, kind) for _ in range(rows)]
+            columns.append(DbColumn(name=f"{kind}{c}", schema=None, values=values))
+        tables.append(DbTable(f"t{t}", columns, []))
+    return DbDump(tables)
+
+
+def test_matches_set_based_reference():
+    for seed in range(300):
+        dump = random_dump(seed)
+        expected = (
+            reference_not_null(dump),
+            reference_unique(dump),
+            reference_foreign_key(dump),
+        )
+        assert infer_constraints(dump) == expected, seed
+        assert infer_not_null(dump) == expected[0], seed
+        assert infer_unique(dump) == expected[1], seed
+        assert infer_foreign_key(dump) == expected[2], seed
+
+
+def test_decimal_and_int_columns_match():
+    ints = DbColumn(name="id", schema=None, values=[1, 2, 3])
+    decimals = DbColumn(
+        name="ref",
+        schema=None,
+        values=[decimal.Decimal("1.0"), decimal.Decimal("2.00"), None],
+    )
+    dump = DbDump([DbTable("a", [ints], []), DbTable("b", [decimals], [])])
+    assert infer_foreign_key(dump) == reference_foreign_key(dump)
+    assert ("b", "ref", "a", "id") in infer_foreign_key(dump)
+
+
+def test_spilled_runs_match_in_memory():
+    for seed in range(50):
+        dump = random_dump(seed)
+        assert profile_dump(dump, spill_threshold=2) == profile_dump(dump), seed
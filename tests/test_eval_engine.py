@@ -0,0 +1,54 @@
+from webnorm_gpt.file_types.log_file import LogItem
+from webnorm_gpt.gen_inv.base import (
+    APIDomain,
+    Invariant,
+    Predicate,
+    Premise,
+    RelatedFields,
+)
+from webnorm_gpt.gen_inv.eval_engine import InvariantEvaluator, project_log
+
+
+def invariant(py_code: str) -> Invariant:
+    related_fields = RelatedFields(include_arguments=True, include_response=True)
+    return Invariant.construct_from(
+        [APIDomain.construct_from("x", related_fields, "forall")],
+        Premise.construct_from("derive", "true"),
+        Predicate.construct_from_py_code("", py_code, 1),
+    )
+
+
+INVARIANTS = [
+    invariant("def check(d):\n    return len(str(d['arguments']['a'])) < 3\n"),
+    invariant("def check(d):\n    return str(d['response']['b']).isdigit()\n"),
+]
+
+
+def tasks() -> list[tuple[int, LogItem]]:
+    return [
+        (
+            i,
+            LogItem(
+                {
+                    "api": "x",
+                    "arguments": {"a": i, "unread": "u" * 1000},
+                    "response": {"b": "-1" if i % 7 == 0 else str(i)},
+                }
+            ),
+        )
+        for i in range(200)
+    ]
+
+
+def test_workers_get_only_the_read_fields():
+    evaluator = InvariantEvaluator(INVARIANTS)
+    projected = project_log(evaluator.inv_set, tasks()[0][1])
+    assert projected.projections == [{"arguments": {"a": 0}, "response": {"b": "-1"}}]
+
+
+def test_pool_matches_serial():
+    with InvariantEvaluator(INVARIANTS) as evaluator:
+        expected = sorted(evaluator.evaluate(tasks()))
+    with InvariantEvaluator(INVARIANTS, num_workers=2, chunk_size=16) as evaluator:
+        assert sorted(evaluator.evaluate(tasks())) == expected
+    assert len(expected) == 2 * len(tasks())
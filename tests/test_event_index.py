@@ -0,0 +1,84 @@
+import datetime
+import random
+
+from webnorm_gpt.file_types.log_file import LogFile, LogItem
+from webnorm_gpt.gen_inv.event_index import EventIndex
+
+START = datetime.datetime(2024, 1, 1)
+
+
+def log_file(events: list[tuple[str, int, str]]) -> LogFile:
+    # (api, seconds after START, user) per log, in log order
+    logs = LogFile()
+    logs.log_items = [
+        LogItem(
+            {
+                "api": api,
+                "time": (START + datetime.timedelta(seconds=seconds)).strftime(
+                    "%Y-%m-%d %H:%M:%S.%f"
+                ),
+                "headers": {"user": user},
+            }
+        )
+        for api, seconds, user in events
+    ]
+    return logs
+
+
+# the nearest event by a walk over every log
+def reference_nearest(events, api, t, direction, within, user=None) -> int:
+    candidates = [
+        (seconds, position)
+        for position, (event_api, seconds, event_user) in enumerate(events)
+        if event_api == api and (user is None or event_user == user)
+    ]
+    if direction == "before":
+        candidates = [c for c in candidates if c[0] <= t]
+        best = max(candidates, default=None)
+    else:
+        candidates = [c for c in candidates if c[0] >= t]
+        best = min(candidates, default=None)
+    if best is None or abs(t - best[0]) >= within:
+        return -1
+    return best[1]
+
+
+def test_nearest_matches_a_walk_on_unsorted_logs():
+    rng = random.Random(0)
+    events = [
+        (rng.choice(["a", "b"]), rng.randrange(0, 100), rng.choice(["u", "v"]))
+        for _ in range(60)
+    ]
+    index = EventIndex(log_file(events))
+    assert not index.time_sorted
+    t0 = START.timestamp()
+    for t in range(-5, 106):
+        for direction in ["before", "after"]:
+            for within in [1, 5, 10]:
+                assert index.nearest("a", t0 + t, direction, within) == (
+                    reference_nearest(events, "a", t, direction, within)
+                ), (t, direction, within)
+
+
+def test_nearest_window_edge_matches_nearest_related():
+    events = [("a", 0, "u"), ("b", 10, "u")]
+    index = EventIndex(log_file(events))
+    t = index.times[1]
+    assert index.nearest("a", t, "before", within=10) == -1
+    assert index.nearest_related(1, "a", "before", within=10) == -1
+    assert index.nearest("a", t, "before", within=11) == 0
+    assert index.nearest_related(1, "a", "before", within=11) == 0
+
+
+def test_session_key_restricts_to_one_session():
+    events = [("a", 0, "u"), ("a", 5, "v"), ("b", 6, "u"), ("a", 8, "v")]
+    index = EventIndex(
+        log_file(events), session_key=lambda log: log.content["headers"]["user"]
+    )
+    t = index.times[2]
+    assert index.nearest("a", t, "before") == 1
+    assert index.nearest("a", t, "before", session="u") == 0
+    assert index.nearest("a", t, "after", session="u") == -1
+    assert index.nearest_related(2, "a", "before") == 1
+    assert index.nearest_related(2, "a", "before", session="u") == 0
+    assert index.nearest_related(2, "a", "after", session="v") == 3
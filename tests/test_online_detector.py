@@ -0,0 +1,157 @@
+import json
+
+from webnorm_gpt.file_types.log_file import LogFile, LogItem
+from webnorm_gpt.online.detector import OnlineConfig, OnlineDetector
+from webnorm_gpt.schema_induction.db import DbColumn, DbDump, DbTable
+from webnorm_gpt.schema_induction.from_log import dump_log_dump_schema
+from webnorm_gpt.schema_induction.induction import JsonSchemaInducer
+
+
+class ApiDesc:
+    argument_names = ["orderId", "userId"]
+    extra: dict = {}
+
+
+class ProjDesc:
+    api_map = {"A": ApiDesc()}
+
+
+def db_table(name: str, rows: list[dict]) -> DbTable:
+    inducer = JsonSchemaInducer()
+    columns = []
+    for key in rows[0]:
+        values = [row[key] for row in rows]
+        schema = inducer.induce_json_schema(values)
+        columns.append(DbColumn(name=key, schema=schema, values=values))
+    return DbTable(name, columns, [])
+
+
+def invariant_json(py_code: str) -> dict:
+    related_fields = {
+        "include_arguments": True,
+        "include_response": False,
+        "include_headers": False,
+        "include_env": False,
+        "include_db_info": True,
+        "include_related_log": False,
+        "related_include_arguments": False,
+        "related_include_response": False,
+        "related_include_headers": False,
+        "related_include_env": False,
+    }
+    return {
+        "domain": [
+            {"api": "A", "related_fields": related_fields, "quantifier": "forall"}
+        ],
+        "premise": {"premise_position": "derive", "premise_type": "true"},
+        "predicate": {
+            "is_true_precisely": False,
+            "desc": "",
+            "py_code": py_code,
+            "num_args": 1,
+        },
+    }
+
+
+def make_detector(tmp_path, compute_context=lambda log: None) -> OnlineDetector:
+    sample = LogFile()
+    sample.log_items = [
+        LogItem(
+            {
+                "api": "A",
+                "time": "2024-01-01 00:00:00.000000",
+                "response_time": "2024-01-01 00:00:00.100000",
+                "arguments": {"orderId": 1, "userId": 7},
+                "headers": {},
+                "env": {},
+                "response": None,
+            }
+        )
+    ]
+    _, log_schema = dump_log_dump_schema(sample)
+    db_dump = DbDump(
+        [
+            db_table("orders", [{"id": 1, "price": 5}]),
+            db_table("users", [{"id": 7, "name": "u"}]),
+        ]
+    )
+    foreign_keys = [
+        ("log::A", "log_data.arguments.orderId", "db::orders", "id"),
+        ("log::A", "log_data.arguments.userId", "db::users", "id"),
+    ]
+    inv_path = tmp_path / "invariants.jsonl"
+    py_code = "def check(log: dict) -> bool:\n    return log['db_info']['orders']['price'] > 10\n"
+    inv_path.write_text(json.dumps(invariant_json(py_code)) + "\n")
+
+    return OnlineDetector(
+        ProjDesc(),
+        str(inv_path),
+        db_dump,
+        log_schema,
+        foreign_keys,
+        {"A": []},
+        config=OnlineConfig(batch_size=1),
+        compute_context=compute_context,
+    )
+
+
+def feed_request(detector: OnlineDetector, t: float) -> list:
+    enter = {
+        "methodName": "A",
+        "isEnter": True,
+        "time": t,
+        "arguments": ["1", "7"],
+        "headers": {},
+    }
+    exit_ = {
+        "methodName": "A",
+        "isEnter": False,
+        "time": t + 0.1,
+        "hasError": False,
+        "returnObj": "",
+    }
+    assert detector.feed(json.dumps(enter)) == []
+    return detector.feed(json.dumps(exit_))
+
+
+def test_online_joins_only_reached_tables(tmp_path):
+    detector = make_detector(tmp_path)
+    joined = []
+    join_logs = detector.prepared.join_logs
+
+    def spy(log_files):
+        result = join_logs(log_files)
+        joined.extend(result[0]["A"].log_items)
+        return result
+
+    detector.prepared.join_logs = spy
+    with detector:
+        detections = feed_request(detector, 1704067200.0)
+
+    assert [d.inv_id for d in detections] == [0]
+    assert len(joined) == 1
+    assert set(joined[0].content["related_db_tables"]) == {"orders"}
+
+
+def test_failures_are_counted_not_raised(tmp_path):
+    calls = []
+
+    def compute_context(log):
+        calls.append(log)
+        if len(calls) == 1:
+            raise ValueError("no context")
+
+    detector = make_detector(tmp_path, compute_context)
+    with detector:
+        assert feed_request(detector, 1704067200.0) == []
+        assert detector.metrics.bad_events == 1
+        assert detector.metrics.batches == 0
+
+        def broken_join(log_files):
+            raise RuntimeError("join failed")
+
+        detector.prepared.join_logs = broken_join
+        assert feed_request(detector, 1704067260.0) == []
+        assert detector.metrics.failed_batches == 1
+        assert detector.metrics.dropped_logs == 1
+        assert len(detector.batch) == 0
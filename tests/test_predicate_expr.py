@@ -0,0 +1,54 @@
+import math
+
+import numpy as np
+
+from webnorm_gpt.gen_inv.predicate_expr import (
+    ExprBatch,
+    PredicateExpr,
+    column_from_values,
+)
+from webnorm_gpt.schema_induction.column_store import pack_primitive
+
+COMPARE_OPS = ["==", "!=", "<", "<=", ">", ">="]
+
+
+# verdicts of `source` over int column arguments.a and float column
+# response.b, vectorized and row by row
+def both_paths(source: str, ints: list, floats: list) -> tuple[list, list]:
+    expr = PredicateExpr(source)
+    batch = ExprBatch([None] * len(ints), None)
+    batch.columns[("arguments", "a")] = column_from_values(
+        pack_primitive(ints, int, np.int64)
+    )
+    batch.columns[("response", "b")] = column_from_values(
+        pack_primitive(floats, float, np.float64)
+    )
+    vectorized = batch.holds(expr).tolist()
+    rows = [
+        expr.holds({"arguments": {"a": a}, "response": {"b": b}})
+        for a, b in zip(ints, floats)
+    ]
+    return vectorized, rows
+
+
+def test_int_float_comparison_is_exact():
+    ints = [10**18 + 1, 10**18, 2**63 - 1, -(2**63), 3, 3, 3, 0, 5, None, 7]
+    floats = [
+        1e18,
+        1e18,
+        2.0**63,
+        -(2.0**63),
+        3.5,
+        2.5,
+        3.0,
+        math.nan,
+        math.inf,
+        1.0,
+        None,
+    ]
+    for op in COMPARE_OPS:
+        for source in [f"arguments.a {op} response.b", f"response.b {op} arguments.a"]:
+            vectorized, rows = both_paths(source, ints, floats)
+            assert vectorized == rows, source
+    vectorized, _ = both_paths("arguments.a == response.b", ints, floats)
+    assert vectorized[:2] == [False, True]
@@ -79,6 +79,22 @@ class DbTableBinlog:
     columns: DbTableColumns
     binlog_items: dict[tuple, DbColumnChanges]
 
+    def add_change(
+        self,
+        time_change: int,
+        primary_key_tuple: tuple,
+        old_value: tuple | None,
+        new_value: tuple | None,
+    ):
+        # appends a change newer than every change recorded so far
+        changes = self.binlog_items.get(primary_key_tuple, None)
+        if changes is None:
+            changes = DbColumnChanges(changes=[(DB_TIMESTAMP_EARLIEST, old_value)])
+            self.binlog_items[primary_key_tuple] = changes
+        elif time_change < changes.changes[-1][0]:
+            raise ValueError(f"Time change order mismatch")
+        changes.changes.append((time_change, new_value))
+
 
 def dump_all_table_keys(conn, db_name: str):
     cursor = conn.cursor()
@@ -129,6 +145,80 @@ def timestamp_to_str(timestamp: int) -> str:
     return dt.isoformat()
 
 
+def binlog_row_change(
+    ty: str, row: dict, table_name: str, primary_keys: list[str], all_cols: list[str]
+) -> tuple[tuple, tuple | None, tuple | None]:
+    # (primary key, values before, values after) of one binlog row, None
+    # before an insert and after a delete
+    if ty == "update":
+        olddata = row["before_values"]
+        newdata = row["after_values"]
+
+        assert sorted(olddata.keys()) == sorted(newdata.keys())
+
+        if len(olddata) != len(all_cols):
+            raise ValueError(
+                f"Column count mismatch in table {table_name}: {olddata} vs {all_cols}"
+            )
+        if len(olddata) != len(newdata):
+            raise ValueError(
+                f"Column count mismatch in table {table_name}: {newdata} vs {all_cols}"
+            )
+
+        for key in olddata:
+            old = olddata[key]
+            new = newdata[key]
+            if key not in all_cols:
+                raise ValueError(f"Column {key} not found in table {table_name}")
+            if old != new:
+                if key in primary_keys:
+                    raise ValueError(f"Primary key {key} changed in table {table_name}")
+
+        primary_key_tuple = tuple(olddata[key] for key in primary_keys)
+        all_key_old_tuple = tuple(olddata[key] for key in all_cols)
+        all_key_new_tuple = tuple(newdata[key] for key in all_cols)
+    elif ty == "insert":
+        data = row["values"]
+        if len(data) != len(all_cols):
+            raise ValueError(
+                f"Column count mismatch in table {table_name}: {data} vs {all_cols}"
+            )
+        for key in data:
+            if key not in all_cols:
+                raise ValueError(f"Column {key} not found in table {table_name}")
+        primary_key_tuple = tuple(data[key] for key in primary_keys)
+        all_key_old_tuple = None
+        all_key_new_tuple = tuple(data[key] for key in all_cols)
+    elif ty == "delete":
+        data = row["values"]
+        if len(data) != len(all_cols):
+            raise ValueError(
+                f"Column count mismatch in table {table_name}: {data} vs {all_cols}"
+            )
+        for key in data:
+            if key not in all_cols:
+                raise ValueError(f"Column {key} not found in table {table_name}")
+        primary_key_tuple = tuple(data[key] for key in primary_keys)
+        all_key_old_tuple = tuple(data[key] for key in all_cols)
+        all_key_new_tuple = None
+    else:
+        raise ValueError(f"Unknown type {ty}")
+
+    if all_key_old_tuple is not None:
+        for val in all_key_old_tuple:
+            assert (
+                val == None
+                or isinstance(val, str)
+                or isinstance(val, int)
+                or isinstance(val, float)
+                or isinstance(val, bool)
+                or isinstance(val, bytes)
+                or isinstance(val, datetime)
+            )
+
+    return primary_key_tuple, all_key_old_tuple, all_key_new_tuple
+
+
 def process_binlog_file(
     all_info,
     binlog_file_path: str,
@@ -178,79 +268,9 @@ def process_binlog_file(
             time_change = item["timestamp"]
 
             for row in rows:
-                if ty == "update":
-                    olddata = row["before_values"]
-                    newdata = row["after_values"]
-
-                    assert sorted(olddata.keys()) == sorted(newdata.keys())
-
-                    if len(olddata) != len(all_cols):
-                        raise ValueError(
-                            f"Column count mismatch in table {table_name}: {olddata} vs {all_cols}"
-                        )
-                    if len(olddata) != len(newdata):
-                        raise ValueError(
-                            f"Column count mismatch in table {table_name}: {newdata} vs {all_cols}"
-                        )
-
-                    for key in olddata:
-                        old = olddata[key]
-                        new = newdata[key]
-                        if key not in all_cols:
-                            raise ValueError(
-                                f"Column {key} not found in table {table_name}"
-                            )
-                        if old != new:
-                            if key in primary_keys:
-                                raise ValueError(
-                                    f"Primary key {key} changed in table {table_name}"
-                                )
-
-                    primary_key_tuple = tuple(olddata[key] for key in primary_keys)
-                    all_key_old_tuple = tuple(olddata[key] for key in all_cols)
-                    all_key_new_tuple = tuple(newdata[key] for key in all_cols)
-                elif ty == "insert":
-                    data = row["values"]
-                    if len(data) != len(all_cols):
-                        raise ValueError(
-                            f"Column count mismatch in table {table_name}: {data} vs {all_cols}"
-                        )
-                    for key in data:
-                        if key not in all_cols:
-                            raise ValueError(
-                                f"Column {key} not found in table {table_name}"
-                            )
-                    primary_key_tuple = tuple(data[key] for key in primary_keys)
-                    all_key_old_tuple = None
-                    all_key_new_tuple = tuple(data[key] for key in all_cols)
-                elif ty == "delete":
-                    data = row["values"]
-                    if len(data) != len(all_cols):
-                        raise ValueError(
-                            f"Column count mismatch in table {table_name}: {data} vs {all_cols}"
-                        )
-                    for key in data:
-                        if key not in all_cols:
-                            raise ValueError(
-                                f"Column {key} not found in table {table_name}"
-                            )
-                    primary_key_tuple = tuple(data[key] for key in primary_keys)
-                    all_key_old_tuple = tuple(data[key] for key in all_cols)
-                    all_key_new_tuple = None
-                else:
-                    raise ValueError(f"Unknown type {ty}")
-
-                if all_key_old_tuple is not None:
-                    for val in all_key_old_tuple:
-                        assert (
-                            val == None
-                            or isinstance(val, str)
-                            or isinstance(val, int)
-                            or isinstance(val, float)
-                            or isinstance(val, bool)
-                            or isinstance(val, bytes)
-                            or isinstance(val, datetime)
-                        )
+                primary_key_tuple, all_key_old_tuple, all_key_new_tuple = (
+                    binlog_row_change(ty, row, table_name, primary_keys, all_cols)
+                )
                 t = (time_change, all_key_old_tuple, all_key_new_tuple)
                 changelist[primary_key_tuple].append(t)
 
@@ -286,3 +306,43 @@ def process_binlog_file(
         db_binlogs[table_name] = db_table_binlog
 
     return db_binlogs
+
+
+def apply_binlog_item(
+    db_binlogs: dict[str, DbTableBinlog],
+    all_info,
+    item: dict,
+    focus_schema_name: str,
+    db_merge_info: list[tuple[str, str]] = [],
+):
+    # one more binlog item, newer than all before, into the result of
+    # process_binlog_file; tables are filtered the same way
+    if item["type"] not in {"insert", "update", "delete"}:
+        return
+    if item["schema"] != focus_schema_name:
+        return
+
+    table_name = item["table"]
+    table_name = dict(db_merge_info).get(table_name, table_name)
+    if table_name not in all_info:
+        raise ValueError(f"Table {table_name} not found in all_info")
+
+    primary_keys, all_cols = all_info[table_name]
+    if primary_keys is None or len(primary_keys) != 1:
+        return
+
+    table_binlog = db_binlogs.get(table_name, None)
+    if table_binlog is None:
+        table_binlog = DbTableBinlog(
+            columns=DbTableColumns(primary_keys=primary_keys, all_columns=all_cols),
+            binlog_items={},
+        )
+        db_binlogs[table_name] = table_binlog
+
+    for row in item["rows"]:
+        primary_key_tuple, old_value, new_value = binlog_row_change(
+            item["type"], row, table_name, primary_keys, all_cols
+        )
+        table_binlog.add_change(
+            item["timestamp"], primary_key_tuple, old_value, new_value
+        )
@@ -2,6 +2,8 @@ import gzip
 import json
 import pickle
 import typing
+from collections import deque
+from collections.abc import Mapping
 from dataclasses import dataclass
 from datetime import datetime
 
@@ -12,11 +14,31 @@ from tqdm import tqdm
 
 from .. import logger
 from ..gen_inv.base import Field, RelatedFields
+from ..gen_inv.field_access import ALL_FIELDS, AccessTree, project_json
 from .proj_desc_file import ProjDescFile
 
 
+HEADER_ARGUMENT_NAMES = ["httpHeaders", "httpHeader", "headers", "header"]
+
+
+def rename_headers(arguments: dict[str, typing.Any]) -> dict[str, typing.Any]:
+    # the headers passed as an argument are always shown as "headers"
+    has_header = False
+    for header_name in HEADER_ARGUMENT_NAMES:
+        if header_name in arguments:
+            has_header = True
+            break
+    if has_header:
+        arguments = arguments.copy()
+        for header_name in HEADER_ARGUMENT_NAMES:
+            if header_name in arguments:
+                arguments["headers"] = arguments[header_name]
+                del arguments[header_name]
+    return arguments
+
+
 class LogItem:
-    content: dict
+    content: Mapping
 
     def __init__(self, content: dict = None):
         if content is None:
@@ -121,73 +143,76 @@ class LogItem:
     def to_execute_json(
         self,
         related_fields: RelatedFields,
+        access: AccessTree = ALL_FIELDS,
     ) -> dict[str, typing.Any]:
+        # `access` restricts the result to the paths a predicate may read, see
+        # gen_inv/field_access.py; sections outside of it are not built
         result = {}
-        header_names = ["httpHeaders", "httpHeader", "headers", "header"]
+
+        def section(key: str) -> tuple[bool, AccessTree]:
+            if access is ALL_FIELDS:
+                return True, ALL_FIELDS
+            return key in access, access.get(key, ALL_FIELDS)
 
         if related_fields.include_arguments:
-            arguments = self.content.get("arguments", {})
-            has_header = False
-            for header_name in header_names:
-                if header_name in arguments:
-                    has_header = True
-                    break
-            if has_header:
-                arguments = arguments.copy()
-                for header_name in header_names:
-                    if header_name in arguments:
-                        arguments["headers"] = arguments[header_name]
-                        del arguments[header_name]
-            result["arguments"] = arguments
+            needed, sub = section("arguments")
+            if needed:
+                arguments = rename_headers(self.content.get("arguments", {}))
+                result["arguments"] = project_json(arguments, sub)
         if related_fields.include_response:
-            result["response"] = self.content.get("response", {})
+            needed, sub = section("response")
+            if needed:
+                result["response"] = project_json(self.content.get("response", {}), sub)
         if related_fields.include_headers:
-            result["headers"] = self.content.get("headers", {})
+            needed, sub = section("headers")
+            if needed:
+                result["headers"] = project_json(self.content.get("headers", {}), sub)
         if related_fields.include_env:
-            env = self.content.get("env", {})
-            env = env.copy()
-            if "is_user" in env:
-                del env["is_user"]
-            if "is_admin" in env:
-                del env["is_admin"]
-            result["env"] = self.content.get("env", {})
+            needed, sub = section("env")
+            if needed:
+                result["env"] = project_json(self.content.get("env", {}), sub)
         if related_fields.include_db_info:
-            result["db_info"] = self.content.get("related_db_tables", {})
+            needed, sub = section("db_info")
+            if needed:
+                result["db_info"] = self.get_projected("related_db_tables", sub)
         if related_fields.include_related_log:
-            related_logs = self.content.get("related_event_logs", {})
-            related_logs_to_add = {}
-            for k, v in related_logs.items():
-                related_event = {}
-                if v is None:
-                    related_logs_to_add[k] = None
-                    continue
-                if related_fields.related_include_arguments:
-                    arguments = v.get("arguments", {})
-                    has_header = False
-                    for header_name in header_names:
-                        if header_name in arguments:
-                            has_header = True
-                            break
-                    if has_header:
-                        arguments = arguments.copy()
-                        for header_name in header_names:
-                            if header_name in arguments:
-                                arguments["headers"] = arguments[header_name]
-                                del arguments[header_name]
-                    related_event["arguments"] = arguments
-                if related_fields.related_include_response:
-                    related_event["response"] = v.get("response", {})
-                if related_fields.related_include_headers:
-                    related_event["headers"] = v.get("headers", {})
-                if related_fields.related_include_env:
-                    related_event["env"] = v.get("env", {})
-                related_logs_to_add[k] = related_event
-            result["related_events"] = related_logs_to_add
+            needed, sub = section("related_events")
+            if needed:
+                related_logs = self.get_projected(
+                    "related_event_logs", None if sub is None else dict.fromkeys(sub)
+                )
+                related_logs_to_add = {}
+                for k, v in related_logs.items():
+                    if v is None:
+                        related_logs_to_add[k] = None
+                        continue
+                    event_access = ALL_FIELDS if sub is None else sub[k]
+                    related_event = {}
+                    if related_fields.related_include_arguments:
+                        related_event["arguments"] = rename_headers(
+                            v.get("arguments", {})
+                        )
+                    if related_fields.related_include_response:
+                        related_event["response"] = v.get("response", {})
+                    if related_fields.related_include_headers:
+                        related_event["headers"] = v.get("headers", {})
+                    if related_fields.related_include_env:
+                        related_event["env"] = v.get("env", {})
+                    related_logs_to_add[k] = project_json(related_event, event_access)
+                result["related_events"] = related_logs_to_add
 
         return result
 
+    def get_projected(self, key: str, access: AccessTree) -> typing.Any:
+        # self.content[key] projected to `access`; joined contents only
+        # gather the joined columns `access` reaches
+        get_projected = getattr(self.content, "get_projected", None)
+        if get_projected is not None:
+            return get_projected(key, access)
+        return project_json(self.content.get(key, {}), access)
+
     def serialize_obj(self, obj):
-        if isinstance(obj, dict):
+        if isinstance(obj, Mapping):
             return {k: self.serialize_obj(v) for k, v in obj.items()}
         elif isinstance(obj, list):
             return [self.serialize_obj(v) for v in obj]
@@ -256,7 +281,7 @@ class LogFile:
             open_func = open
         with open_func(file_path, "w") as f:
             for item in self.log_items:
-                f.write(json.dumps(item.content) + "\n")
+                f.write(json.dumps(dict(item.content)) + "\n")
 
     def filter_train(self) -> "LogFile":
         result = LogFile()
@@ -281,105 +306,135 @@ def time_stamp_to_datetime_str(timestamp: int | float) -> str:
     return dt.strftime("%Y-%m-%d %H:%M:%S.%f")
 
 
-def load_from_log_receiver_file(file_path: str, proj_desc_file: ProjDescFile):
-    logs = []
-    pending_items = {}
+# Pairs the enter / exit events of the log receiver into LogItems. An exit
+# completes the latest pending enter of the same api. `max_pending` bounds the
+# enters waiting for their exit per api, the oldest are dropped first.
+class LogReceiverPairer:
+    def __init__(self, proj_desc_file: ProjDescFile, max_pending: int | None = None):
+        self.proj_desc_file = proj_desc_file
+        self.max_pending = max_pending
+        self.pending_items: dict[str, deque[LogItem]] = {}
 
-    with zstandard.open(file_path, "r") as f:
-        lines = f.readlines()
-    for line in tqdm(lines):
-        line = line.strip()
-        if not line:
-            continue
-        line = json.loads(line)
+    def feed(self, line: dict) -> tuple[LogItem | None, LogItem | None]:
+        # (the LogItem entered, the LogItem completed) by this event
         api = line["methodName"]
-        is_enter = line["isEnter"]
+        if line["isEnter"]:
+            return self.enter(api, line), None
+        return None, self.exit(api, line)
 
+    def enter(self, api: str, line: dict) -> LogItem:
         cur_time = line["time"]
         cur_time = time_stamp_to_datetime_str(cur_time)
 
-        if is_enter:
-            arguments = line["arguments"]
-            arguments_des = []
-            for arg in arguments:
-                try:
-                    a = json.loads(arg)
-                except json.JSONDecodeError:
-                    logger.warning("Failed to decode json: %s", arg)
-                    a = arg
-                arguments_des.append(a)
-            arguments = arguments_des
-
-            headers = line["headers"]
-            real_headers = {}
-            envs = {}
-            queries = {}
-
-            for k, v in headers.items():
-                if k.startswith("__env__"):
-                    envs[k[7:]] = v
-                elif k.startswith("__query__"):
-                    queries[k[9:]] = v
-                else:
-                    real_headers[k] = v
-
-            api_desc = proj_desc_file.api_map[api]
-            argument_names = api_desc.argument_names
-            arguments_dict = dict(zip(argument_names, arguments))
+        arguments = line["arguments"]
+        arguments_des = []
+        for arg in arguments:
+            try:
+                a = json.loads(arg)
+            except json.JSONDecodeError:
+                logger.warning("Failed to decode json: %s", arg)
+                a = arg
+            arguments_des.append(a)
+        arguments = arguments_des
+
+        headers = line["headers"]
+        real_headers = {}
+        envs = {}
+        queries = {}
+
+        for k, v in headers.items():
+            if k.startswith("__env__"):
+                envs[k[7:]] = v
+            elif k.startswith("__query__"):
+                queries[k[9:]] = v
+            else:
+                real_headers[k] = v
+
+        api_desc = self.proj_desc_file.api_map[api]
+        argument_names = api_desc.argument_names
+        arguments_dict = dict(zip(argument_names, arguments))
+
+        controller_path = api_desc.extra.get("controller_path", None)
+        url_path = api_desc.extra.get("url_path", None)
+
+        log_dict = {}
+        log_dict["time"] = cur_time
+        log_dict["api"] = api
+        log_dict["arguments"] = arguments_dict
+        log_dict["headers"] = real_headers
+        log_dict["env"] = envs
+        log_dict["queries"] = queries
+
+        log_dict["controller_path"] = controller_path
+        log_dict["url_path"] = url_path
+        log_dict["api_name"] = api
+
+        log_item = LogItem(log_dict)
+        if api not in self.pending_items:
+            self.pending_items[api] = deque()
+        pending = self.pending_items[api]
+        pending.append(log_item)
+        if self.max_pending is not None and len(pending) > self.max_pending:
+            dropped = pending.popleft()
+            logger.warning(
+                "Warning: dropped enter without exit: %s, %s", api, dropped.content
+            )
+        return log_item
+
+    def exit(self, api: str, line: dict) -> LogItem | None:
+        if api not in self.pending_items or len(self.pending_items[api]) == 0:
+            logger.warning("Warning: no enter for exit: %s. API: %s", line, api)
+            return None
 
-            controller_path = api_desc.extra.get("controller_path", None)
-            url_path = api_desc.extra.get("url_path", None)
+        response_time = line["time"]
+        response_time = time_stamp_to_datetime_str(response_time)
 
-            log_dict = {}
-            log_dict["time"] = cur_time
-            log_dict["api"] = api
-            log_dict["arguments"] = arguments_dict
-            log_dict["headers"] = real_headers
-            log_dict["env"] = envs
-            log_dict["queries"] = queries
+        has_error = line["hasError"]
+        if has_error:
+            response = None
+            throwable = line["throwable"]
+            if throwable.strip():
+                throwable = json.loads(throwable)
+            else:
+                throwable = None
+        else:
+            response = line["returnObj"]
+            if response.strip():
+                response = json.loads(response)
+            else:
+                response = None
+            throwable = None
 
-            log_dict["controller_path"] = controller_path
-            log_dict["url_path"] = url_path
-            log_dict["api_name"] = api
+        log_item = self.pending_items[api].pop()
+        log_item.content["response_time"] = response_time
+        log_item.content["response"] = response
+        log_item.content["throwable"] = throwable
+        log_item.content["has_error"] = has_error
+        return log_item
 
-            log_item = LogItem(log_dict)
-            logs.append(log_item)
-            if api not in pending_items:
-                pending_items[api] = []
-            pending_items[api].append(log_dict)
-        else:
-            if api not in pending_items or len(pending_items[api]) == 0:
-                logger.warning("Warning: no enter for exit: %s. API: %s", line, api)
-                continue
+    def pending(self) -> typing.Iterator[tuple[str, LogItem]]:
+        for k, v in self.pending_items.items():
+            for item in v:
+                yield k, item
 
-            response_time = line["time"]
-            response_time = time_stamp_to_datetime_str(response_time)
 
-            has_error = line["hasError"]
-            if has_error:
-                response = None
-                throwable = line["throwable"]
-                if throwable.strip():
-                    throwable = json.loads(throwable)
-                else:
-                    throwable = None
-            else:
-                response = line["returnObj"]
-                if response.strip():
-                    response = json.loads(response)
-                else:
-                    response = None
-                throwable = None
+def load_from_log_receiver_file(file_path: str, proj_desc_file: ProjDescFile):
+    logs = []
+    pairer = LogReceiverPairer(proj_desc_file)
 
-            log_item = pending_items[api].pop()
-            log_item["response_time"] = response_time
-            log_item["response"] = response
-            log_item["throwable"] = throwable
-            log_item["has_error"] = has_error
+    with zstandard.open(file_path, "r") as f:
+        lines = f.readlines()
+    for line in tqdm(lines):
+        line = line.strip()
+        if not line:
+            continue
+        line = json.loads(line)
+        log_item, _ = pairer.feed(line)
+        if log_item is not None:
+            logs.append(log_item)
 
-    for k, v in pending_items.items():
-        for item in v:
-            logger.warning("Warning: no exit for enter: %s, %s", k, item)
+    for k, item in pairer.pending():
+        logger.warning("Warning: no exit for enter: %s, %s", k, item.content)
 
     log_items_filtered = []
     for log_item in logs:
@@ -1,7 +1,14 @@
+import hashlib
 import inspect
+import types
 import typing
 from dataclasses import dataclass
 
+from .. import logger
+from .field_access import AccessTree, analyze_field_access, merge_access
+from .predicate_cache import active_predicate_cache
+from .predicate_expr import PredicateExpr, PredicateExprError
+
 
 # Invariant
 # Domain: [[event, fields], [event, fields], ...]
@@ -258,10 +265,32 @@ def dummy_print(*args, **kwargs):
     pass
 
 
-def check_valid_predicate_code(py_code: str, num_args):
+def compile_predicate_code(py_code: str) -> types.CodeType:
+    try:
+        return compile(py_code, "<string>", "exec")
+    except Exception as e:
+        raise ValueError(f"Failed during exec Python code. {e}")
+
+
+def load_validated_predicate_code(code: types.CodeType):
+    # the check function of code which passed check_valid_predicate_code
+    py_func_globabls = {"print": dummy_print}
+    try:
+        exec(code, py_func_globabls)
+    except Exception as e:
+        raise ValueError(f"Failed during exec Python code. {e}")
+    return py_func_globabls["check"], py_func_globabls
+
+
+def check_valid_predicate_code(
+    py_code: str, num_args, code: types.CodeType | None = None
+):
+    # `code` is py_code already compiled
     py_func_globabls = {"print": dummy_print}
     try:
-        exec(py_code, py_func_globabls)
+        if code is None:
+            code = compile(py_code, "<string>", "exec")
+        exec(code, py_func_globabls)
     except Exception as e:
         raise ValueError(f"Failed during exec Python code. {e}")
     if "check" not in py_func_globabls:
@@ -294,6 +323,8 @@ class Predicate:
     py_func: typing.Callable
     py_func_globabls: dict
     num_args: int
+    # optional declarative form of the predicate, see gen_inv/predicate_expr.py
+    expr: str | None = None
 
     def __str__(self):
         return f"Is True Predicate: {self.is_true_predicate}, Description: {self.desc}, Python Code: {self.py_code}, Number of Arguments: {self.num_args}"
@@ -320,26 +351,92 @@ class Predicate:
         self.desc = desc
         self.py_code = py_code
         self.num_args = num_args
-
-        py_func, py_func_globabls = check_valid_predicate_code(
-            self.py_code, self.num_args
-        )
+        self.expr = None
+        self.__dict__.pop("_compiled_expr", None)
+        self.__dict__.pop("_field_access", None)
+        self.__dict__.pop("_code_digest", None)
+
+        cache = active_predicate_cache()
+        code = cache.get(self.code_digest) if cache is not None else None
+        if code is not None:
+            py_func, py_func_globabls = load_validated_predicate_code(code)
+        else:
+            code = compile_predicate_code(self.py_code) if cache is not None else None
+            py_func, py_func_globabls = check_valid_predicate_code(
+                self.py_code, self.num_args, code
+            )
+            if cache is not None:
+                cache.add(self.code_digest, code)
         self.py_func = py_func
         self.py_func_globabls = py_func_globabls
 
+    @property
+    def field_access(self) -> "list[AccessTree]":
+        # per argument, the paths of its `to_execute_json` payload the code
+        # may read; analyzed once, on first use
+        if "_field_access" not in self.__dict__:
+            if self.is_true_predicate:
+                self._field_access = []
+            else:
+                self._field_access = analyze_field_access(self.py_code, self.num_args)
+                if self.compiled_expr is not None:
+                    self._field_access[0] = merge_access(
+                        self._field_access[0], self.compiled_expr.access
+                    )
+        return self._field_access
+
+    @property
+    def compiled_expr(self) -> PredicateExpr | None:
+        # `expr` parsed once, on first use; None without an expression or if
+        # it can not be used, then `check` decides on its own
+        if "_compiled_expr" not in self.__dict__:
+            self._compiled_expr = None
+            if self.expr is not None and not self.is_true_predicate:
+                if self.num_args != 1:
+                    logger.warning(
+                        "Ignoring the expression of a predicate of %d arguments",
+                        self.num_args,
+                    )
+                else:
+                    try:
+                        self._compiled_expr = PredicateExpr(self.expr)
+                    except PredicateExprError as e:
+                        logger.warning("Ignoring expression %r: %s", self.expr, e)
+        return self._compiled_expr
+
+    def set_expr(self, expr: str | None) -> None:
+        self.expr = expr
+        self.__dict__.pop("_compiled_expr", None)
+        self.__dict__.pop("_field_access", None)
+
+    @property
+    def code_digest(self) -> bytes:
+        # identifies the code and arity of the predicate, e.g. in caches
+        if "_code_digest" not in self.__dict__:
+            if self.is_true_predicate:
+                self._code_digest = b""
+            else:
+                self._code_digest = hashlib.sha256(
+                    f"{self.num_args}\n{self.py_code}".encode()
+                ).digest()
+        return self._code_digest
+
     def load_from_json(self, j: dict) -> None:
         self.is_true_predicate = j["is_true_precisely"]
 
         if not self.is_true_predicate:
             self.load_py_code(j["desc"], j["py_code"], j["num_args"])
+            self.set_expr(j.get("expr", None))
 
     def save_to_json(self) -> dict:
         if self.is_true_predicate:
             return {"is_true_precisely": self.is_true_predicate}
-        else:
-            return {
-                "is_true_precisely": self.is_true_predicate,
-                "desc": self.desc,
-                "py_code": self.py_code,
-                "num_args": self.num_args,
-            }
+        j = {
+            "is_true_precisely": self.is_true_predicate,
+            "desc": self.desc,
+            "py_code": self.py_code,
+            "num_args": self.num_args,
+        }
+        if self.expr is not None:
+            j["expr"] = self.expr
+        return j
@@ -1,10 +1,23 @@
+import contextlib
 import datetime
+import signal
+import threading
+import time
 import traceback
 import typing
 from abc import ABC, ABCMeta, abstractmethod
+from dataclasses import dataclass
+
+try:
+    import resource
+except ImportError:
+    resource = None
 
 from ..file_types.log_file import LogFile, LogItem
 from .base import APIDomainAllPlaceholder, Field, Invariant, Predicate, RelatedFields
+from .event_index import RELATED_EVENT_SECONDS, get_event_index
+from .predicate_expr import EXPR_FAILURE
+from .profiler import profiling, record_call, record_lookup
 
 
 def run_py_predicate(
@@ -24,6 +37,9 @@ def run_py_predicate(
             f"Number of arguments in predicate should be {len(fields)}, but got {predicate.num_args}"
         )
 
+    profile = profiling()
+    start = time.perf_counter() if profile else 0.0
+
     input_args = []
 
     for log_item, field in zip(log_items, fields):
@@ -35,7 +51,19 @@ def run_py_predicate(
         )
 
     try:
-        ret = predicate.py_func(*input_args)
+        predicate_start = time.perf_counter() if profile else 0.0
+        raised = True
+        try:
+            ret = predicate.py_func(*input_args)
+            raised = False
+        finally:
+            if profile:
+                record_call(
+                    predicate,
+                    predicate_start - start,
+                    time.perf_counter() - predicate_start,
+                    raised,
+                )
     except Exception as e:
         return False, "".join(traceback.format_exception_only(e))
 
@@ -86,34 +114,188 @@ def run_py_predicate_new_json_format(
     if predicate.is_true_predicate:
         return True, None
 
+    verdict, err = run_py_predicate_limited(predicate, log_items, related_fields)
+    return verdict == PredicateVerdicts.Pass, err
+
+
+class PredicateVerdicts:
+    Pass = "pass"
+    Fail = "fail"
+    Timeout = "timeout"
+    OutOfMemory = "out_of_memory"
+    # not run, the invariant already overran its budget too many times
+    Skipped = "skipped"
+
+
+PREDICATE_OVERRUNS = (PredicateVerdicts.Timeout, PredicateVerdicts.OutOfMemory)
+
+
+# Budget of one predicate call. `cpu_time` (seconds) is enforced with a
+# virtual-time interval timer, so it only applies in the main thread and can
+# not interrupt a single long C call (e.g. one regex match) until it returns.
+# `memory` (bytes of address space) is process wide, so it is only applied
+# inside the worker processes of an InvariantEvaluator, and only for the
+# duration of the predicate call. After `max_overruns` timeouts / memory
+# errors an invariant is flagged and no longer run.
+@dataclass
+class PredicateLimits:
+    cpu_time: float | None = 1.0
+    memory: int | None = None
+    max_overruns: int = 3
+
+
+class PredicateTimeout(BaseException):
+    # not an Exception, so a broad `except Exception` in the predicate can
+    # not swallow it
+    pass
+
+
+_timer_armed = False
+
+
+def _on_timer(signum, frame):
+    if _timer_armed:
+        raise PredicateTimeout()
+
+
+def _can_use_timer() -> bool:
+    return (
+        hasattr(signal, "setitimer")
+        and threading.current_thread() is threading.main_thread()
+    )
+
+
+# set in the worker processes of an InvariantEvaluator, see allow_memory_limit
+_memory_limit_allowed = False
+
+
+def allow_memory_limit():
+    # lets this process lower its own address space limit around predicate
+    # calls; only for processes which run nothing else meanwhile
+    global _memory_limit_allowed
+    _memory_limit_allowed = resource is not None
+
+
+@contextlib.contextmanager
+def _limited(cpu_time: float | None, memory: int | None) -> typing.Iterator[None]:
+    # the budget of one predicate call, lifted again right after it, so
+    # nothing but the predicate ever runs under it
+    global _timer_armed
+
+    use_timer = cpu_time is not None and _can_use_timer()
+    if use_timer and signal.getsignal(signal.SIGVTALRM) is not _on_timer:
+        signal.signal(signal.SIGVTALRM, _on_timer)
+    old_memory = None
+    if memory is not None and _memory_limit_allowed:
+        old_memory = resource.getrlimit(resource.RLIMIT_AS)
+        resource.setrlimit(resource.RLIMIT_AS, (memory, old_memory[1]))
+    try:
+        if use_timer:
+            _timer_armed = True
+            signal.setitimer(signal.ITIMER_VIRTUAL, cpu_time)
+        yield
+    finally:
+        if use_timer:
+            _timer_armed = False
+            signal.setitimer(signal.ITIMER_VIRTUAL, 0)
+        if old_memory is not None:
+            resource.setrlimit(resource.RLIMIT_AS, old_memory)
+
+
+def run_py_predicate_limited(
+    predicate: Predicate,
+    log_items: list[LogItem],
+    related_fields: list[RelatedFields],
+    limits: PredicateLimits | None = None,
+) -> tuple[str, typing.Optional[str]]:
+    if predicate.is_true_predicate:
+        return PredicateVerdicts.Pass, None
+
+    profile = profiling()
+    start = time.perf_counter() if profile else 0.0
+
     input_args = []
 
-    for log_item, fields in zip(log_items, related_fields):
-        input_args.append(log_item.to_execute_json(fields))
+    for log_item, fields, access in zip(
+        log_items, related_fields, predicate.field_access
+    ):
+        input_args.append(log_item.to_execute_json(fields, access))
+
+    prepare_time = time.perf_counter() - start if profile else 0.0
+
+    return run_py_args_limited(predicate, input_args, limits, prepare_time)
+
+
+def run_py_args_limited(
+    predicate: Predicate,
+    input_args: list[dict[str, typing.Any]],
+    limits: PredicateLimits | None = None,
+    prepare_time: float = 0.0,
+) -> tuple[str, typing.Optional[str]]:
+    # same as run_py_predicate_limited, on already projected logs;
+    # `prepare_time` is what the projection cost, for the profiler. Without
+    # `limits` the predicate runs unbounded, as run_py_predicate_new_json_format
+    if predicate.is_true_predicate:
+        return PredicateVerdicts.Pass, None
 
-    if predicate.num_args != len(related_fields):
+    if predicate.num_args != len(input_args):
         raise ValueError(
-            f"Number of arguments in predicate should be {len(related_fields)}, but got {predicate.num_args}"
+            f"Number of arguments in predicate should be {len(input_args)}, but got {predicate.num_args}"
         )
 
+    expr = predicate.compiled_expr
+    if expr is not None:
+        # the declarative form decides when there is one
+        if expr.holds(input_args[0]):
+            return PredicateVerdicts.Pass, None
+        return PredicateVerdicts.Fail, EXPR_FAILURE
+
+    profile = profiling()
+    cpu_time = limits.cpu_time if limits is not None else None
+    memory = limits.memory if limits is not None else None
+
     try:
-        ret = predicate.py_func(*input_args)
+        predicate_start = time.perf_counter() if profile else 0.0
+        raised = True
+        try:
+            with _limited(cpu_time, memory):
+                ret = predicate.py_func(*input_args)
+            raised = False
+        finally:
+            if profile:
+                record_call(
+                    predicate,
+                    prepare_time,
+                    time.perf_counter() - predicate_start,
+                    raised,
+                )
+    except PredicateTimeout:
+        return (
+            PredicateVerdicts.Timeout,
+            f"check function exceeded its CPU time budget of {cpu_time}s",
+        )
+    except MemoryError as e:
+        if memory is None or not _memory_limit_allowed:
+            return PredicateVerdicts.Fail, format_exc_in_string(predicate.py_code, e)
+        return (
+            PredicateVerdicts.OutOfMemory,
+            "check function exceeded its memory budget",
+        )
     except Exception as e:
         error_info = format_exc_in_string(predicate.py_code, e)
-        # print("CAUGHT ERROR: ", error_info)
-        return False, error_info
+        return PredicateVerdicts.Fail, error_info
 
     if ret is False:
-        return False, "check function return False"
+        return PredicateVerdicts.Fail, "check function return False"
 
-    return True, None
+    return PredicateVerdicts.Pass, None
 
 
 def is_two_events_related(log1: LogItem, log2: LogItem) -> bool:
     format_str = "%Y-%m-%d %H:%M:%S.%f"
     t1 = datetime.datetime.strptime(log1.time, format_str)
     t2 = datetime.datetime.strptime(log2.time, format_str)
-    if abs((t1 - t2).total_seconds()) < 600:
+    if abs((t1 - t2).total_seconds()) < RELATED_EVENT_SECONDS:
         return True
 
 
@@ -124,20 +306,11 @@ def find_nearest_related_event(
     other_api: typing.Union[str, APIDomainAllPlaceholder],
     direction: typing.Literal["before", "after"],
 ) -> tuple[int, typing.Optional[LogItem]]:
-    if direction == "before":
-        find_range = range(log_idx - 1, -1, -1)
-    elif direction == "after":
-        find_range = range(log_idx + 1, len(all_log))
-    else:
-        raise ValueError(f"Invalid direction: {direction}")
-
-    for i in find_range:
-        other_log = all_log[i]
-        if isinstance(other_api, APIDomainAllPlaceholder) or other_log.api == other_api:
-            if is_two_events_related(log, other_log):
-                return i, other_log
-
-    return -1, None
+    # `log` is all_log[log_idx]; answered from the EventIndex of all_log
+    other_idx = get_event_index(all_log).nearest_related(log_idx, other_api, direction)
+    if other_idx == -1:
+        return -1, None
+    return other_idx, all_log[other_idx]
 
 
 class InvChecker(ABC):
@@ -179,11 +352,6 @@ class InvCheckerForAllOne(InvChecker):
 
 class InvCheckerForAllExistsNearestReleatd(InvChecker):
     def can_check(self, inv):
-        print(len(inv.domain))
-        print(inv.domain[0].quantifier)
-        print(inv.domain[1].quantifier)
-        print(inv.premise.premise_position)
-        print(inv.premise.premise_type)
         return (
             len(inv.domain) == 2
             and inv.domain[0].quantifier == "forall"
@@ -205,9 +373,12 @@ class InvCheckerForAllExistsNearestReleatd(InvChecker):
         else:
             direction = "after"
 
+        lookup_start = time.perf_counter()
         second_log_idx, second_log = find_nearest_related_event(
             log, log_idx, all_log, inv.domain[1].api, direction
         )
+        if profiling():
+            record_lookup(inv.predicate, time.perf_counter() - lookup_start)
 
         if second_log_idx == -1:
             return False, "Cannot find related event"
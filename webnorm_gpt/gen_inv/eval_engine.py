@@ -0,0 +1,383 @@
+import contextlib
+import itertools
+import multiprocessing
+import os
+import time
+import typing
+from collections import defaultdict
+from dataclasses import dataclass
+
+from ..file_types.log_file import LogItem
+from .base import Invariant
+from .check_inv import (
+    PREDICATE_OVERRUNS,
+    PredicateLimits,
+    PredicateVerdicts,
+    allow_memory_limit,
+    run_py_args_limited,
+)
+from .inv_set import InvariantSet
+from .predicate_cache import CompiledPredicateCache, using_predicate_cache
+from .predicate_expr import EXPR_FAILURE, ExprBatch
+from .profiler import InvariantProfiler, InvariantStats, active_profilers, profiling
+from .verdict_cache import VerdictCache, VerdictCacheStats, payload_digest
+
+# (inv_id, log_idx, verdict, err), verdict is one of PredicateVerdicts
+EvalResult = tuple[int, int, str, typing.Optional[str]]
+# (log_idx, log_item), checked against every invariant of log_item.api
+EvalTask = tuple[int, LogItem]
+
+UNLIMITED = PredicateLimits(cpu_time=None, memory=None, max_overruns=2**62)
+
+
+# A log as sent to the workers: only its projection for every group of
+# inv_set.groups(api), None for groups with nothing to evaluate, so the joined
+# tables and events the predicates do not read are never pickled.
+@dataclass
+class ProjectedLog:
+    api: str
+    projections: list[dict | None]
+    # seconds each projection took, for the profiler
+    prepare_times: list[float]
+
+
+ProjectedTask = tuple[int, ProjectedLog]
+
+
+def project_log(
+    inv_set: InvariantSet, log_item: LogItem, only: frozenset[int] | None = None
+) -> ProjectedLog:
+    projections: list[dict | None] = []
+    prepare_times = []
+    for group in inv_set.groups(log_item.api):
+        if not any(
+            entry.expr is None and (only is None or entry.inv_id in only)
+            for entry in group.entries
+        ):
+            projections.append(None)
+            prepare_times.append(0.0)
+            continue
+        start = time.perf_counter()
+        projections.append(log_item.to_execute_json(group.related_fields, group.access))
+        prepare_times.append(time.perf_counter() - start)
+    return ProjectedLog(log_item.api, projections, prepare_times)
+
+
+def evaluate_tasks(
+    inv_set: InvariantSet,
+    tasks: typing.Iterable[EvalTask | ProjectedTask],
+    limits: PredicateLimits,
+    overruns: dict[int, int],
+    cache: VerdictCache | None = None,
+    only: frozenset[int] | None = None,
+) -> typing.Iterator[EvalResult]:
+    # with `only`, just the invariants of these ids are evaluated; invariants
+    # with an expression are left to `evaluate_exprs`
+    for log_idx, log_item in tasks:
+        for group_idx, group in enumerate(inv_set.groups(log_item.api)):
+            # projected once for the whole group
+            projection = None
+            digest = None
+            prepare_time = 0.0
+            for entry in group.entries:
+                inv_id = entry.inv_id
+                if only is not None and inv_id not in only:
+                    continue
+                if entry.expr is not None:
+                    continue
+                if overruns[inv_id] >= limits.max_overruns:
+                    yield inv_id, log_idx, PredicateVerdicts.Skipped, "invariant flagged"
+                    continue
+                if projection is None:
+                    if isinstance(log_item, ProjectedLog):
+                        projection = log_item.projections[group_idx]
+                        assert projection is not None
+                        prepare_time = log_item.prepare_times[group_idx]
+                    else:
+                        start = time.perf_counter()
+                        projection = log_item.to_execute_json(
+                            group.related_fields, group.access
+                        )
+                        prepare_time = time.perf_counter() - start
+                    if cache is not None:
+                        digest = payload_digest(projection)
+                code = entry.invariant.predicate.code_digest
+                if cache is not None and digest is not None:
+                    cached = cache.get(code, digest)
+                    if cached is not None:
+                        yield inv_id, log_idx, cached[0], cached[1]
+                        continue
+                # a fresh top level dict per predicate, one predicate adding
+                # or removing keys must not affect the next
+                verdict, err = run_py_args_limited(
+                    entry.invariant.predicate, [dict(projection)], limits, prepare_time
+                )
+                prepare_time = 0.0
+                if verdict in PREDICATE_OVERRUNS:
+                    overruns[inv_id] += 1
+                if cache is not None and digest is not None:
+                    cache.put(code, digest, verdict, err)
+                yield inv_id, log_idx, verdict, err
+
+
+def evaluate_exprs(
+    inv_set: InvariantSet,
+    tasks: list[EvalTask],
+    only: frozenset[int] | None = None,
+) -> typing.Iterator[EvalResult]:
+    # the invariants with an expression, on all logs of an api at once; an
+    # expression can neither overrun nor be worth caching
+    tasks_by_api: dict[str, list[EvalTask]] = defaultdict(list)
+    for task in tasks:
+        tasks_by_api[task[1].api].append(task)
+    for api, api_tasks in tasks_by_api.items():
+        log_idxs = [log_idx for log_idx, _ in api_tasks]
+        for group in inv_set.groups(api):
+            entries = [
+                entry
+                for entry in group.entries
+                if entry.expr is not None and (only is None or entry.inv_id in only)
+            ]
+            if len(entries) == 0:
+                continue
+            # shared by the expressions of the group, a column is gathered once
+            batch = ExprBatch(
+                [log_item for _, log_item in api_tasks], group.related_fields
+            )
+            for entry in entries:
+                assert entry.expr is not None
+                inv_id = entry.inv_id
+                holds = batch.holds(entry.expr)
+                for log_idx, ok in zip(log_idxs, holds.tolist()):
+                    if ok:
+                        yield inv_id, log_idx, PredicateVerdicts.Pass, None
+                    else:
+                        yield inv_id, log_idx, PredicateVerdicts.Fail, EXPR_FAILURE
+
+
+# Overrun counts by inv_id in shared memory, the same for every worker of an
+# InvariantEvaluator, so an invariant flagged by one worker is skipped by all.
+# Two workers overrunning the same invariant at once may count only once.
+class SharedOverruns:
+    def __init__(self, counts):
+        self.counts = counts
+
+    def __getitem__(self, inv_id: int) -> int:
+        return self.counts[inv_id]
+
+    def __setitem__(self, inv_id: int, count: int):
+        self.counts[inv_id] = count
+
+
+# State of a worker process, set up once by `_init_worker`.
+_worker_inv_set = InvariantSet([])
+_worker_limits = UNLIMITED
+_worker_overruns: dict[int, int] | SharedOverruns = defaultdict(int)
+_worker_cache: VerdictCache | None = None
+
+
+def _init_worker(
+    invariant_jsons: list[dict],
+    limits: PredicateLimits,
+    overrun_counts,
+    cache_config: tuple[str | None, int] | None,
+    predicate_cache_paths: list[str],
+):
+    global _worker_inv_set
+    global _worker_limits
+    global _worker_overruns
+    global _worker_cache
+
+    # around predicate calls only, see check_inv._limited
+    if limits.memory is not None:
+        allow_memory_limit()
+
+    _worker_limits = limits
+    _worker_overruns = SharedOverruns(overrun_counts)
+    predicate_cache = None
+    if len(predicate_cache_paths) > 0:
+        predicate_cache = CompiledPredicateCache()
+        for path in predicate_cache_paths:
+            if os.path.exists(path):
+                predicate_cache.load(path)
+
+    invariants = []
+    with (
+        using_predicate_cache(predicate_cache)
+        if predicate_cache is not None
+        else contextlib.nullcontext()
+    ):
+        for j in invariant_jsons:
+            inv = Invariant()
+            inv.load_from_json(j)
+            invariants.append(inv)
+    _worker_inv_set = InvariantSet(invariants)
+    if cache_config is not None:
+        _worker_cache = VerdictCache(*cache_config)
+
+
+def _evaluate_chunk(
+    chunk: tuple[list[ProjectedTask], frozenset[int] | None],
+) -> tuple[list[EvalResult], VerdictCacheStats | None]:
+    tasks, only = chunk
+    results = list(
+        evaluate_tasks(
+            _worker_inv_set,
+            tasks,
+            _worker_limits,
+            _worker_overruns,
+            _worker_cache,
+            only,
+        )
+    )
+    if _worker_cache is None:
+        return results, None
+    # persisted for the other workers before the chunk is reported done
+    _worker_cache.flush()
+    return results, _worker_cache.take_stats()
+
+
+def _evaluate_chunk_profiled(
+    chunk: tuple[list[ProjectedTask], frozenset[int] | None],
+) -> tuple[list[EvalResult], VerdictCacheStats | None, dict[int, InvariantStats]]:
+    # stats are keyed by inv_id, the predicates of the worker are not the
+    # ones of the parent process
+    with InvariantProfiler() as profiler:
+        results, cache_stats = _evaluate_chunk(chunk)
+    inv_ids = {
+        entry.invariant.predicate: entry.inv_id for entry in _worker_inv_set.entries
+    }
+    return (
+        results,
+        cache_stats,
+        {inv_ids[key]: stats for key, stats in profiler.stats.items()},
+    )
+
+
+# Evaluates the predicates of `invariants` over logs. With num_workers > 0 the
+# logs are sharded in chunks over a forkserver pool whose workers load and
+# compile every predicate once, each log sent as its ProjectedLog; with num_workers == 0 everything runs in this
+# process, which is easier to debug. Results are streamed in completion order.
+# Every call runs under `limits` (no limits by default); invariants with
+# `limits.max_overruns` timeouts / memory errors end up in `flagged()`.
+# Workers report their predicate timings into the active InvariantProfilers.
+# With a `verdict_cache`, verdicts of payloads seen before are reused; workers
+# open their own cache from its config and report their hits into its stats.
+# With `predicate_cache_paths` (see CompiledPredicateCache), workers load the
+# predicates compiled by the parent instead of validating them again.
+# Predicates with an expression (see PredicateExpr) are evaluated in this
+# process, over all tasks of an api at once, before the rest is sharded.
+class InvariantEvaluator:
+    def __init__(
+        self,
+        invariants: list[Invariant],
+        num_workers: int = 0,
+        chunk_size: int = 64,
+        limits: PredicateLimits | None = None,
+        verdict_cache: VerdictCache | None = None,
+        predicate_cache_paths: list[str] | None = None,
+    ):
+        self.invariants = invariants
+        self.verdict_cache = verdict_cache
+        self.inv_set = InvariantSet(invariants)
+        self.has_exprs = any(entry.expr is not None for entry in self.inv_set.entries)
+        self.num_workers = num_workers
+        self.chunk_size = chunk_size
+        self.limits = limits if limits is not None else UNLIMITED
+        self.pool = None
+
+        # overruns seen by this process, and reported by all workers
+        self.local_overruns: dict[int, int] = defaultdict(int)
+        self.overruns: dict[int, int] = defaultdict(int)
+
+        if num_workers > 0:
+            ctx = multiprocessing.get_context("forkserver")
+            ctx.set_forkserver_preload([__name__])
+            self.pool = ctx.Pool(
+                num_workers,
+                initializer=_init_worker,
+                initargs=(
+                    [inv.save_to_json() for inv in invariants],
+                    self.limits,
+                    ctx.Array("q", len(invariants)),
+                    verdict_cache.config() if verdict_cache is not None else None,
+                    predicate_cache_paths if predicate_cache_paths is not None else [],
+                ),
+            )
+
+    def evaluate(
+        self,
+        tasks: typing.Iterable[EvalTask],
+        only: typing.Iterable[int] | None = None,
+    ) -> typing.Iterator[EvalResult]:
+        # with `only`, just the invariants of these ids are evaluated
+        only = frozenset(only) if only is not None else None
+        for result in self._evaluate(tasks, only):
+            if result[2] in PREDICATE_OVERRUNS:
+                self.overruns[result[0]] += 1
+            yield result
+
+    def _evaluate(
+        self, tasks: typing.Iterable[EvalTask], only: frozenset[int] | None
+    ) -> typing.Iterator[EvalResult]:
+        if self.has_exprs:
+            tasks = list(tasks)
+            yield from evaluate_exprs(self.inv_set, tasks, only)
+        if self.pool is None:
+            yield from evaluate_tasks(
+                self.inv_set,
+                tasks,
+                self.limits,
+                self.local_overruns,
+                self.verdict_cache,
+                only,
+            )
+            return
+
+        projected = (
+            (log_idx, project_log(self.inv_set, log_item, only))
+            for log_idx, log_item in tasks
+        )
+        chunks = iter(
+            lambda: (list(itertools.islice(projected, self.chunk_size)), only),
+            ([], only),
+        )
+        if not profiling():
+            for results, cache_stats in self.pool.imap_unordered(
+                _evaluate_chunk, chunks
+            ):
+                self._merge_cache_stats(cache_stats)
+                yield from results
+            return
+
+        for results, cache_stats, stats_by_inv in self.pool.imap_unordered(
+            _evaluate_chunk_profiled, chunks
+        ):
+            self._merge_cache_stats(cache_stats)
+            for inv_id, stats in stats_by_inv.items():
+                for profiler in active_profilers:
+                    profiler.get_stats(self.invariants[inv_id].predicate).merge(stats)
+            yield from results
+
+    def _merge_cache_stats(self, cache_stats: VerdictCacheStats | None):
+        if cache_stats is not None and self.verdict_cache is not None:
+            self.verdict_cache.stats.merge(cache_stats)
+
+    def flagged(self) -> list[int]:
+        return sorted(
+            inv_id
+            for inv_id, count in self.overruns.items()
+            if count >= self.limits.max_overruns
+        )
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,148 @@
+import bisect
+import math
+import typing
+import weakref
+
+from ..file_types.log_file import LogFile, LogItem
+from .base import APIDomainAllPlaceholder
+
+# two events are related when they are less than this many seconds apart
+RELATED_EVENT_SECONDS = 600
+
+ApiKey = typing.Union[str, APIDomainAllPlaceholder]
+SessionKey = typing.Callable[[LogItem], typing.Hashable]
+
+
+class _Series:
+    # events of one api (and session), in log order and in time order
+    def __init__(self, positions: list[int], times: list[float]):
+        self.positions = positions
+        self.times = times
+        by_time = sorted(
+            (i for i in range(len(positions)) if not math.isnan(times[i])),
+            key=lambda i: times[i],
+        )
+        self.sorted_times = [times[i] for i in by_time]
+        self.sorted_positions = [positions[i] for i in by_time]
+
+
+_EMPTY_SERIES = _Series([], [])
+# the series of all sessions
+_ALL_SESSIONS = object()
+
+
+def _parse_time(log: LogItem) -> float:
+    try:
+        return log.parse_time()
+    except ValueError:
+        # never related to anything
+        return math.nan
+
+
+# Per-api index of the events of a LogFile, answering "nearest event of api X
+# before / after" by binary search instead of walking the whole file. Events of
+# every api are also merged into one series for APIDomainAllPlaceholder. With
+# `session_key`, events are further split by its value, e.g. by the
+# authorization header, and queries can be restricted to one session.
+class EventIndex:
+    def __init__(self, logs: LogFile, session_key: SessionKey | None = None):
+        self.log_items = logs.log_items
+        self.size = len(logs.log_items)
+        self.session_key = session_key
+        self.times = [_parse_time(log) for log in logs.log_items]
+        self.time_sorted = all(a <= b for a, b in zip(self.times, self.times[1:]))
+
+        positions_by_key: dict[tuple, list[int]] = {}
+        for position, log in enumerate(logs.log_items):
+            keys = [(log.api, _ALL_SESSIONS), (None, _ALL_SESSIONS)]
+            if session_key is not None:
+                session = session_key(log)
+                keys += [(log.api, session), (None, session)]
+            for key in keys:
+                positions_by_key.setdefault(key, []).append(position)
+
+        self.series_by_key = {
+            key: _Series(positions, [self.times[p] for p in positions])
+            for key, positions in positions_by_key.items()
+        }
+
+    def series(self, api: ApiKey, session: typing.Hashable = _ALL_SESSIONS) -> _Series:
+        api_key = None if isinstance(api, APIDomainAllPlaceholder) else api
+        return self.series_by_key.get((api_key, session), _EMPTY_SERIES)
+
+    def nearest_related(
+        self,
+        log_idx: int,
+        api: ApiKey,
+        direction: typing.Literal["before", "after"],
+        within: float = RELATED_EVENT_SECONDS,
+        session: typing.Hashable = _ALL_SESSIONS,
+    ) -> int:
+        # position of the closest event of `api` (of `session`) before / after
+        # position `log_idx` in log order which is less than `within` seconds
+        # away from it, -1 if there is none
+        series = self.series(api, session)
+        t = self.times[log_idx]
+        if direction == "before":
+            k = bisect.bisect_left(series.positions, log_idx) - 1
+            step = -1
+        elif direction == "after":
+            k = bisect.bisect_right(series.positions, log_idx)
+            step = 1
+        else:
+            raise ValueError(f"Invalid direction: {direction}")
+
+        while 0 <= k < len(series.positions):
+            if abs(t - series.times[k]) < within:
+                return series.positions[k]
+            if self.time_sorted:
+                # every event further away in log order is further in time
+                return -1
+            k += step
+        return -1
+
+    def nearest(
+        self,
+        api: ApiKey,
+        t: float,
+        direction: typing.Literal["before", "after"],
+        within: float = RELATED_EVENT_SECONDS,
+        session: typing.Hashable = _ALL_SESSIONS,
+    ) -> int:
+        # position of the latest event of `api` (of `session`) at or before
+        # time `t`, or of the earliest at or after it, less than `within`
+        # seconds away as in nearest_related; -1 if there is none. Unlike
+        # nearest_related it is a binary search whether or not the logs are
+        # in time order
+        series = self.series(api, session)
+        if direction == "before":
+            k = bisect.bisect_right(series.sorted_times, t) - 1
+        elif direction == "after":
+            k = bisect.bisect_left(series.sorted_times, t)
+        else:
+            raise ValueError(f"Invalid direction: {direction}")
+        if (
+            0 <= k < len(series.sorted_times)
+            and abs(t - series.sorted_times[k]) < within
+        ):
+            return series.sorted_positions[k]
+        return -1
+
+
+_event_indexes: "weakref.WeakKeyDictionary[LogFile, EventIndex]" = (
+    weakref.WeakKeyDictionary()
+)
+
+
+def get_event_index(logs: LogFile) -> EventIndex:
+    # the index of `logs`, built on first use and rebuilt when its log items
+    # change
+    index = _event_indexes.get(logs, None)
+    if (
+        index is None
+        or index.log_items is not logs.log_items
+        or index.size != len(logs.log_items)
+    ):
+        index = EventIndex(logs)
+        _event_indexes[logs] = index
+    return index
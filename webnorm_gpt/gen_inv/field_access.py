@@ -0,0 +1,253 @@
+import ast
+import typing
+
+# The part of a predicate argument a predicate may read, as a tree of JSON
+# paths: a dict maps each key that is read to the tree below it, and
+# ALL_FIELDS (None) means the whole value at that position is needed.
+#
+#     {"arguments": {"orderId": None}, "db_info": {"orders": None}}
+#
+# A top level ALL_FIELDS means the analysis was inconclusive and the full
+# `to_execute_json` payload has to be built.
+AccessTree = typing.Optional[dict[str, "AccessTree"]]
+ALL_FIELDS: AccessTree = None
+
+Path = tuple  # (argument index, key, key, ...)
+
+# names through which code can reach the arguments without naming them
+_OPAQUE_NAMES = {
+    "eval",
+    "exec",
+    "globals",
+    "locals",
+    "vars",
+    "__import__",
+    "__builtins__",
+}
+_OPAQUE_ATTRIBUTES = {"f_locals", "_getframe", "currentframe"}
+
+
+class _Inconclusive(Exception):
+    pass
+
+
+# marks a subtree needed as a whole while the tree is being built
+_WHOLE = object()
+
+
+def _insert(tree: dict, keys: tuple, whole: bool):
+    for key in keys:
+        if _WHOLE in tree:
+            return
+        tree = tree.setdefault(key, {})
+    if whole:
+        tree.clear()
+        tree[_WHOLE] = True
+
+
+def _finish(tree: dict) -> AccessTree:
+    if _WHOLE in tree:
+        return ALL_FIELDS
+    return {key: _finish(sub) for key, sub in tree.items()}
+
+
+def merge_access(a: AccessTree, b: AccessTree) -> AccessTree:
+    if a is ALL_FIELDS or b is ALL_FIELDS:
+        return ALL_FIELDS
+    result = dict(a)
+    for key, sub in b.items():
+        result[key] = merge_access(result[key], sub) if key in result else sub
+    return result
+
+
+# Static analysis of a predicate's `check` function. Every argument is
+# followed through constant subscripts, `.get(<constant>, ...)` calls and
+# plain-name aliases (`args = data["arguments"]`); any other use of a value
+# (iteration, truthiness, passing it to a function, ...) needs that value as a
+# whole. Aliases are tracked by name over the whole module, ignoring control
+# flow and scopes, which can only over-approximate what is read.
+class _FieldAccessAnalyzer:
+    def __init__(self, module: ast.Module, num_args: int):
+        self.module = module
+        self.aliases: dict[str, set[Path]] = {}
+        self.tree: dict = {}
+
+        check = None
+        for node in module.body:
+            if isinstance(node, ast.FunctionDef) and node.name == "check":
+                check = node
+        if check is None:
+            raise _Inconclusive()
+        args = check.args
+        if args.vararg or args.kwarg or args.kwonlyargs or args.defaults:
+            raise _Inconclusive()
+        params = args.posonlyargs + args.args
+        if len(params) != num_args:
+            raise _Inconclusive()
+        for idx, param in enumerate(params):
+            self.aliases[param.arg] = {(idx,)}
+        self.num_args = num_args
+
+    def resolve(self, node: ast.AST) -> typing.Optional[set[Path]]:
+        # the paths an expression may evaluate to, None if it is not a path
+        if isinstance(node, ast.Name) and isinstance(node.ctx, ast.Load):
+            return self.aliases.get(node.id, None)
+        if isinstance(node, ast.Subscript):
+            key = node.slice
+            if isinstance(key, ast.Constant) and isinstance(key.value, str):
+                paths = self.resolve(node.value)
+                if paths is not None:
+                    return {path + (key.value,) for path in paths}
+            return None
+        if (
+            isinstance(node, ast.Call)
+            and isinstance(node.func, ast.Attribute)
+            and node.func.attr == "get"
+            and 1 <= len(node.args) <= 2
+            and len(node.keywords) == 0
+            and isinstance(node.args[0], ast.Constant)
+            and isinstance(node.args[0].value, str)
+        ):
+            paths = self.resolve(node.func.value)
+            if paths is not None:
+                return {path + (node.args[0].value,) for path in paths}
+        return None
+
+    def collect_aliases(self):
+        # names bound to a path, until no alias is added
+        changed = True
+        while changed:
+            changed = False
+            for node in ast.walk(self.module):
+                if isinstance(node, ast.Assign):
+                    targets, value = node.targets, node.value
+                elif isinstance(node, (ast.AnnAssign, ast.NamedExpr)):
+                    targets, value = [node.target], node.value
+                else:
+                    continue
+                if value is None:
+                    continue
+                paths = self.resolve(value)
+                if paths is None:
+                    continue
+                for target in targets:
+                    if not isinstance(target, ast.Name):
+                        continue
+                    known = self.aliases.setdefault(target.id, set())
+                    if not paths <= known:
+                        known |= paths
+                        changed = True
+
+    def record(self, paths: set[Path], whole: bool):
+        for path in paths:
+            _insert(self.tree.setdefault(path[0], {}), path[1:], whole)
+
+    def visit_path_extras(self, node: ast.AST):
+        # the parts of a path expression that are not the path itself
+        while True:
+            if isinstance(node, ast.Subscript):
+                node = node.value
+            elif isinstance(node, ast.Call):
+                for arg in node.args[1:]:
+                    self.visit(arg)
+                node = node.func.value  # type: ignore
+            else:
+                return
+
+    def visit(self, node: ast.AST):
+        if isinstance(node, ast.Name) and node.id in _OPAQUE_NAMES:
+            raise _Inconclusive()
+        if isinstance(node, ast.Attribute) and node.attr in _OPAQUE_ATTRIBUTES:
+            raise _Inconclusive()
+
+        paths = self.resolve(node)
+        if paths is not None:
+            self.record(paths, whole=True)
+            self.visit_path_extras(node)
+            return
+
+        # uses which only need the value to be there, not all of it
+        if isinstance(node, (ast.Assign, ast.AnnAssign, ast.NamedExpr)):
+            paths = self.resolve(node.value) if node.value is not None else None
+            if paths is not None:
+                # read through the alias
+                self.record(paths, whole=False)
+                self.visit_path_extras(node.value)
+                targets = (
+                    node.targets if isinstance(node, ast.Assign) else [node.target]
+                )
+                for target in targets:
+                    if not isinstance(target, ast.Name):
+                        self.visit(target)
+                return
+        elif (
+            isinstance(node, ast.Compare)
+            and len(node.ops) == 1
+            and isinstance(node.ops[0], (ast.In, ast.NotIn))
+            and isinstance(node.left, ast.Constant)
+            and isinstance(node.left.value, str)
+        ):
+            # "key" in value, only the presence of the key is read
+            paths = self.resolve(node.comparators[0])
+            if paths is not None:
+                self.record({path + (node.left.value,) for path in paths}, whole=False)
+                self.visit_path_extras(node.comparators[0])
+                return
+        elif (
+            isinstance(node, ast.Compare)
+            and all(isinstance(op, (ast.Is, ast.IsNot)) for op in node.ops)
+        ) or (
+            isinstance(node, ast.Call)
+            and isinstance(node.func, ast.Name)
+            and node.func.id == "isinstance"
+            and len(node.args) == 2
+        ):
+            # identity and type checks, only the type of the value is read
+            operands = (
+                [node.left] + node.comparators
+                if isinstance(node, ast.Compare)
+                else node.args
+            )
+            for operand in operands:
+                paths = self.resolve(operand)
+                if paths is not None:
+                    self.record(paths, whole=False)
+                    self.visit_path_extras(operand)
+                else:
+                    self.visit(operand)
+            if isinstance(node, ast.Call):
+                self.visit(node.func)
+            return
+
+        for child in ast.iter_child_nodes(node):
+            self.visit(child)
+
+    def analyze(self) -> list[AccessTree]:
+        self.collect_aliases()
+        self.visit(self.module)
+        return [
+            _finish(self.tree[idx]) if idx in self.tree else {}
+            for idx in range(self.num_args)
+        ]
+
+
+def analyze_field_access(py_code: str, num_args: int) -> list[AccessTree]:
+    # one AccessTree per argument of `check`, ALL_FIELDS for every argument
+    # when the code can not be analyzed
+    try:
+        module = ast.parse(py_code)
+        return _FieldAccessAnalyzer(module, num_args).analyze()
+    except (SyntaxError, ValueError, RecursionError, _Inconclusive):
+        return [ALL_FIELDS] * num_args
+
+
+def project_json(value: typing.Any, access: AccessTree) -> typing.Any:
+    # `value` restricted to the keys in `access`; anything but a plain dict,
+    # e.g. a list or None, is kept as is
+    if access is ALL_FIELDS or type(value) is not dict:
+        return value
+    return {
+        key: project_json(value[key], sub)
+        for key, sub in access.items()
+        if key in value
+    }
@@ -15,9 +15,10 @@ from ..schema_induction.db import DbSchema, DbValue
 from ..schema_induction.schema import JsonSchema, JsonSchemaTypes, schema_json_to_string
 from .base import APIDomain, Field, Invariant, Predicate, Premise, RelatedFields
 from .check_inv import (
+    PREDICATE_OVERRUNS,
+    PredicateLimits,
     find_nearest_related_event,
     run_py_predicate,
-    run_py_predicate_new_json_format,
 )
 from .prompts import (
     COMMONSENSE_CONSTRAINT_FEEDBACK,
@@ -31,6 +32,8 @@ from .prompts import (
     DATA_CONSTRAINT_SYSTEM,
     DATA_CONSTRAINT_USER,
 )
+from .staged_validation import StagedValidator
+from .verdict_cache import VerdictCache
 
 
 class InvGenerator(ABC):
@@ -533,12 +536,18 @@ class InvGeneratorCommonSenseNewJsonFormat(InvGenerator):
         no_log_log=False,
         no_env=False,
         no_schema=False,
+        predicate_limits: PredicateLimits | None = None,
+        verdict_cache: VerdictCache | None = None,
     ):
         self.api = api
         self.random_seed = random_seed
         self.gpt_invoker = gpt_invoker
         self.proj_desc = proj_desc
         self.predict_only_schema = predict_only_schema
+        if predicate_limits is None:
+            predicate_limits = PredicateLimits()
+        self.predicate_limits = predicate_limits
+        self.verdict_cache = verdict_cache
         self.output_file = output_file
         if proj_desc is not None:
             self.api_desc = proj_desc.api_map[api]
@@ -686,6 +695,13 @@ class InvGeneratorCommonSenseNewJsonFormat(InvGenerator):
             {"role": "user", "content": prompt_user},
         ]
 
+        validator = StagedValidator(
+            [log for _, log in logs_all],
+            related_fields,
+            json_to_schema,
+            self.predicate_limits,
+            verdict_cache=self.verdict_cache,
+        )
         for idx_turn in range(self.gpt_invoker.turns):
             if idx_turn > 10:
                 logger.warning(
@@ -718,15 +734,17 @@ class InvGeneratorCommonSenseNewJsonFormat(InvGenerator):
 
                 invariant = Invariant.construct_from([api_domain], premise, predicate)
 
-                for _, log in logs_all:
-                    check_res, e = run_py_predicate_new_json_format(
-                        predicate, [log], [related_fields]
-                    )
-                    if not check_res:
-                        log_str = json_to_trim_str(log.to_execute_json(related_fields))
+                failure = validator.validate(predicate)
+                if failure is not None:
+                    log, verdict, e = failure
+                    log_str = json_to_trim_str(log.to_execute_json(related_fields))
+                    if verdict in PREDICATE_OVERRUNS:
                         raise ValueError(
-                            f"Checker failed for log: {log_str}.\nNested Error: {e}"
+                            f"Checker is too slow or uses too much memory for log: {log_str}.\nNested Error: {e}"
                         )
+                    raise ValueError(
+                        f"Checker failed for log: {log_str}.\nNested Error: {e}"
+                    )
 
                 if self.output_file is not None:
                     out = DUMP_TEMPLATE.format(
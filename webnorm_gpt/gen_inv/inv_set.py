@@ -0,0 +1,156 @@
+import contextlib
+import json
+import typing
+from collections.abc import Mapping
+from dataclasses import dataclass, field
+
+from .. import logger
+from .base import Invariant, RelatedFields
+from .check_inv import InvChecker, find_checker
+from .field_access import ALL_FIELDS, AccessTree, merge_access
+from .predicate_cache import (
+    CompiledPredicateCache,
+    predicate_cache_path,
+    using_predicate_cache,
+)
+from .predicate_expr import PredicateExpr
+
+
+@dataclass
+class InvariantEntry:
+    inv_id: int
+    invariant: Invariant
+    checker: InvChecker | None
+    related_fields: RelatedFields
+    # paths of the log projection the predicate may read
+    access: AccessTree
+    # the declarative form of the predicate, evaluated instead of it
+    expr: PredicateExpr | None
+
+
+@dataclass
+class InvariantGroup:
+    # invariants of one api reading the same projection of a log, `access`
+    # covers what any of them may read
+    related_fields: RelatedFields
+    entries: list[InvariantEntry]
+    access: AccessTree = field(default_factory=dict)
+
+
+def load_invariants_file(
+    inv_path: str, use_predicate_cache: bool = True
+) -> list[Invariant]:
+    # one invariant per line, as written by the invariant generation; their
+    # compiled predicates are cached next to the file, see
+    # CompiledPredicateCache
+    cache = None
+    if use_predicate_cache:
+        cache = CompiledPredicateCache(predicate_cache_path(inv_path))
+
+    invariants: list[Invariant] = []
+    with open(inv_path, "rt") as f, (
+        using_predicate_cache(cache) if cache is not None else contextlib.nullcontext()
+    ):
+        for line in f:
+            inv = json.loads(line)
+            i = Invariant()
+            i.load_from_json(inv)
+            invariants.append(i)
+
+    if cache is not None:
+        try:
+            cache.save()
+        except OSError as e:
+            logger.warning("Failed to save predicate cache %s: %s", cache.path, e)
+    return invariants
+
+
+def related_fields_key(related_fields: RelatedFields) -> tuple:
+    return tuple(sorted(related_fields.save_to_json().items()))
+
+
+# Invariants dispatched by the api of their first domain: api -> entries in
+# invariant order. Each api's entries are also grouped by identical
+# RelatedFields, so a log only has to be projected once per group, and only
+# to the paths the group's predicates may read.
+class InvariantSet(Mapping):
+    def __init__(self, invariants: list[Invariant]):
+        self.invariants = invariants
+        self.entries: list[InvariantEntry] = []
+        self.entries_by_api: dict[str, list[InvariantEntry]] = {}
+        self.groups_by_api: dict[str, list[InvariantGroup]] = {}
+
+        group_by_key: dict[tuple, InvariantGroup] = {}
+        for inv_id, inv in enumerate(invariants):
+            api = inv.domain[0].api
+            related_fields = inv.domain[0].related_fields
+            access = inv.predicate.field_access
+            entry = InvariantEntry(
+                inv_id,
+                inv,
+                find_checker(inv),
+                related_fields,
+                access[0] if len(access) > 0 else {},
+                inv.predicate.compiled_expr,
+            )
+            self.entries.append(entry)
+            self.entries_by_api.setdefault(api, []).append(entry)  # type: ignore
+
+            key = (api, related_fields_key(related_fields))
+            if key not in group_by_key:
+                group_by_key[key] = InvariantGroup(related_fields, [])
+                self.groups_by_api.setdefault(api, []).append(group_by_key[key])  # type: ignore
+            group = group_by_key[key]
+            group.entries.append(entry)
+            group.access = merge_access(group.access, entry.access)
+
+    def __getitem__(self, api: str) -> list[InvariantEntry]:
+        return self.entries_by_api[api]
+
+    def __iter__(self) -> typing.Iterator[str]:
+        return iter(self.entries_by_api)
+
+    def __len__(self) -> int:
+        return len(self.entries_by_api)
+
+    def groups(self, api: str) -> list[InvariantGroup]:
+        return self.groups_by_api.get(api, [])
+
+    def checker(self, inv_id: int) -> InvChecker | None:
+        return self.entries[inv_id].checker
+
+    def reached_joins(
+        self, api: str
+    ) -> tuple[typing.Optional[set[str]], typing.Optional[set[str]]]:
+        # names of the `db_info` tables and `related_events` the predicates of
+        # `api` may read, None when they may read all of them
+        db_access: AccessTree = {}
+        event_access: AccessTree = {}
+        for group in self.groups(api):
+            fields = group.related_fields
+            if not isinstance(fields, RelatedFields):
+                continue
+            if fields.include_db_info:
+                db_access = merge_access(
+                    db_access, section_access(group.access, "db_info")
+                )
+            if fields.include_related_log:
+                event_access = merge_access(
+                    event_access, section_access(group.access, "related_events")
+                )
+        return (
+            None if db_access is ALL_FIELDS else set(db_access),
+            None if event_access is ALL_FIELDS else set(event_access),
+        )
+
+    def reached_joins_by_api(
+        self,
+    ) -> dict[str, tuple[typing.Optional[set[str]], typing.Optional[set[str]]]]:
+        # reached_joins of every api with invariants, as PreparedJoinAll takes
+        return {api: self.reached_joins(api) for api in self.groups_by_api}
+
+
+def section_access(access: AccessTree, key: str) -> AccessTree:
+    if access is ALL_FIELDS:
+        return ALL_FIELDS
+    return access[key] if key in access else {}
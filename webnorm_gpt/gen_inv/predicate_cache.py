@@ -0,0 +1,100 @@
+import contextlib
+import importlib.util
+import marshal
+import os
+import tempfile
+import types
+import typing
+
+from .. import logger
+
+# the cache of an invariant file is kept next to it
+PREDICATE_CACHE_SUFFIX = ".predicates"
+
+
+def predicate_cache_path(inv_path: str) -> str:
+    return inv_path + PREDICATE_CACHE_SUFFIX
+
+
+# Compiled code of predicate sources which passed check_valid_predicate_code,
+# keyed by Predicate.code_digest. A predicate found here is exec'ed from its
+# code object instead of being compiled and validated again. The file is the
+# marshal of {digest: code} behind the bytecode magic number of the running
+# Python; a file of another version, or one which can not be read, is
+# ignored, and every predicate is validated in full as if there was none.
+class CompiledPredicateCache:
+    def __init__(self, path: str | None = None):
+        self.path = path
+        self.codes: dict[bytes, types.CodeType] = {}
+        self.dirty = False
+        self.hits = 0
+        self.misses = 0
+        if path is not None and os.path.exists(path):
+            self.load()
+
+    def load(self, path: str | None = None):
+        # adds the codes of the cache file at `path`, by default this cache's
+        path = path if path is not None else self.path
+        assert path is not None
+        magic = importlib.util.MAGIC_NUMBER
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            if not data.startswith(magic):
+                logger.info("Predicate cache %s is of another Python", path)
+                return
+            codes = marshal.loads(data[len(magic) :])
+        except (OSError, EOFError, ValueError, TypeError) as e:
+            logger.warning("Failed to read predicate cache %s: %s", path, e)
+            return
+        if isinstance(codes, dict):
+            self.codes.update(codes)
+
+    def get(self, digest: bytes) -> types.CodeType | None:
+        code = self.codes.get(digest, None)
+        if code is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return code
+
+    def add(self, digest: bytes, code: types.CodeType):
+        if digest not in self.codes:
+            self.codes[digest] = code
+            self.dirty = True
+
+    def save(self):
+        # written to a temporary file first, readers never see a partial file
+        if self.path is None or not self.dirty:
+            return
+        folder = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(dir=folder, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(importlib.util.MAGIC_NUMBER)
+                marshal.dump(self.codes, f)
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        self.dirty = False
+
+
+# The cache Predicate.load_py_code looks predicates up in, set with
+# `using_predicate_cache`.
+_active_caches: list[CompiledPredicateCache] = []
+
+
+@contextlib.contextmanager
+def using_predicate_cache(
+    cache: CompiledPredicateCache,
+) -> typing.Iterator[CompiledPredicateCache]:
+    _active_caches.append(cache)
+    try:
+        yield cache
+    finally:
+        _active_caches.remove(cache)
+
+
+def active_predicate_cache() -> CompiledPredicateCache | None:
+    return _active_caches[-1] if len(_active_caches) > 0 else None
@@ -0,0 +1,658 @@
+import ast
+import typing
+from dataclasses import dataclass
+
+import numpy as np
+
+from ..schema_induction.column_store import (
+    DictEncodedColumnValues,
+    PrimitiveColumnValues,
+    pack_primitive,
+    pack_str,
+    take_values,
+)
+from .field_access import ALL_FIELDS, AccessTree, merge_access
+
+# Declarative form of a single argument predicate, checked instead of its
+# `check` function when present. It is a Python expression over the sections
+# of the `to_execute_json` payload:
+#
+#     arguments.price >= 0 and db_info.orders.status in [0, 1, 2]
+#     response.orderId == related_events["/api/v1/order"].arguments.id
+#     len(arguments.name) <= 64 and db_info.users.email is not None
+#
+# A path is null when a key on it is missing or its parent is not an object
+# (integer keys index lists). Values are nulls, numbers, booleans, strings and
+# the rest (objects and lists); values of different kinds are never equal and
+# only numbers and strings are ordered. A comparison, `in` / `not in` a list
+# of constants, is false when an operand is null, `x != 1` included, and
+# `is None` / `is not None` test for null. `+ - * /` work on numbers in double
+# precision, anything else or a division by zero is null, and `len` is the
+# length of a string, object or list. A bare value is true only if it is the
+# boolean true. The predicate passes a log iff the expression is true.
+#
+# Over a batch of logs the expression is evaluated column by column with
+# NumPy, see ExprBatch; `db_info` columns of joined logs are read from the
+# typed DbTable columns directly, without building any payload.
+EXPR_SECTIONS = (
+    "arguments",
+    "response",
+    "headers",
+    "env",
+    "db_info",
+    "related_events",
+)
+
+ExprPath = tuple  # (section, key, key, ...), keys are str or int
+
+# err of a log an expression does not hold on
+EXPR_FAILURE = "check expression return False"
+
+
+class PredicateExprError(ValueError):
+    pass
+
+
+@dataclass(frozen=True)
+class PathNode:
+    path: ExprPath
+
+
+@dataclass(frozen=True)
+class ConstNode:
+    value: typing.Any
+
+
+@dataclass(frozen=True)
+class LenNode:
+    operand: typing.Any
+
+
+@dataclass(frozen=True)
+class ArithNode:
+    op: str
+    left: typing.Any
+    right: typing.Any
+
+
+@dataclass(frozen=True)
+class CompareNode:
+    op: str
+    left: typing.Any
+    right: typing.Any
+
+
+@dataclass(frozen=True)
+class MemberNode:
+    operand: typing.Any
+    values: tuple
+    negated: bool
+
+
+@dataclass(frozen=True)
+class IsNullNode:
+    operand: typing.Any
+    negated: bool
+
+
+@dataclass(frozen=True)
+class BoolNode:
+    op: str  # "and" or "or"
+    operands: tuple
+
+
+@dataclass(frozen=True)
+class NotNode:
+    operand: typing.Any
+
+
+_COMPARE_OPS = {
+    ast.Eq: "==",
+    ast.NotEq: "!=",
+    ast.Lt: "<",
+    ast.LtE: "<=",
+    ast.Gt: ">",
+    ast.GtE: ">=",
+}
+_ARITH_OPS = {ast.Add: "+", ast.Sub: "-", ast.Mult: "*", ast.Div: "/"}
+
+
+class _ExprParser:
+    def __init__(self, source: str):
+        self.source = source
+        self.paths: list[ExprPath] = []
+
+    def parse(self):
+        try:
+            tree = ast.parse(self.source.strip(), mode="eval")
+        except SyntaxError as e:
+            raise PredicateExprError(f"invalid expression: {e.msg}") from None
+        return self.condition(tree.body)
+
+    def fail(self, node: ast.AST, what: str):
+        raise PredicateExprError(f"{what} is not supported: {ast.unparse(node)}")
+
+    def condition(self, node: ast.expr):
+        if isinstance(node, ast.BoolOp):
+            op = "and" if isinstance(node.op, ast.And) else "or"
+            return BoolNode(op, tuple(self.condition(v) for v in node.values))
+        if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.Not):
+            return NotNode(self.condition(node.operand))
+        if isinstance(node, ast.Compare):
+            # a < b < c is a < b and b < c
+            parts = []
+            left = node.left
+            for op, right in zip(node.ops, node.comparators):
+                parts.append(self.comparison(left, op, right))
+                left = right
+            return parts[0] if len(parts) == 1 else BoolNode("and", tuple(parts))
+        return self.value(node)
+
+    def comparison(self, left: ast.expr, op: ast.cmpop, right: ast.expr):
+        if type(op) in _COMPARE_OPS:
+            return CompareNode(
+                _COMPARE_OPS[type(op)], self.value(left), self.value(right)
+            )
+        if isinstance(op, (ast.Is, ast.IsNot)):
+            if not (isinstance(right, ast.Constant) and right.value is None):
+                self.fail(right, "`is` with anything but None")
+            return IsNullNode(self.value(left), isinstance(op, ast.IsNot))
+        if isinstance(op, (ast.In, ast.NotIn)):
+            if not isinstance(right, (ast.List, ast.Tuple, ast.Set)):
+                self.fail(right, "`in` with anything but a list of constants")
+            values = tuple(self.constant(v) for v in right.elts)
+            return MemberNode(self.value(left), values, isinstance(op, ast.NotIn))
+        self.fail(right, "the comparison")
+
+    def constant(self, node: ast.expr):
+        if (
+            isinstance(node, ast.UnaryOp)
+            and isinstance(node.op, ast.USub)
+            and isinstance(node.operand, ast.Constant)
+            and _kind(node.operand.value) == "num"
+        ):
+            return -node.operand.value
+        if isinstance(node, ast.Constant) and _kind(node.value) in (
+            "num",
+            "bool",
+            "str",
+        ):
+            return node.value
+        self.fail(node, "the constant")
+
+    def value(self, node: ast.expr):
+        if isinstance(node, ast.Constant):
+            return ConstNode(self.constant(node))
+        if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.USub):
+            if isinstance(node.operand, ast.Constant):
+                return ConstNode(self.constant(node))
+            return ArithNode("-", ConstNode(0), self.value(node.operand))
+        if isinstance(node, ast.BinOp) and type(node.op) in _ARITH_OPS:
+            return ArithNode(
+                _ARITH_OPS[type(node.op)], self.value(node.left), self.value(node.right)
+            )
+        if (
+            isinstance(node, ast.Call)
+            and isinstance(node.func, ast.Name)
+            and node.func.id == "len"
+            and len(node.args) == 1
+            and len(node.keywords) == 0
+        ):
+            return LenNode(self.value(node.args[0]))
+        if isinstance(node, (ast.Name, ast.Attribute, ast.Subscript)):
+            path = self.path(node)
+            self.paths.append(path)
+            return PathNode(path)
+        self.fail(node, "the expression")
+
+    def path(self, node: ast.expr) -> ExprPath:
+        keys = []
+        while not isinstance(node, ast.Name):
+            if isinstance(node, ast.Attribute):
+                keys.append(node.attr)
+                node = node.value
+            elif isinstance(node, ast.Subscript):
+                key = self.constant(node.slice)
+                if type(key) not in (str, int):
+                    self.fail(node, "the key")
+                keys.append(key)
+                node = node.value
+            else:
+                self.fail(node, "the path")
+        if node.id not in EXPR_SECTIONS:
+            raise PredicateExprError(
+                f"paths start at one of {', '.join(EXPR_SECTIONS)}, not {node.id}"
+            )
+        keys.append(node.id)
+        return tuple(reversed(keys))
+
+
+def _kind(value: typing.Any) -> str:
+    if value is None:
+        return "null"
+    if type(value) is bool:
+        return "bool"
+    if type(value) in (int, float):
+        return "num"
+    if type(value) is str:
+        return "str"
+    return "object"
+
+
+def _path_access(path: ExprPath) -> AccessTree:
+    # everything below an integer key is needed, projections keep lists whole
+    access: AccessTree = ALL_FIELDS
+    keys = list(path)
+    for idx, key in enumerate(keys):
+        if type(key) is not str:
+            keys = keys[:idx]
+            break
+    for key in reversed(keys):
+        access = {key: access}
+    return access
+
+
+# A parsed predicate expression, see the top of this file.
+class PredicateExpr:
+    def __init__(self, source: str):
+        parser = _ExprParser(source)
+        self.source = source
+        self.root = parser.parse()
+        self.paths: list[ExprPath] = list(dict.fromkeys(parser.paths))
+        # what the expression reads of the `to_execute_json` payload
+        self.access: AccessTree = {}
+        for path in self.paths:
+            self.access = merge_access(self.access, _path_access(path))
+
+    def __str__(self):
+        return self.source
+
+    def holds(self, payload: dict) -> bool:
+        # on one `to_execute_json` payload
+        return _holds(self.root, payload)
+
+
+def resolve_path(payload: typing.Any, path: ExprPath) -> typing.Any:
+    value = payload
+    for key in path:
+        if type(key) is str:
+            if type(value) is not dict:
+                return None
+            value = value.get(key, None)
+        else:
+            if type(value) is not list or not -len(value) <= key < len(value):
+                return None
+            value = value[key]
+    return value
+
+
+# Row at a time, on python values.
+
+
+def _compare_values(op: str, left: typing.Any, right: typing.Any) -> bool:
+    left_kind = _kind(left)
+    right_kind = _kind(right)
+    if left_kind == "null" or right_kind == "null":
+        return False
+    if op == "==":
+        return left_kind == right_kind and left == right
+    if op == "!=":
+        return left_kind != right_kind or left != right
+    if left_kind != right_kind or left_kind not in ("num", "str"):
+        return False
+    if op == "<":
+        return left < right
+    if op == "<=":
+        return left <= right
+    if op == ">":
+        return left > right
+    return left >= right
+
+
+def _arith_values(op: str, left: typing.Any, right: typing.Any) -> float | None:
+    if _kind(left) != "num" or _kind(right) != "num":
+        return None
+    left = float(left)
+    right = float(right)
+    if op == "+":
+        return left + right
+    if op == "-":
+        return left - right
+    if op == "*":
+        return left * right
+    if right == 0:
+        return None
+    return left / right
+
+
+def _len_value(value: typing.Any) -> int | None:
+    if type(value) in (str, list, dict):
+        return len(value)
+    return None
+
+
+def _value(node, payload: dict) -> typing.Any:
+    if isinstance(node, PathNode):
+        return resolve_path(payload, node.path)
+    if isinstance(node, ConstNode):
+        return node.value
+    if isinstance(node, LenNode):
+        return _len_value(_value(node.operand, payload))
+    assert isinstance(node, ArithNode)
+    return _arith_values(
+        node.op, _value(node.left, payload), _value(node.right, payload)
+    )
+
+
+def _holds(node, payload: dict) -> bool:
+    if isinstance(node, CompareNode):
+        return _compare_values(
+            node.op, _value(node.left, payload), _value(node.right, payload)
+        )
+    if isinstance(node, MemberNode):
+        value = _value(node.operand, payload)
+        if value is None:
+            return False
+        found = any(_compare_values("==", value, v) for v in node.values)
+        return found != node.negated
+    if isinstance(node, IsNullNode):
+        return (_value(node.operand, payload) is None) == (not node.negated)
+    if isinstance(node, BoolNode):
+        if node.op == "and":
+            return all(_holds(v, payload) for v in node.operands)
+        return any(_holds(v, payload) for v in node.operands)
+    if isinstance(node, NotNode):
+        return not _holds(node.operand, payload)
+    return _value(node, payload) is True
+
+
+# Column at a time. An ExprColumn holds one value per row: `data` is a
+# numeric array for "num", a bool array for "bool", codes into `dictionary`
+# for "str" and python values for "object", which may mix kinds; `valid` is
+# False where the value is null.
+@dataclass
+class ExprColumn:
+    kind: str
+    data: np.ndarray
+    valid: np.ndarray
+    dictionary: list[str] | None = None
+
+    def objects(self) -> list:
+        if self.kind == "str":
+            assert self.dictionary is not None
+            dictionary = self.dictionary
+            return [
+                dictionary[code] if ok else None
+                for code, ok in zip(self.data.tolist(), self.valid.tolist())
+            ]
+        return [
+            value if ok else None
+            for value, ok in zip(self.data.tolist(), self.valid.tolist())
+        ]
+
+
+def _null_column(n: int) -> ExprColumn:
+    return ExprColumn(
+        "object", np.full(n, None, dtype=object), np.zeros(n, dtype=np.bool_)
+    )
+
+
+def column_from_values(values: typing.Sequence) -> ExprColumn:
+    # packs python values, or typed column values of a DbTable
+    if isinstance(values, DictEncodedColumnValues):
+        return ExprColumn("str", values.codes, values.codes >= 0, values.dictionary)
+    if isinstance(values, PrimitiveColumnValues):
+        kind = "bool" if values.data.dtype == np.bool_ else "num"
+        return ExprColumn(kind, values.data, values.valid)
+    values = list(values)
+    kinds = {_kind(value) for value in values} - {"null"}
+    if len(kinds) == 1:
+        packed = None
+        if kinds == {"str"}:
+            packed = pack_str(values)
+        elif kinds == {"bool"}:
+            packed = pack_primitive(values, bool, np.bool_)
+        elif kinds == {"num"}:
+            # ints and floats mixed stay python values, compared exactly
+            types = {type(value) for value in values if value is not None}
+            if types == {int}:
+                packed = pack_primitive(values, int, np.int64)
+            elif types == {float}:
+                packed = pack_primitive(values, float, np.float64)
+        if packed is not None and not isinstance(packed, list):
+            return column_from_values(packed)
+    data = np.empty(len(values), dtype=object)
+    data[:] = values
+    return ExprColumn(
+        "object",
+        data,
+        np.fromiter((v is not None for v in values), dtype=np.bool_, count=len(values)),
+    )
+
+
+def _const_column(value: typing.Any, n: int) -> ExprColumn:
+    return column_from_values([value] * n)
+
+
+def _str_ranks(left: ExprColumn, right: ExprColumn) -> tuple[np.ndarray, np.ndarray]:
+    # codes of both columns mapped to ranks in their joint sorted dictionary
+    assert left.dictionary is not None and right.dictionary is not None
+    rank = {s: i for i, s in enumerate(sorted(set(left.dictionary + right.dictionary)))}
+
+    def ranks(column: ExprColumn) -> np.ndarray:
+        assert column.dictionary is not None
+        lookup = np.array([rank[s] for s in column.dictionary] + [-1], dtype=np.int64)
+        # -1 codes (nulls) index the trailing -1
+        return lookup[column.data]
+
+    return ranks(left), ranks(right)
+
+
+_NP_COMPARE = {
+    "==": np.equal,
+    "!=": np.not_equal,
+    "<": np.less,
+    "<=": np.less_equal,
+    ">": np.greater,
+    ">=": np.greater_equal,
+}
+
+
+def _compare_columns(op: str, left: ExprColumn, right: ExprColumn) -> np.ndarray:
+    both = left.valid & right.valid
+    if left.kind == "object" or right.kind == "object":
+        return np.fromiter(
+            (
+                _compare_values(op, a, b)
+                for a, b in zip(left.objects(), right.objects())
+            ),
+            dtype=np.bool_,
+            count=len(both),
+        )
+    if left.kind != right.kind:
+        # non-null values of different kinds
+        return both if op == "!=" else np.zeros(len(both), dtype=np.bool_)
+    if left.kind == "bool" and op not in ("==", "!="):
+        return np.zeros(len(both), dtype=np.bool_)
+    if left.kind == "str":
+        left_data, right_data = _str_ranks(left, right)
+    elif left.kind == "num" and left.data.dtype != right.data.dtype:
+        return both & _compare_int_float(op, left.data, right.data)
+    else:
+        left_data, right_data = left.data, right.data
+    return both & _NP_COMPARE[op](left_data, right_data)
+
+
+def _compare_int_float(op: str, left: np.ndarray, right: np.ndarray) -> np.ndarray:
+    # exactly as python compares int and float; numpy would round the int64
+    # to float64 (1e18 == 10**18 + 1)
+    flip = np.issubdtype(left.dtype, np.floating)
+    ints, floats = (right, left) if flip else (left, right)
+    nan = np.isnan(floats)
+    in_range = (floats >= -(2.0**63)) & (floats < 2.0**63)
+    integral = in_range & (floats == np.floor(floats))
+    # integral floats compare as int64; a float with a fraction is never equal
+    # to an int and rounding the int to float keeps the order against it
+    as_int = np.where(integral, floats, 0.0).astype(np.int64)
+    as_float = ints.astype(np.float64)
+    sign = np.where(
+        integral,
+        (ints > as_int).astype(np.int8) - (ints < as_int).astype(np.int8),
+        (as_float > floats).astype(np.int8) - (as_float < floats).astype(np.int8),
+    )
+    # beyond the int64 range (inf included) the float decides alone
+    sign = np.where(in_range | nan, sign, np.where(floats > 0, -1, 1))
+    if flip:
+        sign = -sign
+    if op == "!=":
+        return (sign != 0) | nan
+    return ~nan & _NP_COMPARE[op](sign, 0)
+
+
+def _arith_columns(op: str, left: ExprColumn, right: ExprColumn) -> ExprColumn:
+    if left.kind == "object" or right.kind == "object":
+        return column_from_values(
+            [_arith_values(op, a, b) for a, b in zip(left.objects(), right.objects())]
+        )
+    n = len(left.valid)
+    if left.kind != "num" or right.kind != "num":
+        return _null_column(n)
+    a = left.data.astype(np.float64)
+    b = right.data.astype(np.float64)
+    valid = left.valid & right.valid
+    if op == "+":
+        data = a + b
+    elif op == "-":
+        data = a - b
+    elif op == "*":
+        data = a * b
+    else:
+        valid = valid & (b != 0)
+        data = a / np.where(valid, b, 1.0)
+    return ExprColumn("num", np.where(valid, data, 0.0), valid)
+
+
+def _len_column(column: ExprColumn) -> ExprColumn:
+    if column.kind == "str":
+        assert column.dictionary is not None
+        lookup = np.array([len(s) for s in column.dictionary] + [0], dtype=np.int64)
+        return ExprColumn("num", lookup[column.data], column.valid)
+    if column.kind == "object":
+        return column_from_values([_len_value(v) for v in column.objects()])
+    return _null_column(len(column.valid))
+
+
+# The rows of `log_items`, one api projected with `related_fields`, as columns
+# of the paths the expressions evaluated on it read. Columns are gathered
+# once per batch and shared by every expression reading the same path.
+class ExprBatch:
+    def __init__(self, log_items: list, related_fields):
+        self.log_items = log_items
+        self.related_fields = related_fields
+        self.columns: dict[ExprPath, ExprColumn] = {}
+
+    def __len__(self):
+        return len(self.log_items)
+
+    def holds(self, expr: PredicateExpr) -> np.ndarray:
+        # a bool per row, whether the row passes `expr`
+        missing = [path for path in expr.paths if path not in self.columns]
+        if len(missing) > 0:
+            self._gather(missing)
+        with np.errstate(all="ignore"):
+            return self._holds(expr.root)
+
+    def _gather(self, paths: list[ExprPath]):
+        rest = []
+        for path in paths:
+            column = self._joined_db_column(path)
+            if column is None:
+                rest.append(path)
+            else:
+                self.columns[path] = column
+        if len(rest) == 0:
+            return
+        access: AccessTree = {}
+        for path in rest:
+            access = merge_access(access, _path_access(path))
+        payloads = [
+            log_item.to_execute_json(self.related_fields, access)
+            for log_item in self.log_items
+        ]
+        for path in rest:
+            self.columns[path] = column_from_values(
+                [resolve_path(payload, path) for payload in payloads]
+            )
+
+    def _joined_db_column(self, path: ExprPath) -> ExprColumn | None:
+        # db_info.<table>.<column> of logs joined with the db side, read from
+        # the joined DbTable column; None if the rows are not all from one
+        # joined table or the value is not a plain joined column
+        if len(path) != 3 or path[0] != "db_info" or len(self.log_items) == 0:
+            return None
+        if not self.related_fields.include_db_info:
+            return None
+        _, table_name, column_name = path
+        first = self.log_items[0].content
+        joined = getattr(first, "joined_sql_data", None)
+        if joined is None or table_name not in joined:
+            return None
+        column = joined[table_name].get(column_name, None)
+        if column is None:
+            return None
+        idxs = []
+        for log_item in self.log_items:
+            content = log_item.content
+            if getattr(content, "joined_sql_data", None) is not joined:
+                return None
+            if table_name in content.base.get("related_db_tables", {}):
+                return None
+            idxs.append(content.idx)
+        return column_from_values(
+            take_values(column.values, np.array(idxs, dtype=np.int64))
+        )
+
+    def _value(self, node) -> ExprColumn:
+        n = len(self.log_items)
+        if isinstance(node, PathNode):
+            return self.columns[node.path]
+        if isinstance(node, ConstNode):
+            return _const_column(node.value, n)
+        if isinstance(node, LenNode):
+            return _len_column(self._value(node.operand))
+        assert isinstance(node, ArithNode)
+        return _arith_columns(node.op, self._value(node.left), self._value(node.right))
+
+    def _holds(self, node) -> np.ndarray:
+        n = len(self.log_items)
+        if isinstance(node, CompareNode):
+            return _compare_columns(
+                node.op, self._value(node.left), self._value(node.right)
+            )
+        if isinstance(node, MemberNode):
+            column = self._value(node.operand)
+            found = np.zeros(n, dtype=np.bool_)
+            for value in node.values:
+                found |= _compare_columns("==", column, _const_column(value, n))
+            return column.valid & (found != node.negated)
+        if isinstance(node, IsNullNode):
+            valid = self._value(node.operand).valid
+            return valid.copy() if node.negated else ~valid
+        if isinstance(node, BoolNode):
+            result = self._holds(node.operands[0]).copy()
+            for operand in node.operands[1:]:
+                if node.op == "and":
+                    result &= self._holds(operand)
+                else:
+                    result |= self._holds(operand)
+            return result
+        if isinstance(node, NotNode):
+            return ~self._holds(node.operand)
+        column = self._value(node)
+        if column.kind == "bool":
+            return column.valid & column.data
+        if column.kind == "object":
+            return np.fromiter(
+                (v is True for v in column.objects()), dtype=np.bool_, count=n
+            )
+        return np.zeros(n, dtype=np.bool_)
@@ -0,0 +1,144 @@
+import json
+import typing
+from array import array
+
+import numpy as np
+
+# Profilers entered with `with`, every instrumented predicate call is
+# recorded into all of them.
+active_profilers: "list[InvariantProfiler]" = []
+
+
+class InvariantStats:
+    def __init__(self):
+        self.exceptions = 0
+        self.lookup_time = 0.0
+        # per call, seconds
+        self.prepare_times = array("d")
+        self.predicate_times = array("d")
+
+    @property
+    def calls(self) -> int:
+        return len(self.predicate_times)
+
+    def merge(self, other: "InvariantStats"):
+        self.exceptions += other.exceptions
+        self.lookup_time += other.lookup_time
+        self.prepare_times.extend(other.prepare_times)
+        self.predicate_times.extend(other.predicate_times)
+
+    def to_json(self) -> dict:
+        prepare = np.frombuffer(self.prepare_times, dtype=np.float64)
+        predicate = np.frombuffer(self.predicate_times, dtype=np.float64)
+        total = prepare + predicate
+        has_calls = len(total) > 0
+        return {
+            "calls": self.calls,
+            "total_s": float(total.sum()) + self.lookup_time,
+            "p50_ms": float(np.percentile(total, 50)) * 1000 if has_calls else 0.0,
+            "p99_ms": float(np.percentile(total, 99)) * 1000 if has_calls else 0.0,
+            "lookup_s": self.lookup_time,
+            "to_execute_json_s": float(prepare.sum()),
+            "predicate_s": float(predicate.sum()),
+            "exception_rate": self.exceptions / self.calls if has_calls else 0.0,
+        }
+
+
+# Per-invariant cost of predicate calls: call count, latency distribution,
+# time spent building the predicate input (`to_execute_json`) versus running
+# the predicate, and how often the predicate raised. Use it around any check
+# loop:
+#
+#     with InvariantProfiler() as profiler:
+#         profiler.register_invariants(invariants)
+#         ...
+#     print(profiler.text_report())
+class InvariantProfiler:
+    def __init__(self):
+        # keyed by the Predicate object
+        self.stats: dict[typing.Any, InvariantStats] = {}
+        self.labels: dict[typing.Any, str] = {}
+
+    def __enter__(self):
+        active_profilers.append(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        active_profilers.remove(self)
+
+    def register_invariants(self, invariants: list):
+        for idx, inv in enumerate(invariants):
+            self.labels[inv.predicate] = f"#{idx} {inv.domain[0].api}"
+
+    def get_stats(self, key) -> InvariantStats:
+        stats = self.stats.get(key, None)
+        if stats is None:
+            stats = InvariantStats()
+            self.stats[key] = stats
+        return stats
+
+    def record(self, key, prepare_time: float, predicate_time: float, raised: bool):
+        stats = self.get_stats(key)
+        stats.prepare_times.append(prepare_time)
+        stats.predicate_times.append(predicate_time)
+        if raised:
+            stats.exceptions += 1
+
+    def record_lookup(self, key, lookup_time: float):
+        self.get_stats(key).lookup_time += lookup_time
+
+    def label(self, key) -> str:
+        if key in self.labels:
+            return self.labels[key]
+        desc = getattr(key, "desc", "") or getattr(key, "py_code", "") or ""
+        return desc.strip().split("\n", 1)[0][:60]
+
+    def report(self) -> list[dict]:
+        # ranked by total time, most expensive first
+        rows = []
+        for key, stats in self.stats.items():
+            row = {"invariant": self.label(key)}
+            row.update(stats.to_json())
+            rows.append(row)
+        rows.sort(key=lambda row: row["total_s"], reverse=True)
+        for rank, row in enumerate(rows):
+            row["rank"] = rank + 1
+        return rows
+
+    def text_report(self, top: int | None = None) -> str:
+        rows = self.report()
+        if top is not None:
+            rows = rows[:top]
+        lines = [
+            f"{'rank':>4}  {'invariant':<40} {'calls':>8} {'total_s':>9} "
+            f"{'p50_ms':>8} {'p99_ms':>8} {'json_s':>8} {'pred_s':>8} {'exc':>6}"
+        ]
+        for row in rows:
+            lines.append(
+                f"{row['rank']:>4}  {row['invariant'][:40]:<40} {row['calls']:>8} "
+                f"{row['total_s']:>9.3f} {row['p50_ms']:>8.3f} {row['p99_ms']:>8.3f} "
+                f"{row['to_execute_json_s']:>8.3f} {row['predicate_s']:>8.3f} "
+                f"{row['exception_rate']:>6.1%}"
+            )
+        return "\n".join(lines)
+
+    def save(self, path_prefix: str):
+        with open(path_prefix + ".json", "wt") as f:
+            json.dump(self.report(), f, indent=2)
+        with open(path_prefix + ".txt", "wt") as f:
+            f.write(self.text_report())
+            f.write("\n")
+
+
+def profiling() -> bool:
+    return len(active_profilers) != 0
+
+
+def record_call(key, prepare_time: float, predicate_time: float, raised: bool):
+    for profiler in active_profilers:
+        profiler.record(key, prepare_time, predicate_time, raised)
+
+
+def record_lookup(key, lookup_time: float):
+    for profiler in active_profilers:
+        profiler.record_lookup(key, lookup_time)
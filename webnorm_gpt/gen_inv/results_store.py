@@ -0,0 +1,91 @@
+import hashlib
+import json
+import sqlite3
+import typing
+
+from ..file_types.log_file import LogFile
+from .base import Invariant
+
+# (api, position of the log among the joined logs of its api in the shard,
+# err) of a log an invariant does not pass
+StoredFailure = tuple[str, int, typing.Optional[str]]
+
+
+def invariant_digest(invariant: Invariant) -> bytes:
+    # equal for invariants with the same domain, premise and predicate
+    dump = json.dumps(invariant.save_to_json(), sort_keys=True)
+    return hashlib.sha256(dump.encode()).digest()
+
+
+def files_digest(paths: list[str]) -> bytes:
+    # of the contents of input files, e.g. the db side logs are joined with
+    h = hashlib.sha256()
+    for path in paths:
+        h.update(path.encode() + b"\0")
+        with open(path, "rb") as f:
+            while chunk := f.read(1 << 20):
+                h.update(chunk)
+    return h.digest()
+
+
+def shard_digest(log_file: LogFile, context: bytes = b"") -> bytes:
+    # of the logs of one checked window, and of whatever else the joined
+    # result depends on (`context`); taken before the logs are joined, which
+    # fills in their env
+    h = hashlib.sha256(context)
+    for log_item in log_file.log_items:
+        h.update(str(log_item).encode())
+        h.update(b"\n")
+    return h.digest()
+
+
+# Failures of invariants on log shards (the windows 004_check_inv.py checks),
+# keyed by (invariant_digest, shard_digest) in a sqlite file. A rerun only has
+# to evaluate the pairs it does not find here, i.e. new or changed invariants
+# and new shards, and can assemble everything else from the stored failures.
+# Pairs where an invariant overran its budget or was skipped are not stored,
+# their outcome depends on the machine rather than on the invariant.
+class ResultsStore:
+    def __init__(self, path: str):
+        self.path = path
+        self.db = sqlite3.connect(path, timeout=60)
+        cursor = self.db.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute(
+            "CREATE TABLE IF NOT EXISTS results (inv_digest BLOB, shard_digest BLOB, failures TEXT, PRIMARY KEY (shard_digest, inv_digest))"
+        )
+        self.db.commit()
+
+    def get_shard(self, shard_digest: bytes) -> dict[bytes, list[StoredFailure]]:
+        # stored failures on a shard, by invariant_digest
+        cursor = self.db.cursor()
+        cursor.execute(
+            "SELECT inv_digest, failures FROM results WHERE shard_digest = ?",
+            (shard_digest,),
+        )
+        return {
+            inv_digest: [(api, pos, err) for api, pos, err in json.loads(failures)]
+            for inv_digest, failures in cursor.fetchall()
+        }
+
+    def put_many(
+        self, results: typing.Iterable[tuple[bytes, bytes, list[StoredFailure]]]
+    ):
+        cursor = self.db.cursor()
+        cursor.executemany(
+            "INSERT OR REPLACE INTO results (inv_digest, shard_digest, failures) VALUES (?, ?, ?)",
+            [
+                (inv_digest, shard_digest, json.dumps(failures))
+                for inv_digest, shard_digest, failures in results
+            ],
+        )
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,93 @@
+import typing
+
+from ..file_types.log_file import LogItem
+from .base import Predicate, RelatedFields
+from .check_inv import PredicateLimits, PredicateVerdicts, run_py_args_limited
+from .verdict_cache import VerdictCache, payload_digest
+
+# (log, verdict, err) of the first log a candidate predicate does not pass
+ValidationFailure = tuple[LogItem, str, typing.Optional[str]]
+
+
+# Checks candidate predicates of one api against all its logs, finding a
+# failing log as early as possible:
+#
+# 1. logs are projected to what the candidate reads (field_access) one by one,
+#    and logs with byte-identical projections are checked only once;
+# 2. the first projection of every `shape` (json_to_schema) is checked as soon
+#    as it is seen, as the odd logs are the likely counterexamples, so a
+#    failure there stops before the remaining logs are projected;
+# 3. the other projections are checked once all logs passed stage 2.
+#
+# With a `verdict_cache`, verdicts of projections seen before, e.g. in an
+# earlier run over the same logs, are reused and a cached failure is
+# reported without running the candidate.
+class StagedValidator:
+    def __init__(
+        self,
+        logs: list[LogItem],
+        related_fields: RelatedFields,
+        shape: typing.Callable[[typing.Any], str],
+        limits: PredicateLimits | None = None,
+        verdict_cache: VerdictCache | None = None,
+    ):
+        self.logs = logs
+        self.related_fields = related_fields
+        self.shape = shape
+        self.limits = limits if limits is not None else PredicateLimits()
+        self.verdict_cache = verdict_cache
+
+    def validate(self, predicate: Predicate) -> typing.Optional[ValidationFailure]:
+        # the first log found failing `predicate`, None if all of them pass
+        if predicate.is_true_predicate:
+            return None
+        failure = self._validate(predicate)
+        if self.verdict_cache is not None:
+            self.verdict_cache.flush()
+        return failure
+
+    def _validate(self, predicate: Predicate) -> typing.Optional[ValidationFailure]:
+        access = predicate.field_access[0]
+        cache = self.verdict_cache
+        code = predicate.code_digest
+
+        def check(
+            log: LogItem, projection: dict, digest: bytes | None
+        ) -> typing.Optional[ValidationFailure]:
+            verdict, err = run_py_args_limited(predicate, [projection], self.limits)
+            if cache is not None and digest is not None:
+                cache.put(code, digest, verdict, err)
+            if verdict != PredicateVerdicts.Pass:
+                return log, verdict, err
+            return None
+
+        deferred: list[tuple[LogItem, dict, bytes | None]] = []
+        seen: set[bytes] = set()
+        shapes: set[str] = set()
+        for log in self.logs:
+            projection = log.to_execute_json(self.related_fields, access)
+            digest = payload_digest(projection)
+            if digest is not None:
+                if digest in seen:
+                    continue
+                seen.add(digest)
+                if cache is not None:
+                    cached = cache.get(code, digest)
+                    if cached is not None:
+                        if cached[0] != PredicateVerdicts.Pass:
+                            return log, cached[0], cached[1]
+                        continue
+            shape = self.shape(projection)
+            if shape in shapes:
+                deferred.append((log, projection, digest))
+                continue
+            shapes.add(shape)
+            failure = check(log, projection, digest)
+            if failure is not None:
+                return failure
+
+        for log, projection, digest in deferred:
+            failure = check(log, projection, digest)
+            if failure is not None:
+                return failure
+        return None
@@ -0,0 +1,157 @@
+import hashlib
+import json
+import sqlite3
+import typing
+from collections import OrderedDict
+from dataclasses import dataclass
+
+from .check_inv import PredicateVerdicts
+
+VERDICT_CACHE_MAX_ENTRIES = 1 << 20
+# puts buffered before they are written to the sqlite file
+_PERSIST_BATCH = 1024
+
+# (verdict, err), only Pass and Fail are cached: an overrun depends on the
+# limits and the load of the machine, and has to be counted against the
+# invariant every time
+CachedVerdict = tuple[str, typing.Optional[str]]
+_CACHED_VERDICTS = (PredicateVerdicts.Pass, PredicateVerdicts.Fail)
+
+
+def payload_digest(payload: typing.Any) -> bytes | None:
+    # equal digests for byte-identical `to_execute_json` payloads, None if the
+    # payload can not be dumped as JSON
+    try:
+        dump = json.dumps(payload, sort_keys=True, default=repr)
+    except (TypeError, ValueError, RecursionError):
+        return None
+    return hashlib.blake2b(dump.encode(), digest_size=16).digest()
+
+
+@dataclass
+class VerdictCacheStats:
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups > 0 else 0.0
+
+    def merge(self, other: "VerdictCacheStats"):
+        self.hits += other.hits
+        self.misses += other.misses
+        self.evictions += other.evictions
+
+    def to_json(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hit_rate,
+        }
+
+
+# Verdicts of predicates on payloads, keyed by (Predicate.code_digest,
+# payload_digest): a predicate is a pure function of its payload, so logs
+# which project to the same payload, e.g. retries and polling, are only
+# evaluated once per predicate. The most recently used `max_entries` verdicts
+# are kept in memory; with `path`, verdicts are also kept in a sqlite file,
+# read on a miss in memory and shared by every process and rerun using it.
+class VerdictCache:
+    def __init__(
+        self, path: str | None = None, max_entries: int = VERDICT_CACHE_MAX_ENTRIES
+    ):
+        self.path = path
+        self.max_entries = max_entries
+        self.entries: OrderedDict[tuple[bytes, bytes], CachedVerdict] = OrderedDict()
+        self.stats = VerdictCacheStats()
+        self.db = None
+        # put, but not written to the sqlite file yet
+        self.unsaved: dict[tuple[bytes, bytes], CachedVerdict] = {}
+
+        if path is not None:
+            self.db = sqlite3.connect(path, timeout=60)
+            cursor = self.db.cursor()
+            cursor.execute("PRAGMA journal_mode=WAL")
+            cursor.execute(
+                "CREATE TABLE IF NOT EXISTS verdict_cache (code_digest BLOB, payload_digest BLOB, verdict TEXT, err TEXT, PRIMARY KEY (code_digest, payload_digest))"
+            )
+            self.db.commit()
+
+    def config(self) -> tuple[str | None, int]:
+        # what a worker process builds its own cache from
+        return self.path, self.max_entries
+
+    def get(self, code: bytes, payload: bytes) -> CachedVerdict | None:
+        key = (code, payload)
+        verdict = self.entries.get(key, None)
+        if verdict is None:
+            verdict = self.unsaved.get(key, None)
+            if verdict is not None:
+                self._remember(key, verdict)
+        if verdict is not None:
+            self.entries.move_to_end(key)
+            self.stats.hits += 1
+            return verdict
+
+        if self.db is not None:
+            cursor = self.db.cursor()
+            cursor.execute(
+                "SELECT verdict, err FROM verdict_cache WHERE code_digest = ? AND payload_digest = ?",
+                key,
+            )
+            row = cursor.fetchone()
+            if row is not None:
+                self._remember(key, (row[0], row[1]))
+                self.stats.hits += 1
+                return row[0], row[1]
+
+        self.stats.misses += 1
+        return None
+
+    def put(self, code: bytes, payload: bytes, verdict: str, err: str | None):
+        if verdict not in _CACHED_VERDICTS:
+            return
+        self._remember((code, payload), (verdict, err))
+        if self.db is not None:
+            self.unsaved[code, payload] = (verdict, err)
+            if len(self.unsaved) >= _PERSIST_BATCH:
+                self.flush()
+
+    def _remember(self, key: tuple[bytes, bytes], verdict: CachedVerdict):
+        self.entries[key] = verdict
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.stats.evictions += 1
+
+    def take_stats(self) -> VerdictCacheStats:
+        # the stats since the last call, for reporting them elsewhere
+        stats = self.stats
+        self.stats = VerdictCacheStats()
+        return stats
+
+    def flush(self):
+        if self.db is None or len(self.unsaved) == 0:
+            return
+        cursor = self.db.cursor()
+        cursor.executemany(
+            "INSERT OR REPLACE INTO verdict_cache (code_digest, payload_digest, verdict, err) VALUES (?, ?, ?, ?)",
+            [key + verdict for key, verdict in self.unsaved.items()],
+        )
+        self.db.commit()
+        self.unsaved = {}
+
+    def close(self):
+        self.flush()
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
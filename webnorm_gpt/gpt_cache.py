@@ -0,0 +1,741 @@
+import atexit
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from multiprocessing import util as mp_util
+
+import zstandard
+
+from . import logger
+
+# responses kept in memory per process, on top of the sqlite file
+GPT_CACHE_MEMORY_ENTRIES = 4096
+# buffered writes are committed once there are this many, or after this long
+GPT_CACHE_COMMIT_BATCH = 64
+GPT_CACHE_COMMIT_INTERVAL = 1.0
+# prompts are stored as the chunks starting at this, GPTInvoker joins the
+# messages of a conversation with it
+PROMPT_CHUNK_SEPARATOR = "|s9Z69ZPA|"
+GPT_CACHE_ZSTD_LEVEL = 3
+# the shared dictionary is trained once this many blobs are stored, on at
+# most GPT_CACHE_DICT_MAX_SAMPLES of them
+GPT_CACHE_DICT_MIN_SAMPLES = 256
+GPT_CACHE_DICT_MAX_SAMPLES = 4096
+GPT_CACHE_DICT_SIZE = 64 << 10
+# an eviction goes this far below the limits, not to evict on every commit
+GPT_CACHE_EVICT_TO = 0.9
+
+_BLOB_DIGEST_SIZE = 16
+
+# (input_tokens, output_tokens, timestamp, model)
+UsageRow = tuple[int, int, str, str]
+# [entries, blob_bytes] of the file, updated along a write transaction
+Totals = list[int]
+# (dictionary id, 0 for none; compressor)
+Compressor = tuple[int, zstandard.ZstdCompressor]
+
+
+def split_prompt(prompt: str, separator: str | None) -> list[str]:
+    # chunks joining back to `prompt`, all but the first start with `separator`
+    if separator is None:
+        return [prompt]
+    parts = prompt.split(separator)
+    return parts[:1] + [separator + part for part in parts[1:]]
+
+
+def blob_digest(text: str) -> bytes:
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=_BLOB_DIGEST_SIZE).digest()
+
+
+# Limits of a GPT cache file, None for no limit. Beyond one, entries are
+# evicted on commit, the least recently used ("lru") or the largest ("size")
+# first, until the file is GPT_CACHE_EVICT_TO of the limit.
+@dataclass
+class GPTCacheLimits:
+    max_bytes: int | None = None
+    max_entries: int | None = None
+    evict: str = "lru"
+
+    def __post_init__(self):
+        if self.evict not in ("lru", "size"):
+            raise ValueError(f"Unknown GPT cache eviction {self.evict!r}")
+
+    def bounded(self) -> bool:
+        return self.max_bytes is not None or self.max_entries is not None
+
+    def to_json(self) -> dict:
+        return {
+            "max_bytes": self.max_bytes,
+            "max_entries": self.max_entries,
+            "evict": self.evict,
+        }
+
+
+@dataclass
+class GPTCacheStats:
+    memory_hits: int = 0
+    db_hits: int = 0
+    misses: int = 0
+    commits: int = 0
+    evictions: int = 0
+
+    def to_json(self) -> dict:
+        return {
+            "memory_hits": self.memory_hits,
+            "db_hits": self.db_hits,
+            "misses": self.misses,
+            "commits": self.commits,
+            "evictions": self.evictions,
+        }
+
+
+# GPT responses keyed by the digest of their prompt, and the token usage of
+# every request, in a sqlite file shared by all processes using it, e.g. the
+# multiprocessing.Pool workers of 003_inv_gen.py, which inherit the invoker.
+#
+# - The file is in WAL mode, readers never wait for the writer.
+# - Every process opens its own connection on first use; one inherited over
+#   a fork is never touched, sqlite connections must not cross a fork.
+# - The most recently used responses are kept in memory, and read from there.
+# - Responses and usage rows are buffered and committed in batches, by the
+#   caller once GPT_CACHE_COMMIT_BATCH are pending and by a background thread
+#   every GPT_CACHE_COMMIT_INTERVAL; buffered writes are visible to `get` of
+#   the same process right away, and flushed at exit. A process which is
+#   killed, e.g. a worker of a terminated Pool, loses what it has not flushed.
+#
+# Storage is content addressed: a prompt is split into chunks at
+# `chunk_separator`, and every chunk and response is stored once as a zstd
+# blob, compressed with a dictionary trained on the stored blobs. An entry
+# refers to its blobs by digest; blobs are reference counted and deleted
+# with the last entry referring to them. A file of the former layout, one
+# gpt_cache table of plain prompts and responses, is converted on first use.
+class GPTCache:
+    def __init__(
+        self,
+        path: str,
+        memory_entries: int = GPT_CACHE_MEMORY_ENTRIES,
+        commit_batch: int = GPT_CACHE_COMMIT_BATCH,
+        commit_interval: float = GPT_CACHE_COMMIT_INTERVAL,
+        limits: GPTCacheLimits | None = None,
+        chunk_separator: str | None = PROMPT_CHUNK_SEPARATOR,
+    ):
+        self.path = path
+        self.memory_entries = memory_entries
+        self.commit_batch = commit_batch
+        self.commit_interval = commit_interval
+        self.limits = limits if limits is not None else GPTCacheLimits()
+        self.chunk_separator = chunk_separator
+        self.stats = GPTCacheStats()
+        self._pid: int | None = None
+        self._reset()
+        atexit.register(self.flush)
+
+    def _reset(self):
+        # per process state; whatever a forked child inherits is dropped, the
+        # parent commits its own pending writes
+        if self._pid is not None and getattr(self, "_db", None) is not None:
+            _inherited_connections.append(self._db)
+        self._pid = os.getpid()
+        self._db: sqlite3.Connection | None = None
+        self._lock = threading.RLock()
+        self._memory: OrderedDict[str, tuple[str, str]] = OrderedDict()
+        self._pending: dict[str, tuple[str, str]] = {}
+        self._usage: list[UsageRow] = []
+        # digest -> when it was last read, of a bounded cache
+        self._touched: dict[str, float] = {}
+        self._flusher: threading.Thread | None = None
+        self._closed = False
+        self._dicts: dict[int, zstandard.ZstdCompressionDict] = {}
+        self._decompressors: dict[int, zstandard.ZstdDecompressor] = {}
+        self._compressor: Compressor | None = None
+        # blobs stored before training the first dictionary is tried (again)
+        self._train_at = GPT_CACHE_DICT_MIN_SAMPLES
+
+    def _check_pid(self):
+        if self._pid != os.getpid():
+            self._reset()
+            # a pool worker exits without running atexit handlers
+            mp_util.Finalize(self, self.flush, exitpriority=10)
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._db is None:
+            db = sqlite3.connect(self.path, timeout=60, check_same_thread=False)
+            cursor = db.cursor()
+            cursor.execute("PRAGMA journal_mode=WAL")
+            cursor.execute("PRAGMA synchronous=NORMAL")
+            cursor.execute(
+                "CREATE TABLE IF NOT EXISTS gpt_blob (blob_id INTEGER PRIMARY KEY, blob_digest BLOB UNIQUE, blob_dict INT, blob_data BLOB, blob_raw_size INT, blob_refs INT)"
+            )
+            cursor.execute(
+                "CREATE TABLE IF NOT EXISTS gpt_entry (cache_digest TEXT PRIMARY KEY, prompt_digest BLOB, prompt_chunks BLOB, response_blob BLOB, entry_size INT, last_used REAL)"
+            )
+            cursor.execute(
+                "CREATE INDEX IF NOT EXISTS entry_last_used_index ON gpt_entry (last_used)"
+            )
+            cursor.execute(
+                "CREATE INDEX IF NOT EXISTS entry_size_index ON gpt_entry (entry_size)"
+            )
+            cursor.execute(
+                "CREATE TABLE IF NOT EXISTS gpt_dict (dict_id INTEGER PRIMARY KEY AUTOINCREMENT, dict_data BLOB)"
+            )
+            cursor.execute(
+                "CREATE TABLE IF NOT EXISTS gpt_meta (meta_key TEXT PRIMARY KEY, meta_value INT)"
+            )
+            cursor.execute(
+                "INSERT OR IGNORE INTO gpt_meta (meta_key, meta_value) VALUES ('entries', 0), ('blob_bytes', 0)"
+            )
+            cursor.execute(
+                "CREATE TABLE IF NOT EXISTS gpt_usage (input_tokens INT, output_tokens INT, timestamp TEXT, model TEXT)"
+            )
+            db.commit()
+            self._db = db
+            self._convert_legacy_table(db)
+        return self._db
+
+    def _has_legacy_table(self, cursor: sqlite3.Cursor) -> bool:
+        cursor.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'gpt_cache'"
+        )
+        return cursor.fetchone() is not None
+
+    def _convert_legacy_table(self, db: sqlite3.Connection):
+        cursor = db.cursor()
+        if not self._has_legacy_table(cursor):
+            return
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            # another process may have converted it in the meantime
+            if not self._has_legacy_table(cursor):
+                db.rollback()
+                return
+            totals = self._load_totals(cursor)
+            compressor = self._current_compressor(cursor)
+            last_rowid = -1
+            while True:
+                cursor.execute(
+                    "SELECT rowid, cache_digest, cache_prompt, cache_response FROM gpt_cache WHERE rowid > ? ORDER BY rowid LIMIT 256",
+                    (last_rowid,),
+                )
+                rows = cursor.fetchall()
+                if len(rows) == 0:
+                    break
+                for rowid, digest, prompt, response in rows:
+                    last_rowid = rowid
+                    if digest is None or prompt is None or response is None:
+                        continue
+                    self._store(cursor, compressor, totals, digest, prompt, response)
+            cursor.execute("DROP TABLE gpt_cache")
+            self._save_totals(cursor, totals)
+            self._maybe_train_dictionary(cursor, totals)
+            db.commit()
+        except BaseException:
+            db.rollback()
+            raise
+        logger.info(
+            "Converted GPT cache %s: %d entries in %d bytes of blobs",
+            self.path,
+            totals[0],
+            totals[1],
+        )
+
+    # compression
+
+    def _dictionary(
+        self, cursor: sqlite3.Cursor, dict_id: int
+    ) -> zstandard.ZstdCompressionDict:
+        d = self._dicts.get(dict_id, None)
+        if d is None:
+            cursor.execute(
+                "SELECT dict_data FROM gpt_dict WHERE dict_id = ? ", (dict_id,)
+            )
+            row = cursor.fetchone()
+            if row is None:
+                raise KeyError(f"GPT cache dictionary {dict_id} is missing")
+            d = zstandard.ZstdCompressionDict(row[0])
+            self._dicts[dict_id] = d
+        return d
+
+    def _current_compressor(self, cursor: sqlite3.Cursor) -> Compressor:
+        # with the newest dictionary
+        cursor.execute("SELECT MAX(dict_id) FROM gpt_dict")
+        dict_id = cursor.fetchone()[0] or 0
+        if self._compressor is None or self._compressor[0] != dict_id:
+            if dict_id == 0:
+                compressor = zstandard.ZstdCompressor(level=GPT_CACHE_ZSTD_LEVEL)
+            else:
+                compressor = zstandard.ZstdCompressor(
+                    level=GPT_CACHE_ZSTD_LEVEL,
+                    dict_data=self._dictionary(cursor, dict_id),
+                )
+            self._compressor = (dict_id, compressor)
+        return self._compressor
+
+    def _decompress(self, cursor: sqlite3.Cursor, dict_id: int, data: bytes) -> str:
+        decompressor = self._decompressors.get(dict_id, None)
+        if decompressor is None:
+            if dict_id == 0:
+                decompressor = zstandard.ZstdDecompressor()
+            else:
+                decompressor = zstandard.ZstdDecompressor(
+                    dict_data=self._dictionary(cursor, dict_id)
+                )
+            self._decompressors[dict_id] = decompressor
+        return decompressor.decompress(data).decode("utf-8")
+
+    def _load_blob(self, cursor: sqlite3.Cursor, digest: bytes) -> str | None:
+        cursor.execute(
+            "SELECT blob_dict, blob_data FROM gpt_blob WHERE blob_digest = ? ",
+            (digest,),
+        )
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        return self._decompress(cursor, row[0], row[1])
+
+    def _maybe_train_dictionary(self, cursor: sqlite3.Cursor, totals: Totals):
+        if self._current_compressor(cursor)[0] != 0:
+            return
+        cursor.execute("SELECT COUNT(*) FROM gpt_blob")
+        count = cursor.fetchone()[0]
+        if count < self._train_at:
+            return
+        if not self._train_dictionary(cursor, totals):
+            self._train_at = count * 2
+
+    def _train_dictionary(self, cursor: sqlite3.Cursor, totals: Totals) -> bool:
+        # trains a dictionary on a sample of the blobs, recompresses all of
+        # them with it and drops the former ones; False if zstd found none
+        cursor.execute(
+            "SELECT blob_dict, blob_data FROM gpt_blob ORDER BY RANDOM() LIMIT ?",
+            (GPT_CACHE_DICT_MAX_SAMPLES,),
+        )
+        samples = [
+            self._decompress(cursor, dict_id, data).encode("utf-8")
+            for dict_id, data in cursor.fetchall()
+        ]
+        try:
+            d = zstandard.train_dictionary(GPT_CACHE_DICT_SIZE, samples)
+        except zstandard.ZstdError as e:
+            logger.info("No dictionary for GPT cache %s: %s", self.path, e)
+            return False
+
+        cursor.execute("INSERT INTO gpt_dict (dict_data) VALUES (?)", (d.as_bytes(),))
+        dict_id, compressor = self._current_compressor(cursor)
+        last_id = -1
+        while True:
+            cursor.execute(
+                "SELECT blob_id, blob_dict, blob_data FROM gpt_blob WHERE blob_id > ? ORDER BY blob_id LIMIT 256",
+                (last_id,),
+            )
+            rows = cursor.fetchall()
+            if len(rows) == 0:
+                break
+            for blob_id, old_dict_id, data in rows:
+                last_id = blob_id
+                text = self._decompress(cursor, old_dict_id, data)
+                new_data = compressor.compress(text.encode("utf-8"))
+                totals[1] += len(new_data) - len(data)
+                cursor.execute(
+                    "UPDATE gpt_blob SET blob_dict = ?, blob_data = ? WHERE blob_id = ?",
+                    (dict_id, new_data, blob_id),
+                )
+        cursor.execute("DELETE FROM gpt_dict WHERE dict_id != ?", (dict_id,))
+        self._save_totals(cursor, totals)
+        return True
+
+    # blobs and entries, within a write transaction
+
+    def _load_totals(self, cursor: sqlite3.Cursor) -> Totals:
+        cursor.execute("SELECT meta_key, meta_value FROM gpt_meta")
+        meta = dict(cursor.fetchall())
+        return [meta.get("entries", 0), meta.get("blob_bytes", 0)]
+
+    def _save_totals(self, cursor: sqlite3.Cursor, totals: Totals):
+        cursor.executemany(
+            "UPDATE gpt_meta SET meta_value = ? WHERE meta_key = ?",
+            [(totals[0], "entries"), (totals[1], "blob_bytes")],
+        )
+
+    def _retain(
+        self,
+        cursor: sqlite3.Cursor,
+        compressor: Compressor,
+        totals: Totals,
+        digest: bytes,
+        text: str,
+    ) -> int:
+        # a reference to the blob of `text`, stored first if it is new; its
+        # compressed size
+        cursor.execute(
+            "SELECT length(blob_data) FROM gpt_blob WHERE blob_digest = ? ",
+            (digest,),
+        )
+        row = cursor.fetchone()
+        if row is not None:
+            cursor.execute(
+                "UPDATE gpt_blob SET blob_refs = blob_refs + 1 WHERE blob_digest = ?",
+                (digest,),
+            )
+            return row[0]
+        raw = text.encode("utf-8")
+        data = compressor[1].compress(raw)
+        cursor.execute(
+            "INSERT INTO gpt_blob (blob_digest, blob_dict, blob_data, blob_raw_size, blob_refs) VALUES (?, ?, ?, ?, 1)",
+            (digest, compressor[0], data, len(raw)),
+        )
+        totals[1] += len(data)
+        return len(data)
+
+    def _release(self, cursor: sqlite3.Cursor, totals: Totals, digest: bytes):
+        cursor.execute(
+            "UPDATE gpt_blob SET blob_refs = blob_refs - 1 WHERE blob_digest = ?",
+            (digest,),
+        )
+        cursor.execute(
+            "SELECT length(blob_data) FROM gpt_blob WHERE blob_digest = ? AND blob_refs <= 0",
+            (digest,),
+        )
+        row = cursor.fetchone()
+        if row is not None:
+            cursor.execute("DELETE FROM gpt_blob WHERE blob_digest = ?", (digest,))
+            totals[1] -= row[0]
+
+    def _delete_entry(self, cursor: sqlite3.Cursor, totals: Totals, digest: str):
+        cursor.execute(
+            "SELECT prompt_chunks, response_blob FROM gpt_entry WHERE cache_digest = ? ",
+            (digest,),
+        )
+        row = cursor.fetchone()
+        if row is None:
+            return
+        cursor.execute("DELETE FROM gpt_entry WHERE cache_digest = ?", (digest,))
+        prompt_chunks, response_blob = row
+        for i in range(0, len(prompt_chunks), _BLOB_DIGEST_SIZE):
+            self._release(cursor, totals, prompt_chunks[i : i + _BLOB_DIGEST_SIZE])
+        self._release(cursor, totals, response_blob)
+        totals[0] -= 1
+
+    def _store(
+        self,
+        cursor: sqlite3.Cursor,
+        compressor: Compressor,
+        totals: Totals,
+        digest: str,
+        prompt: str,
+        response: str,
+    ):
+        prompt_digest = blob_digest(prompt)
+        response_digest = blob_digest(response)
+        cursor.execute(
+            "SELECT prompt_digest, response_blob FROM gpt_entry WHERE cache_digest = ? ",
+            (digest,),
+        )
+        row = cursor.fetchone()
+        if row is not None:
+            if row[0] != prompt_digest:
+                # another prompt with the same digest
+                return
+            if row[1] == response_digest:
+                # cached by another process in the meantime
+                cursor.execute(
+                    "UPDATE gpt_entry SET last_used = ? WHERE cache_digest = ?",
+                    (time.time(), digest),
+                )
+                return
+            self._delete_entry(cursor, totals, digest)
+
+        chunks = split_prompt(prompt, self.chunk_separator)
+        chunk_digests = [blob_digest(chunk) for chunk in chunks]
+        size = 0
+        for chunk_digest, chunk in zip(chunk_digests, chunks):
+            size += self._retain(cursor, compressor, totals, chunk_digest, chunk)
+        size += self._retain(cursor, compressor, totals, response_digest, response)
+        cursor.execute(
+            "INSERT INTO gpt_entry (cache_digest, prompt_digest, prompt_chunks, response_blob, entry_size, last_used) VALUES (?, ?, ?, ?, ?, ?)",
+            (
+                digest,
+                prompt_digest,
+                b"".join(chunk_digests),
+                response_digest,
+                size,
+                time.time(),
+            ),
+        )
+        totals[0] += 1
+
+    def _evict(self, cursor: sqlite3.Cursor, totals: Totals):
+        limits = self.limits
+
+        def over(fraction: float) -> bool:
+            if limits.max_entries is not None:
+                if totals[0] > limits.max_entries * fraction:
+                    return True
+            if limits.max_bytes is not None:
+                if totals[1] > limits.max_bytes * fraction:
+                    return True
+            return False
+
+        if not over(1.0):
+            return
+        order = "last_used" if limits.evict == "lru" else "entry_size DESC"
+        while over(GPT_CACHE_EVICT_TO):
+            cursor.execute(
+                f"SELECT cache_digest FROM gpt_entry ORDER BY {order} LIMIT 64"
+            )
+            digests = [row[0] for row in cursor.fetchall()]
+            if len(digests) == 0:
+                break
+            for digest in digests:
+                if not over(GPT_CACHE_EVICT_TO):
+                    break
+                self._delete_entry(cursor, totals, digest)
+                self._memory.pop(digest, None)
+                self.stats.evictions += 1
+
+    # reads and writes
+
+    def _remember(self, digest: str, prompt: str, response: str):
+        self._memory[digest] = (prompt, response)
+        self._memory.move_to_end(digest)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def _touch(self, digest: str):
+        # recency only matters to the eviction, an unbounded cache keeps the
+        # time an entry was stored
+        if not self.limits.bounded():
+            return
+        self._touched[digest] = time.time()
+        self._start_flusher()
+
+    def _stored_prompt_digest(self, digest: str) -> bytes | None:
+        cursor = self._connection().cursor()
+        cursor.execute(
+            "SELECT prompt_digest FROM gpt_entry WHERE cache_digest = ? ", (digest,)
+        )
+        row = cursor.fetchone()
+        return row[0] if row else None
+
+    def get(self, digest: str, prompt: str) -> str | None:
+        # the response cached for `prompt`, whose digest is `digest`
+        self._check_pid()
+        with self._lock:
+            entry = self._memory.get(digest, None)
+            if entry is None:
+                entry = self._pending.get(digest, None)
+            if entry is not None:
+                if digest in self._memory:
+                    self._memory.move_to_end(digest)
+                if entry[0] != prompt:
+                    self.stats.misses += 1
+                    return None
+                self._touch(digest)
+                self.stats.memory_hits += 1
+                return entry[1]
+
+            cursor = self._connection().cursor()
+            cursor.execute(
+                "SELECT prompt_digest, response_blob FROM gpt_entry WHERE cache_digest = ? ",
+                (digest,),
+            )
+            row = cursor.fetchone()
+            response = None
+            if row and row[0] == blob_digest(prompt):
+                response = self._load_blob(cursor, row[1])
+            if response is None:
+                self.stats.misses += 1
+                return None
+            self._remember(digest, prompt, response)
+            self._touch(digest)
+            self.stats.db_hits += 1
+            return response
+
+    def put(self, digest: str, prompt: str, response: str) -> bool:
+        # False, and nothing is cached, if another prompt with the same digest
+        # is cached already
+        self._check_pid()
+        with self._lock:
+            entry = self._memory.get(digest, None) or self._pending.get(digest, None)
+            if entry is not None:
+                conflict = entry[0] != prompt
+            else:
+                stored = self._stored_prompt_digest(digest)
+                conflict = stored is not None and stored != blob_digest(prompt)
+            if conflict:
+                return False
+            self._remember(digest, prompt, response)
+            self._pending[digest] = (prompt, response)
+            self._after_write()
+        return True
+
+    def add_usage(
+        self, input_tokens: int, output_tokens: int, timestamp: str, model: str
+    ):
+        self._check_pid()
+        with self._lock:
+            self._usage.append((input_tokens, output_tokens, timestamp, model))
+            self._after_write()
+
+    def _after_write(self):
+        if len(self._pending) + len(self._usage) >= self.commit_batch:
+            self.flush()
+        else:
+            self._start_flusher()
+
+    def _start_flusher(self):
+        if self._flusher is None:
+            self._flusher = threading.Thread(
+                target=self._flush_periodically, daemon=True
+            )
+            self._flusher.start()
+
+    def _flush_periodically(self):
+        pid = os.getpid()
+        while not self._closed and self._pid == pid:
+            time.sleep(self.commit_interval)
+            try:
+                self.flush()
+            except sqlite3.Error as e:
+                logger.warning("Failed to commit to GPT cache %s: %s", self.path, e)
+
+    def flush(self):
+        if self._pid != os.getpid():
+            return
+        with self._lock:
+            if len(self._pending) + len(self._usage) + len(self._touched) == 0:
+                return
+            pending = self._pending
+            usage = self._usage
+            touched = self._touched
+            self._pending = {}
+            self._usage = []
+            self._touched = {}
+
+            try:
+                self._write(pending, usage, touched)
+            except sqlite3.Error:
+                # kept for the next flush
+                self._pending = {**pending, **self._pending}
+                self._usage = usage + self._usage
+                self._touched = {**touched, **self._touched}
+                raise
+            self.stats.commits += 1
+
+    def _write(
+        self,
+        pending: dict[str, tuple[str, str]],
+        usage: list[UsageRow],
+        touched: dict[str, float],
+    ):
+        db = self._connection()
+        cursor = db.cursor()
+        # locked for writing up front, what is read below stays true
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            totals = self._load_totals(cursor)
+            compressor = self._current_compressor(cursor)
+            for digest, (prompt, response) in pending.items():
+                self._store(cursor, compressor, totals, digest, prompt, response)
+            cursor.executemany(
+                "UPDATE gpt_entry SET last_used = ? WHERE cache_digest = ?",
+                [(last_used, digest) for digest, last_used in touched.items()],
+            )
+            cursor.executemany(
+                "INSERT INTO gpt_usage (input_tokens, output_tokens, timestamp, model) VALUES (?, ?, ?, ?)",
+                usage,
+            )
+            self._evict(cursor, totals)
+            if len(pending) > 0:
+                self._maybe_train_dictionary(cursor, totals)
+            self._save_totals(cursor, totals)
+            db.commit()
+        except BaseException:
+            db.rollback()
+            raise
+
+    # maintenance, see exp_scripts/maintain_gpt_cache.py
+
+    def storage_stats(self) -> dict:
+        self._check_pid()
+        with self._lock:
+            cursor = self._connection().cursor()
+            totals = self._load_totals(cursor)
+            cursor.execute(
+                "SELECT COUNT(*), COALESCE(SUM(blob_raw_size), 0) FROM gpt_blob"
+            )
+            blobs, raw_bytes = cursor.fetchone()
+            cursor.execute("SELECT MIN(last_used), MAX(last_used) FROM gpt_entry")
+            oldest_use, newest_use = cursor.fetchone()
+            cursor.execute("SELECT COUNT(*) FROM gpt_usage")
+            usage_rows = cursor.fetchone()[0]
+            cursor.execute("SELECT MAX(dict_id) FROM gpt_dict")
+            dict_id = cursor.fetchone()[0]
+            file_bytes = sum(
+                os.path.getsize(self.path + suffix)
+                for suffix in ("", "-wal")
+                if os.path.exists(self.path + suffix)
+            )
+            return {
+                "entries": totals[0],
+                "blobs": blobs,
+                "blob_bytes": totals[1],
+                "raw_bytes": raw_bytes,
+                "dictionary": dict_id,
+                "usage_rows": usage_rows,
+                "oldest_use": oldest_use,
+                "newest_use": newest_use,
+                "file_bytes": file_bytes,
+                "limits": self.limits.to_json(),
+            }
+
+    def vacuum(self, retrain: bool = True):
+        # evicts down to the limits, retrains the dictionary on the current
+        # blobs and recompresses them, and shrinks the file; other processes
+        # wait for it to finish before writing
+        self.flush()
+        with self._lock:
+            db = self._connection()
+            cursor = db.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            try:
+                # blobs no entry refers to, and totals counted afresh
+                cursor.execute("DELETE FROM gpt_blob WHERE blob_refs <= 0")
+                cursor.execute("SELECT COUNT(*) FROM gpt_entry")
+                entries = cursor.fetchone()[0]
+                cursor.execute(
+                    "SELECT COALESCE(SUM(length(blob_data)), 0) FROM gpt_blob"
+                )
+                totals = [entries, cursor.fetchone()[0]]
+                self._evict(cursor, totals)
+                if retrain:
+                    self._train_dictionary(cursor, totals)
+                self._save_totals(cursor, totals)
+                db.commit()
+            except BaseException:
+                db.rollback()
+                raise
+            cursor.execute("VACUUM")
+            cursor.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    def close(self):
+        self.flush()
+        with self._lock:
+            self._closed = True
+            if self._db is not None and self._pid == os.getpid():
+                self._db.close()
+            self._db = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+# connections of a parent process seen by a forked child, kept alive so they
+# are never closed (or finalized) by the child
+_inherited_connections: list[sqlite3.Connection] = []
@@ -1,17 +1,22 @@
+import asyncio
 import datetime
 import hashlib
 import json
 import os
+import random
 import re
-import sqlite3
 import traceback
 import typing
 from typing import Optional
 
-from openai import OpenAI
+import openai
+from openai import AsyncOpenAI, OpenAI
+from tqdm import tqdm
 
 from . import file_names, load_internal_config, logger
 from .gen_inv.base import API_DOMAIN_ALL_PLACEHOLDER, APIDomainAllPlaceholder, Field
+from .gpt_cache import PROMPT_CHUNK_SEPARATOR, GPTCache, GPTCacheLimits
+from .rate_limiter import RateLimiter
 
 RESPONSE_CODE_PATTERN = re.compile("```(?:\w+\s+)?(.*?)```", re.DOTALL)
 RESPONSE_INVARIANT_PATTERN = re.compile("<invariant>(.*?)</invariant>")
@@ -19,6 +24,21 @@ RESPONSE_FIELD_PATTERN = re.compile("<field>(.*?)</field>")
 
 RESPONSE_JSON_PATTERN = re.compile("```json\n(.*?)```", re.DOTALL)
 
+# characters per token, for charging a prompt against the tokens per minute
+# before its actual usage is known
+CHARS_PER_TOKEN = 4
+# retried requests wait a random time up to base * 2^attempt seconds, capped
+RETRY_BACKOFF_BASE = 1.0
+RETRY_BACKOFF_MAX = 60.0
+
+
+def default_gpt_cache_limits() -> GPTCacheLimits:
+    return GPTCacheLimits(
+        max_bytes=load_internal_config.gpt_cache_max_bytes,
+        max_entries=load_internal_config.gpt_cache_max_entries,
+        evict=load_internal_config.gpt_cache_evict,
+    )
+
 
 class GPTInvoker:
     def __init__(
@@ -32,6 +52,10 @@ class GPTInvoker:
         api_host: Optional[str] = None,
         always_disable_cache: bool = False,
         dump_gpt_log: bool = False,
+        concurrency: Optional[int] = None,
+        requests_per_minute: Optional[float] = None,
+        tokens_per_minute: Optional[float] = None,
+        max_retries: Optional[int] = None,
     ) -> None:
         api_key = api_key if api_key is not None else load_internal_config.api_key
         model = model if model is not None else load_internal_config.api_model
@@ -44,7 +68,25 @@ class GPTInvoker:
         )
         turns = turns if turns is not None else load_internal_config.turns
         api_host = api_host if api_host is not None else load_internal_config.api_host
+        concurrency = (
+            concurrency if concurrency is not None else load_internal_config.concurrency
+        )
+        requests_per_minute = (
+            requests_per_minute
+            if requests_per_minute is not None
+            else load_internal_config.requests_per_minute
+        )
+        tokens_per_minute = (
+            tokens_per_minute
+            if tokens_per_minute is not None
+            else load_internal_config.tokens_per_minute
+        )
+        max_retries = (
+            max_retries if max_retries is not None else load_internal_config.max_retries
+        )
 
+        self.api_key = api_key
+        self.api_host = api_host
         self.client = OpenAI(api_key=api_key, base_url=api_host, timeout=1800)
         self.model = model
         self.model_args = {
@@ -55,7 +97,20 @@ class GPTInvoker:
         self.turns = turns
         self.dump_gpt_log = dump_gpt_log
 
-        self.gpt_cache = sqlite3.connect(file_names.gpt_cache_sqlite)
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.rate_limiter = RateLimiter(requests_per_minute, tokens_per_minute)
+        # bound to the event loop `agenerate` runs in, see _loop_state
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._async_client: AsyncOpenAI | None = None
+        self._slots: asyncio.Semaphore | None = None
+        self._inflight: dict[str, asyncio.Future] = {}
+        # callers awaiting each in flight request
+        self._waiters: dict[asyncio.Future, int] = {}
+
+        self.gpt_cache = GPTCache(
+            file_names.gpt_cache_sqlite, limits=default_gpt_cache_limits()
+        )
         self._init_gpt_cache()
 
         self.always_disable_cache = always_disable_cache
@@ -69,18 +124,6 @@ class GPTInvoker:
         self.prompt_organize_input_error = None
 
     def _init_gpt_cache(self):
-        cursor = self.gpt_cache.cursor()
-        cursor.execute(
-            "CREATE TABLE IF NOT EXISTS gpt_cache (cache_id PRIMARY KEY, cache_digest TEXT, cache_prompt TEXT, cache_response TEXT)"
-        )
-        cursor.execute(
-            "CREATE INDEX IF NOT EXISTS cache_digest_index ON gpt_cache (cache_digest)"
-        )
-        cursor.execute(
-            "CREATE TABLE IF NOT EXISTS gpt_usage (input_tokens INT, output_tokens INT, timestamp TEXT, model TEXT)"
-        )
-        self.gpt_cache.commit()
-
         seperate_token = "|9ZPA|"
         model_args_sorted = sorted(self.model_args.items())
         msg_concat = []
@@ -94,59 +137,28 @@ class GPTInvoker:
         self.model_args_str = "".join(msg_concat)
 
     def add_to_gpt_usage(self, input_tokens: int, output_tokens: int):
-        cursor = self.gpt_cache.cursor()
         now = datetime.datetime.now().strftime("%Y-%m-%d-%H-%M-%S")
-        cursor.execute(
-            "INSERT INTO gpt_usage (input_tokens, output_tokens, timestamp, model) VALUES (?, ?, ?, ?)",
-            (input_tokens, output_tokens, now, self.model),
-        )
-        self.gpt_cache.commit()
+        self.gpt_cache.add_usage(input_tokens, output_tokens, now, self.model)
 
     def _query_gpt_cache(self, msg_digest: str, msg_concat: str) -> Optional[str]:
-        cursor = self.gpt_cache.cursor()
-        cursor.execute(
-            "SELECT cache_prompt, cache_response FROM gpt_cache WHERE cache_digest = ? ",
-            (msg_digest,),
-        )
-        response = cursor.fetchone()
-        if response:
-            cache_prompt_q, cache_response = response
-            if cache_prompt_q == msg_concat:
-                return cache_response
-        return None
+        return self.gpt_cache.get(msg_digest, msg_concat)
 
     def _put_gpt_cache(self, msg_digest: str, msg_concat: str, msg_response: str):
-        cursor = self.gpt_cache.cursor()
-        cursor.execute(
-            "SELECT cache_prompt FROM gpt_cache WHERE cache_digest = ? ",
-            (msg_digest,),
-        )
-        response = cursor.fetchone()
-        if response:
-            cache_prompt_q = response[0]
-            if cache_prompt_q == msg_concat:
-                cursor.execute(
-                    "UPDATE gpt_cache SET cache_response = ? WHERE cache_digest = ?",
-                    (msg_response, msg_digest),
-                )
-            else:
-                return
-        else:
-            cursor.execute(
-                "INSERT INTO gpt_cache (cache_digest, cache_prompt, cache_response) VALUES (?, ?, ?)",
-                (msg_digest, msg_concat, msg_response),
-            )
-        self.gpt_cache.commit()
+        if not self.gpt_cache.put(msg_digest, msg_concat, msg_response):
+            return
 
+        # the prompt and response are in the cache, stored once
         now = datetime.datetime.now().strftime("%Y-%m-%d-%H-%M-%S")
         log_record = (
-            repr((now, msg_digest, msg_concat, msg_response)).encode("utf-8") + b"\n"
+            repr((now, msg_digest, len(msg_concat), len(msg_response))).encode("utf-8")
+            + b"\n"
         )
         self.gpt_log.write(log_record)
 
     def _msg_digest(self, message: list[dict[str, str]]) -> tuple[str, str]:
         msg_concat = [self.model_args_str]
-        seperate_token = "|s9Z69ZPA|"
+        # every message is a chunk of the prompt in the cache
+        seperate_token = PROMPT_CHUNK_SEPARATOR
         for msg in message:
             role = msg["role"]
             content = msg["content"]
@@ -239,6 +251,215 @@ class GPTInvoker:
 
         return response
 
+    def _loop_state(
+        self, concurrency: Optional[int] = None
+    ) -> tuple[AsyncOpenAI, asyncio.Semaphore]:
+        # the async client, request slots and in flight requests belong to
+        # one event loop, they are made anew when agenerate runs in another
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._async_client = AsyncOpenAI(
+                api_key=self.api_key,
+                base_url=self.api_host,
+                timeout=1800,
+                max_retries=0,
+            )
+            self._slots = asyncio.Semaphore(
+                concurrency if concurrency is not None else self.concurrency
+            )
+            self._inflight = {}
+            self._waiters = {}
+        assert self._async_client is not None and self._slots is not None
+        return self._async_client, self._slots
+
+    async def _close_loop_state(self):
+        if self._async_client is not None:
+            await self._async_client.close()
+        self._loop = None
+        self._async_client = None
+        self._slots = None
+        self._inflight = {}
+        self._waiters = {}
+
+    def _retry_delay(self, e: Exception, attempt: int) -> Optional[float]:
+        # seconds to wait before retrying a request failing with `e`, None if
+        # it is not worth retrying
+        if attempt >= self.max_retries:
+            return None
+        if isinstance(e, openai.APIStatusError):
+            if e.status_code != 429 and e.status_code < 500:
+                return None
+        elif not isinstance(e, openai.APIConnectionError):
+            return None
+        delay = random.uniform(
+            0, min(RETRY_BACKOFF_MAX, RETRY_BACKOFF_BASE * 2**attempt)
+        )
+        if isinstance(e, openai.APIStatusError):
+            try:
+                delay = max(delay, float(e.response.headers.get("retry-after")))
+            except (TypeError, ValueError):
+                pass
+            if e.status_code == 429:
+                # the account is over its limits, hold back every request
+                self.rate_limiter.pause(delay)
+        return delay
+
+    async def agenerate_inner(self, messages: list[dict[str, str]]) -> str:
+        client, slots = self._loop_state()
+        # charged as the API does, the prompt plus all tokens it may generate;
+        # settled with the actual usage once it is known
+        prompt_chars = sum(len(msg["content"]) for msg in messages)
+        max_tokens = self.model_args["max_tokens"] or 0
+        charged = prompt_chars // CHARS_PER_TOKEN + max_tokens
+        attempt = 0
+        while True:
+            async with slots:
+                await self.rate_limiter.acquire(charged)
+                try:
+                    response = await client.chat.completions.create(
+                        model=self.model, messages=messages, **self.model_args
+                    )
+                    break
+                except Exception as e:
+                    self.rate_limiter.settle(charged, 0)
+                    delay = self._retry_delay(e, attempt)
+                    if delay is None:
+                        raise
+                    error = e
+            attempt += 1
+            logger.warning(
+                "Retrying request to %s in %.1fs (attempt %d): %s",
+                self.model,
+                delay,
+                attempt,
+                error,
+            )
+            await asyncio.sleep(delay)
+
+        usage = response.usage
+        self.rate_limiter.settle(charged, usage.prompt_tokens + usage.completion_tokens)
+        self.add_to_gpt_usage(usage.prompt_tokens, usage.completion_tokens)
+        return response.choices[0].message.content
+
+    async def _agenerate_uncached(
+        self, messages: list[dict[str, str]], msg_digest: str, msg_concat: str
+    ) -> str:
+        logger.debug(
+            "Generating response from %s with input length %d",
+            self.model,
+            len(msg_concat),
+        )
+        try:
+            response = await self.agenerate_inner(messages)
+        except Exception:
+            if self.dump_gpt_log:
+                err_msg = traceback.format_exc()
+                self.dump_log(messages, err_msg, False, True)
+            raise
+        logger.debug(
+            "Generated response from %s with output length %d",
+            self.model,
+            len(response),
+        )
+
+        self._put_gpt_cache(msg_digest, msg_concat, response)
+
+        if self.dump_gpt_log:
+            self.dump_log(messages, response, False)
+
+        return response
+
+    async def agenerate(
+        self, messages: list[dict[str, str]], ignore_cache=False
+    ) -> str:
+        # `generate` for asyncio: at most `concurrency` requests are in flight,
+        # under the rate limits, and requests failing with a rate limit,
+        # server or connection error are retried with a jittered backoff.
+        # The same prompt asked again while in flight is only requested once,
+        # and the request is cancelled once every caller awaiting it is.
+        msg_digest, msg_concat = self._msg_digest(messages)
+        if ignore_cache or self.always_disable_cache:
+            return await self._agenerate_uncached(messages, msg_digest, msg_concat)
+
+        gpt_cache = self._query_gpt_cache(msg_digest, msg_concat)
+        if gpt_cache is not None:
+            if self.dump_gpt_log:
+                self.dump_log(messages, gpt_cache, True)
+            return gpt_cache
+
+        self._loop_state()
+        key = msg_digest + msg_concat
+        pending = self._inflight.get(key, None)
+        if pending is None:
+            pending = asyncio.ensure_future(
+                self._agenerate_uncached(messages, msg_digest, msg_concat)
+            )
+            self._inflight[key] = pending
+            pending.add_done_callback(lambda _: self._inflight.pop(key, None))
+        self._waiters[pending] = self._waiters.get(pending, 0) + 1
+        try:
+            return await asyncio.shield(pending)
+        except asyncio.CancelledError:
+            if self._waiters[pending] == 1:
+                pending.cancel()
+            raise
+        finally:
+            self._waiters[pending] -= 1
+            if self._waiters[pending] == 0:
+                del self._waiters[pending]
+
+    def run_many(
+        self,
+        coros: list[typing.Coroutine],
+        concurrency: Optional[int] = None,
+        desc: Optional[str] = None,
+    ) -> list:
+        # runs coroutines calling `agenerate` in one event loop, at most
+        # `concurrency` requests in flight; results are in the order of
+        # `coros`, and the first exception raised is raised here
+        return asyncio.run(self._run_many(coros, concurrency, desc))
+
+    async def _run_many(
+        self,
+        coros: list[typing.Coroutine],
+        concurrency: Optional[int],
+        desc: Optional[str],
+    ) -> list:
+        self._loop_state(concurrency)
+        progress = tqdm(total=len(coros), desc=desc) if desc is not None else None
+
+        async def run(coro: typing.Coroutine):
+            result = await coro
+            if progress is not None:
+                progress.update(1)
+            return result
+
+        tasks = [asyncio.ensure_future(run(coro)) for coro in coros]
+        try:
+            return await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            if progress is not None:
+                progress.close()
+            await self._close_loop_state()
+
+    def generate_many(
+        self,
+        prompts: list[list[dict[str, str]]],
+        concurrency: Optional[int] = None,
+        ignore_cache=False,
+        desc: Optional[str] = None,
+    ) -> list[str]:
+        # `generate` of every prompt, see agenerate and run_many
+        return self.run_many(
+            [self.agenerate(prompt, ignore_cache) for prompt in prompts],
+            concurrency,
+            desc,
+        )
+
     def extract_code(self, message: str) -> str:
         code_matches = RESPONSE_CODE_PATTERN.findall(message)
         if len(code_matches) == 0:
@@ -2,7 +2,6 @@ import json
 import os
 import pickle
 
-import tqdm
 import zstandard
 
 from .. import logger
@@ -54,9 +53,9 @@ def hmm_predict_via_llm(
     truncate_prob: float = 0.1,
 ):
     all_result = {}
-    result_dict_list = list(result_dict.items())
-    t = tqdm.tqdm(result_dict_list)
-    for api, targets in t:
+    # api -> (prompt, candidate apis), asked all at once below
+    to_predict = {}
+    for api, targets in result_dict.items():
         to_filter = []
         for idx, (prob, _, tgt_api) in enumerate(targets):
             if external_apis is not None and tgt_api not in external_apis:
@@ -94,9 +93,11 @@ def hmm_predict_via_llm(
                 ),
             },
         ]
+        to_predict[api] = (prompt, all_candidates)
 
+    async def predict(prompt: list[dict[str, str]], all_candidates: set[str]):
         for _ in range(5):
-            output = gpt_invoker.generate(prompt)
+            output = await gpt_invoker.agenerate(prompt)
             try:
                 output_json = gpt_invoker.extract_json(output)
                 if "related_apis" not in output_json:
@@ -107,7 +108,7 @@ def hmm_predict_via_llm(
                         raise ValueError(
                             f"Related API {related_api} not in the candidate list. Do you have a typo?"
                         )
-                break
+                return related_apis
             except Exception as e:
                 error_str = str(e)
                 prompt.append(
@@ -122,10 +123,15 @@ def hmm_predict_via_llm(
                         "content": HMM_FILTER_RETRY.format(error=error_str),
                     }
                 )
-        else:
-            all_result[api] = None
-            logger.error("Failed to extract related APIs for %s", api)
+        return None
 
+    results = gpt_invoker.run_many(
+        [predict(prompt, candidates) for prompt, candidates in to_predict.values()],
+        desc="Predicting Related APIs",
+    )
+    for api, related_apis in zip(to_predict, results):
+        if related_apis is None:
+            logger.error("Failed to extract related APIs for %s", api)
         all_result[api] = related_apis
 
     return all_result
@@ -10,6 +10,18 @@ _params = {
     "temperature": 0.0,
     "top_p": 1.0,
     "turns": 3,
+    # requests in flight at once in GPTInvoker.generate_many / run_many
+    "concurrency": 8,
+    # client side limits of the account, None for no limit
+    "requests_per_minute": None,
+    "tokens_per_minute": None,
+    # of a request failing with a rate limit, server or connection error
+    "max_retries": 6,
+    # size of the GPT cache file, None for no limit; entries beyond are
+    # evicted, "lru": least recently used first, "size": largest first
+    "gpt_cache_max_bytes": None,
+    "gpt_cache_max_entries": None,
+    "gpt_cache_evict": "lru",
 }
 
 __all__ = list(_params.keys())
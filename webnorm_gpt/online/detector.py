@@ -0,0 +1,358 @@
+import json
+import os
+import time
+import typing
+from collections import defaultdict, deque
+from dataclasses import dataclass
+
+import numpy as np
+
+from .. import logger
+from ..file_types.binlog_file import DbTableBinlog, apply_binlog_item
+from ..file_types.compute_context import compute_context_train_ticket_log
+from ..file_types.log_file import LogFile, LogItem, LogReceiverPairer
+from ..file_types.proj_desc_file import ProjDescFile
+from ..gen_inv.base import Invariant
+from ..gen_inv.check_inv import (
+    PREDICATE_OVERRUNS,
+    PredicateLimits,
+    PredicateVerdicts,
+)
+from ..gen_inv.eval_engine import InvariantEvaluator
+from ..gen_inv.inv_set import load_invariants_file
+from ..gen_inv.predicate_cache import predicate_cache_path
+from ..schema_induction.db import DbDump, DbSchema
+from ..schema_induction.join import (
+    NEAREST_RELATED_MAX_ROWS,
+    NEAREST_RELATED_MAX_SECONDS,
+)
+from ..schema_induction.prepared_check import ComputeContext, PreparedCheck
+from .sources import LineSource
+
+
+@dataclass
+class OnlineConfig:
+    # a batch is checked once it has `batch_size` logs, or its oldest log
+    # waited `max_batch_delay` seconds
+    batch_size: int = 64
+    max_batch_delay: float = 0.5
+    # logs kept per api as the other side of nearest related joins, the
+    # defaults cover everything nearest_related_before_rows can look at
+    window_rows: int = NEAREST_RELATED_MAX_ROWS
+    window_seconds: float = NEAREST_RELATED_MAX_SECONDS
+    # enters waiting for their exit, per api
+    max_pending: int = 1024
+    # seconds between checks of the invariant file for changes
+    reload_interval: float = 5.0
+    # latest latencies / batch times the reported percentiles are taken over
+    metrics_window: int = 4096
+
+
+@dataclass
+class Detection:
+    inv_id: int
+    invariant: Invariant
+    log_item: LogItem
+    err: str | None
+    # seconds from the exit event being read to the verdict
+    latency: float
+
+
+def _percentile_ms(values: deque[float], q: float) -> float:
+    if len(values) == 0:
+        return 0.0
+    return float(np.percentile(np.fromiter(values, dtype=np.float64), q)) * 1000
+
+
+class OnlineMetrics:
+    def __init__(self, window: int):
+        self.events = 0
+        self.bad_events = 0
+        self.logs = 0
+        self.checks = 0
+        self.detections = 0
+        self.overruns = 0
+        self.batches = 0
+        # batches which failed to be checked, and their logs
+        self.failed_batches = 0
+        self.dropped_logs = 0
+        self.reloads = 0
+        # seconds, per checked log / per batch, the latest `window` of each
+        self.latencies: deque[float] = deque(maxlen=window)
+        self.join_times: deque[float] = deque(maxlen=window)
+        self.evaluate_times: deque[float] = deque(maxlen=window)
+
+    def to_json(self) -> dict:
+        return {
+            "events": self.events,
+            "bad_events": self.bad_events,
+            "logs": self.logs,
+            "checks": self.checks,
+            "detections": self.detections,
+            "overruns": self.overruns,
+            "batches": self.batches,
+            "failed_batches": self.failed_batches,
+            "dropped_logs": self.dropped_logs,
+            "reloads": self.reloads,
+            "latency_p50_ms": _percentile_ms(self.latencies, 50),
+            "latency_p99_ms": _percentile_ms(self.latencies, 99),
+            "join_p50_ms": _percentile_ms(self.join_times, 50),
+            "evaluate_p50_ms": _percentile_ms(self.evaluate_times, 50),
+        }
+
+
+# Invariant checking on live traffic. Events of the log receiver are paired
+# into logs and their context is computed as they arrive; completed logs are
+# checked in small batches, joined the same way 004_check_inv.py joins a
+# recorded window. The last `window_rows` logs of every api (at most
+# `window_seconds` old) are joined along with each batch, so nearest related
+# events are found across batches, but only logs of the batch are checked.
+#
+# The db side is a snapshot plus the binlog; `feed_binlog` appends live
+# binlog items, which joins read from the next batch on. The invariant file
+# is reloaded when it changes, a file which fails to load keeps the previous
+# invariants running.
+class OnlineDetector:
+    def __init__(
+        self,
+        proj_desc_file: ProjDescFile,
+        inv_path: str,
+        db_dump: DbDump,
+        log_schema: DbSchema,
+        foreign_key_results,
+        dataflow_map,
+        db_binlogs: dict[str, DbTableBinlog] | None = None,
+        config: OnlineConfig | None = None,
+        limits: PredicateLimits | None = None,
+        num_workers: int = 0,
+        compute_context: ComputeContext = compute_context_train_ticket_log,
+        on_detection: typing.Callable[[Detection], None] | None = None,
+    ):
+        self.config = config if config is not None else OnlineConfig()
+        self.limits = limits
+        self.num_workers = num_workers
+        self.compute_context = compute_context
+        self.on_detection = on_detection
+        self.inv_path = inv_path
+        self.metrics = OnlineMetrics(self.config.metrics_window)
+
+        self.pairer = LogReceiverPairer(proj_desc_file, self.config.max_pending)
+        self.db_binlogs = db_binlogs if db_binlogs is not None else {}
+        # context is computed once, when a log completes
+        self.prepared = PreparedCheck(
+            db_dump,
+            log_schema,
+            foreign_key_results,
+            dataflow_map,
+            self.db_binlogs,
+            compute_context=None,
+        )
+
+        self.window: dict[str, deque[LogItem]] = defaultdict(
+            lambda: deque(maxlen=self.config.window_rows)
+        )
+        # (log, when its exit was read)
+        self.batch: list[tuple[LogItem, float]] = []
+
+        self.evaluator: InvariantEvaluator | None = None
+        self.inv_mtime: float | None = None
+        self.last_reload_check = 0.0
+        self.reload_invariants()
+        if self.evaluator is None:
+            raise ValueError(f"Failed to load invariants from {inv_path}")
+
+    def reload_invariants(self) -> bool:
+        # loads the invariant file if it changed since the last load
+        self.last_reload_check = time.monotonic()
+        try:
+            mtime = os.stat(self.inv_path).st_mtime
+        except FileNotFoundError:
+            logger.warning("Invariant file %s not found", self.inv_path)
+            return False
+        if mtime == self.inv_mtime:
+            return False
+        self.inv_mtime = mtime
+
+        try:
+            invariants = load_invariants_file(self.inv_path)
+        except Exception as e:
+            logger.warning(
+                "Failed to load invariants from %s, keeping the previous ones",
+                self.inv_path,
+                exc_info=e,
+            )
+            return False
+
+        evaluator = InvariantEvaluator(
+            invariants,
+            self.num_workers,
+            limits=self.limits,
+            predicate_cache_paths=[predicate_cache_path(self.inv_path)],
+        )
+        old_evaluator = self.evaluator
+        self.evaluator = evaluator
+        self.prepared.joiner.reached_by_api = evaluator.inv_set.reached_joins_by_api()
+        if old_evaluator is not None:
+            old_evaluator.close()
+            self.metrics.reloads += 1
+        logger.info("Loaded %d invariants from %s", len(invariants), self.inv_path)
+        return True
+
+    def feed_binlog(
+        self,
+        item: dict,
+        all_info,
+        focus_schema_name: str,
+        db_merge_info: list[tuple[str, str]] = [],
+    ):
+        # `item` as in the binlog files read by process_binlog_file
+        apply_binlog_item(
+            self.db_binlogs, all_info, item, focus_schema_name, db_merge_info
+        )
+
+    def feed(self, line: str) -> list[Detection]:
+        self.metrics.events += 1
+        line = line.strip()
+        if line:
+            try:
+                _, log_item = self.pairer.feed(json.loads(line))
+                if log_item is not None:
+                    self.compute_context(log_item)
+            except Exception as e:
+                self.metrics.bad_events += 1
+                logger.warning("Failed to process event: %s", line[:200], exc_info=e)
+                log_item = None
+            if log_item is not None:
+                self.batch.append((log_item, time.monotonic()))
+                self.metrics.logs += 1
+        return self.poll()
+
+    def poll(self) -> list[Detection]:
+        # runs what is due: reloading the invariants, checking the batch
+        now = time.monotonic()
+        if now - self.last_reload_check >= self.config.reload_interval:
+            self.reload_invariants()
+        if len(self.batch) == 0:
+            return []
+        if (
+            len(self.batch) >= self.config.batch_size
+            or now - self.batch[0][1] >= self.config.max_batch_delay
+        ):
+            return self.flush()
+        return []
+
+    def _window_logs(self, newest_time: float) -> list[LogItem]:
+        oldest_time = newest_time - self.config.window_seconds
+        logs = []
+        for window in self.window.values():
+            while len(window) > 0 and window[0].parse_time() < oldest_time:
+                window.popleft()
+            logs.extend(window)
+        return logs
+
+    def flush(self) -> list[Detection]:
+        if len(self.batch) == 0:
+            return []
+        batch = self.batch
+        self.batch = []
+        self.metrics.batches += 1
+        try:
+            return self._check_batch(batch)
+        except Exception as e:
+            # not queued again, a batch failing once would most likely fail
+            # again and hold up the ones after it
+            self.metrics.failed_batches += 1
+            self.metrics.dropped_logs += len(batch)
+            logger.warning(
+                "Failed to check a batch of %d logs, dropping it",
+                len(batch),
+                exc_info=e,
+            )
+            return []
+
+    def _check_batch(self, batch: list[tuple[LogItem, float]]) -> list[Detection]:
+        assert self.evaluator is not None
+
+        join_start = time.perf_counter()
+        new_logs = [log_item for log_item, _ in batch]
+        arrived = {id(log_item): t for log_item, t in batch}
+        newest_time = max(log_item.parse_time() for log_item in new_logs)
+        log_file = LogFile()
+        log_file.log_items = sorted(
+            self._window_logs(newest_time) + new_logs, key=lambda log: log.time
+        )
+        # joined logs keep their position in log_file as `seq`
+        checked = {
+            seq: log_item
+            for seq, log_item in enumerate(log_file.log_items)
+            if id(log_item) in arrived
+        }
+        for log_item in new_logs:
+            self.window[log_item.api].append(log_item)
+
+        logs, _ = self.prepared.join_logs([log_file])
+
+        tasks = []
+        for api in self.evaluator.inv_set:
+            if api not in logs:
+                continue
+            for joined in logs[api].log_items:
+                seq = joined.content.get("seq", None)
+                if seq in checked:
+                    tasks.append((seq, joined))
+        self.metrics.join_times.append(time.perf_counter() - join_start)
+
+        evaluate_start = time.perf_counter()
+        detections = []
+        for inv_id, seq, verdict, err in self.evaluator.evaluate(tasks):
+            self.metrics.checks += 1
+            if verdict in PREDICATE_OVERRUNS:
+                self.metrics.overruns += 1
+            if verdict != PredicateVerdicts.Fail:
+                continue
+            log_item = checked[seq]
+            detection = Detection(
+                inv_id,
+                self.evaluator.invariants[inv_id],
+                log_item,
+                err,
+                time.monotonic() - arrived[id(log_item)],
+            )
+            detections.append(detection)
+            self.metrics.detections += 1
+            if self.on_detection is not None:
+                self.on_detection(detection)
+        self.metrics.evaluate_times.append(time.perf_counter() - evaluate_start)
+
+        now = time.monotonic()
+        for _, t in batch:
+            self.metrics.latencies.append(now - t)
+        return detections
+
+    def run(
+        self, source: LineSource, metrics_interval: float | None = 60.0
+    ) -> typing.Iterator[Detection]:
+        last_metrics = time.monotonic()
+        for line in source:
+            if line is None:
+                yield from self.poll()
+            else:
+                yield from self.feed(line)
+            if (
+                metrics_interval is not None
+                and time.monotonic() - last_metrics >= metrics_interval
+            ):
+                last_metrics = time.monotonic()
+                logger.info("Online detector: %s", json.dumps(self.metrics.to_json()))
+        yield from self.flush()
+
+    def close(self):
+        if self.evaluator is not None:
+            self.evaluator.close()
+            self.evaluator = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,118 @@
+import os
+import queue
+import socketserver
+import threading
+import time
+import typing
+
+from .. import logger
+
+# A source yields the lines of the log receiver as they arrive, and None
+# whenever nothing arrived for a while, so its consumer gets to run timers
+# (batch flushes, reloads) on an idle stream too.
+LineSource = typing.Iterable[typing.Optional[str]]
+
+
+def follow_file(
+    file_path: str,
+    poll_interval: float = 0.2,
+    from_start: bool = True,
+    stop: threading.Event | None = None,
+) -> typing.Iterator[typing.Optional[str]]:
+    # `tail -F` of a plain text jsonl file, the file is reopened when it is
+    # rotated or truncated
+    while not os.path.exists(file_path):
+        if stop is not None and stop.is_set():
+            return
+        yield None
+        time.sleep(poll_interval)
+
+    f = open(file_path, "rt")
+    if not from_start:
+        f.seek(0, os.SEEK_END)
+    partial = ""
+    try:
+        while stop is None or not stop.is_set():
+            line = f.readline()
+            if line:
+                if not line.endswith("\n"):
+                    # the writer has not finished this line yet
+                    partial += line
+                    continue
+                yield partial + line
+                partial = ""
+                continue
+
+            try:
+                stat = os.stat(file_path)
+            except FileNotFoundError:
+                stat = None
+            if stat is not None and (
+                stat.st_ino != os.fstat(f.fileno()).st_ino or stat.st_size < f.tell()
+            ):
+                logger.info("Log file %s was rotated, reopening", file_path)
+                f.close()
+                f = open(file_path, "rt")
+                partial = ""
+                continue
+
+            yield None
+            time.sleep(poll_interval)
+    finally:
+        f.close()
+
+
+class _LineHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for raw in self.rfile:
+            line = raw.decode("utf-8", errors="replace")
+            # blocks while the queue is full, which stalls this sender
+            self.server.lines.put(line)  # type: ignore
+
+
+class _LineServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+# Lines sent by any number of local TCP clients, one event per line. The
+# queue between the connections and the consumer is bounded, a consumer that
+# falls behind slows the senders down instead of growing without limit.
+class SocketLineSource:
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        idle_timeout: float = 0.2,
+        max_queued: int = 65536,
+    ):
+        self.idle_timeout = idle_timeout
+        self.server = _LineServer((host, port), _LineHandler)
+        self.server.lines = queue.Queue(max_queued)  # type: ignore
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        self.closed = False
+
+    @property
+    def address(self) -> tuple[str, int]:
+        return self.server.server_address  # type: ignore
+
+    def __iter__(self) -> typing.Iterator[typing.Optional[str]]:
+        lines: queue.Queue = self.server.lines  # type: ignore
+        while not self.closed:
+            try:
+                yield lines.get(timeout=self.idle_timeout)
+            except queue.Empty:
+                yield None
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.server.shutdown()
+            self.server.server_close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,92 @@
+import asyncio
+import time
+
+
+# A bucket holding up to `capacity` units, refilled continuously at
+# `per_minute` units per minute. Taking more than there is leaves the bucket
+# in debt, which later takers wait out.
+class TokenBucket:
+    def __init__(self, per_minute: float, capacity: float | None = None):
+        self.rate = per_minute / 60.0
+        self.capacity = capacity if capacity is not None else per_minute
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, amount: float) -> float:
+        # seconds until `amount` can be taken; a request larger than the
+        # bucket only waits for a full one
+        self._refill()
+        missing = min(amount, self.capacity) - self.level
+        return max(0.0, missing / self.rate)
+
+    def take(self, amount: float):
+        self._refill()
+        self.level -= amount
+
+    def give(self, amount: float):
+        self._refill()
+        self.level = min(self.capacity, self.level + amount)
+
+
+# Client side limits of an API account, in requests and tokens per minute
+# (None for no limit). Callers `acquire` before a request, in arrival order,
+# and `settle` the tokens they were charged once the actual usage is known.
+# After a rate limit error, `pause` holds every caller back for a while.
+class RateLimiter:
+    def __init__(
+        self,
+        requests_per_minute: float | None = None,
+        tokens_per_minute: float | None = None,
+    ):
+        self.requests = (
+            TokenBucket(requests_per_minute)
+            if requests_per_minute is not None
+            else None
+        )
+        self.tokens = (
+            TokenBucket(tokens_per_minute) if tokens_per_minute is not None else None
+        )
+        self.paused_until = 0.0
+        # asyncio locks belong to one event loop, one is made per loop
+        self._lock: asyncio.Lock | None = None
+        self._lock_loop: asyncio.AbstractEventLoop | None = None
+
+    def _get_lock(self) -> asyncio.Lock:
+        loop = asyncio.get_running_loop()
+        if self._lock is None or self._lock_loop is not loop:
+            self._lock = asyncio.Lock()
+            self._lock_loop = loop
+        return self._lock
+
+    def _delay(self, tokens: int) -> float:
+        delay = self.paused_until - time.monotonic()
+        if self.requests is not None:
+            delay = max(delay, self.requests.delay(1))
+        if self.tokens is not None:
+            delay = max(delay, self.tokens.delay(tokens))
+        return delay
+
+    async def acquire(self, tokens: int):
+        async with self._get_lock():
+            while (delay := self._delay(tokens)) > 0:
+                await asyncio.sleep(delay)
+            if self.requests is not None:
+                self.requests.take(1)
+            if self.tokens is not None:
+                self.tokens.take(tokens)
+
+    def settle(self, charged: int, used: int):
+        if self.tokens is None:
+            return
+        if used > charged:
+            self.tokens.take(used - charged)
+        else:
+            self.tokens.give(charged - used)
+
+    def pause(self, seconds: float):
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
@@ -1,9 +1,132 @@
-from copy import deepcopy
+from collections.abc import Mapping
 
 from ..file_types.log_file import LogFile, LogItem
+from ..gen_inv.field_access import ALL_FIELDS, AccessTree, project_json
 from .db import DbTable, ExpandedColumn
 
 
+# Overlay of one joined log row: the original `log_data` dict plus the
+# `related_db_tables` / `related_event_logs` sections, which are gathered from
+# the joined columns only when accessed. The original dict is never copied or
+# modified, writes go to a per-row override layer.
+class JoinedLogContent(Mapping):
+    __slots__ = ("base", "idx", "joined_sql_data", "joined_log_data", "overrides")
+
+    def __init__(
+        self,
+        base: dict,
+        idx: int,
+        joined_sql_data: dict[str, dict[str, ExpandedColumn]],
+        joined_log_data: dict[str, ExpandedColumn],
+    ):
+        self.base = base
+        self.idx = idx
+        self.joined_sql_data = joined_sql_data
+        self.joined_log_data = joined_log_data
+        self.overrides = {}
+
+    def _joined_keys(self) -> list[str]:
+        keys = []
+        if len(self.joined_sql_data) > 0:
+            keys.append("related_db_tables")
+        if len(self.joined_log_data) > 0:
+            keys.append("related_event_logs")
+        return keys
+
+    def _gather(self, key: str):
+        if key == "related_db_tables":
+            value = self._gather_db_tables()
+        else:
+            value = self._gather_event_logs()
+        self.overrides[key] = value
+        return value
+
+    def get_projected(self, key: str, access: AccessTree):
+        # self.get(key, {}) projected to `access`, without gathering the
+        # joined tables `access` does not reach
+        if (
+            access is ALL_FIELDS
+            or key in self.overrides
+            or key not in self._joined_keys()
+        ):
+            return project_json(self.get(key, {}), access)
+        if key == "related_db_tables":
+            value = self._gather_db_tables(access)
+        else:
+            value = self._gather_event_logs(access)
+        return project_json(value, access)
+
+    def _gather_db_tables(self, access: AccessTree = ALL_FIELDS) -> dict:
+        i = self.idx
+        db_data_dict = dict(self.base.get("related_db_tables", {}))
+        for table_name, columns in self.joined_sql_data.items():
+            if access is not ALL_FIELDS and table_name not in access:
+                continue
+            has_non_null = False
+            for column in columns.values():
+                if column.values[i] is not None:
+                    has_non_null = True
+                    break
+            if has_non_null or table_name in db_data_dict:
+                table_dict = db_data_dict.get(table_name, {})
+                assert isinstance(table_dict, dict)
+                table_dict = dict(table_dict)
+                table_access = (
+                    ALL_FIELDS if access is ALL_FIELDS else access[table_name]
+                )
+                for column_name, column in columns.items():
+                    if column_name in table_dict:
+                        raise ValueError(f"Duplicate column name {column_name}")
+                    if table_access is ALL_FIELDS or column_name in table_access:
+                        table_dict[column_name] = column.values[i]
+                db_data_dict[table_name] = table_dict
+            else:
+                db_data_dict[table_name] = None
+        return db_data_dict
+
+    def _gather_event_logs(self, access: AccessTree = ALL_FIELDS) -> dict:
+        i = self.idx
+        log_data_dict = dict(self.base.get("related_event_logs", {}))
+        for table_name, column in self.joined_log_data.items():
+            if access is not ALL_FIELDS and table_name not in access:
+                continue
+            if table_name in log_data_dict:
+                raise ValueError(f"Duplicate table name {table_name}")
+            log_data_dict[table_name] = column.values[i]
+        return log_data_dict
+
+    def __getitem__(self, key):
+        if key in self.overrides:
+            return self.overrides[key]
+        if key in self._joined_keys():
+            return self._gather(key)
+        return self.base[key]
+
+    def __setitem__(self, key, value):
+        self.overrides[key] = value
+
+    def __contains__(self, key):
+        return key in self.overrides or key in self.base or key in self._joined_keys()
+
+    def __iter__(self):
+        yield from self.base
+        for key in self._joined_keys():
+            if key not in self.base:
+                yield key
+        for key in self.overrides:
+            if key not in self.base and key not in self._joined_keys():
+                yield key
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __reduce__(self):
+        return (dict, (dict(self),))
+
+    def __repr__(self):
+        return repr(dict(self))
+
+
 def db_table_to_log(table: DbTable) -> LogFile:
     original_log_data: None | ExpandedColumn = None
     joined_log_data: dict[str, ExpandedColumn] = {}
@@ -60,43 +183,10 @@ def db_table_to_log(table: DbTable) -> LogFile:
     result_logs = []
     for i in range(len(original_log_data.values)):
         original_log = original_log_data.values[i]
-        original_log = deepcopy(original_log)
         assert isinstance(original_log, dict)
 
-        if len(joined_sql_data) > 0:
-            if "related_db_tables" not in original_log:
-                original_log["related_db_tables"] = {}
-            db_data_dict = original_log["related_db_tables"]
-            assert isinstance(db_data_dict, dict)
-            for table_name, columns in joined_sql_data.items():
-                has_non_null = False
-                for column in columns.values():
-                    if column.values[i] is not None:
-                        has_non_null = True
-                        break
-                if has_non_null or table_name in db_data_dict:
-                    if table_name not in db_data_dict:
-                        db_data_dict[table_name] = {}
-                    table_dict = db_data_dict[table_name]
-                    assert isinstance(table_dict, dict)
-                    for column_name, column in columns.items():
-                        if column_name in table_dict:
-                            raise ValueError(f"Duplicate column name {column_name}")
-                        table_dict[column_name] = column.values[i]
-                else:
-                    db_data_dict[table_name] = None
-
-        if len(joined_log_data) > 0:
-            if "related_event_logs" not in original_log:
-                original_log["related_event_logs"] = {}
-            log_data_dict = original_log["related_event_logs"]
-            assert isinstance(log_data_dict, dict)
-            for table_name, column in joined_log_data.items():
-                if table_name in log_data_dict:
-                    raise ValueError(f"Duplicate table name {table_name}")
-                log_data_dict[table_name] = column.values[i]
-
-        log_item = LogItem(original_log)
+        content = JoinedLogContent(original_log, i, joined_sql_data, joined_log_data)
+        log_item = LogItem(content)
         result_logs.append(log_item)
 
     log_file = LogFile()
@@ -0,0 +1,273 @@
+from collections.abc import Sequence
+
+import numpy as np
+
+from .db import DbDump, DbTable, DbValue
+from .schema import JsonSchema, JsonSchemaTypes
+
+# Strings longer than this are left as plain lists, encoding them gains nothing.
+STR_DICT_LEN_MAX = 256
+
+INT64_MIN = -(2**63)
+INT64_MAX = 2**63 - 1
+
+
+# Typed storage for primitive columns. Both kinds behave as a read-only
+# sequence of python values (null is None), so code indexing `values[i]`
+# keeps working, while joins, profiling and induction use the arrays.
+class TypedColumnValues(Sequence):
+    valid: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.valid)
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return self.take(np.arange(len(self), dtype=np.int64)[idx])
+        if not self.valid[idx]:
+            return None
+        return self.get_valid(idx)
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, (list, TypedColumnValues)):
+            return self.to_list() == list(other)
+        return NotImplemented
+
+    __hash__ = None  # type: ignore
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({self.to_list()!r})"
+
+    def to_list(self) -> list[DbValue]:
+        return list(self)
+
+    def null_count(self) -> int:
+        return len(self.valid) - int(np.count_nonzero(self.valid))
+
+    def get_valid(self, idx: int) -> DbValue:
+        raise NotImplementedError()
+
+    def distinct(self) -> set[DbValue]:
+        raise NotImplementedError()
+
+    def has_duplicates(self) -> bool:
+        raise NotImplementedError()
+
+    def factorize(self) -> tuple[np.ndarray, np.ndarray, int]:
+        # (non-null rows, code of each of those rows, number of codes)
+        raise NotImplementedError()
+
+    def take(self, indices: np.ndarray) -> "TypedColumnValues":
+        # gather rows, index -1 gives null
+        raise NotImplementedError()
+
+    def induce_schema(self) -> JsonSchema | None:
+        # same result as JsonSchemaInducer, None if there is nothing to induce
+        raise NotImplementedError()
+
+
+class PrimitiveColumnValues(TypedColumnValues):
+    def __init__(self, data: np.ndarray, valid: np.ndarray):
+        assert len(data) == len(valid)
+        self.data = data
+        self.valid = valid
+
+    def __iter__(self):
+        for value, ok in zip(self.data.tolist(), self.valid.tolist()):
+            yield value if ok else None
+
+    def get_valid(self, idx: int) -> DbValue:
+        return self.data[idx].item()
+
+    def non_null(self) -> np.ndarray:
+        return self.data[self.valid]
+
+    def distinct(self) -> set[DbValue]:
+        return set(np.unique(self.non_null()).tolist())
+
+    def has_duplicates(self) -> bool:
+        values = self.non_null()
+        return len(np.unique(values)) != len(values)
+
+    def factorize(self) -> tuple[np.ndarray, np.ndarray, int]:
+        rows = np.flatnonzero(self.valid)
+        uniques, codes = np.unique(self.data[rows], return_inverse=True)
+        return rows, codes.astype(np.int64).reshape(-1), len(uniques)
+
+    def take(self, indices: np.ndarray) -> "PrimitiveColumnValues":
+        ok = indices >= 0
+        if len(self.data) == 0:
+            return PrimitiveColumnValues(
+                np.zeros(len(indices), dtype=self.data.dtype),
+                np.zeros(len(indices), dtype=np.bool_),
+            )
+        safe = np.where(ok, indices, 0)
+        return PrimitiveColumnValues(self.data[safe], ok & self.valid[safe])
+
+    def induce_schema(self) -> JsonSchema | None:
+        values = self.non_null()
+        if len(values) == 0:
+            return None
+        can_null = len(values) != len(self.valid)
+        if self.data.dtype == np.float64:
+            return JsonSchema.new_float(
+                can_null=can_null,
+                value_min=values.min().item(),
+                value_max=values.max().item(),
+                is_unique=len(np.unique(values)) == len(values),
+            )
+        # bools are ints to the inducer, which never marks int columns as
+        # having duplicates
+        return JsonSchema.new_int(
+            can_null=can_null,
+            value_min=values.min().item(),
+            value_max=values.max().item(),
+            is_unique=True,
+        )
+
+
+class DictEncodedColumnValues(TypedColumnValues):
+    def __init__(self, codes: np.ndarray, dictionary: list[str]):
+        self.codes = codes
+        self.dictionary = dictionary
+
+    @property
+    def valid(self) -> np.ndarray:  # type: ignore
+        return self.codes >= 0
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    def __iter__(self):
+        dictionary = self.dictionary
+        for code in self.codes.tolist():
+            yield None if code < 0 else dictionary[code]
+
+    def get_valid(self, idx: int) -> DbValue:
+        return self.dictionary[self.codes[idx]]
+
+    def used_codes(self) -> np.ndarray:
+        return np.unique(self.codes[self.codes >= 0])
+
+    def distinct(self) -> set[DbValue]:
+        dictionary = self.dictionary
+        return {dictionary[code] for code in self.used_codes().tolist()}
+
+    def has_duplicates(self) -> bool:
+        codes = self.codes[self.codes >= 0]
+        return len(np.unique(codes)) != len(codes)
+
+    def factorize(self) -> tuple[np.ndarray, np.ndarray, int]:
+        rows = np.flatnonzero(self.codes >= 0)
+        uniques, codes = np.unique(self.codes[rows], return_inverse=True)
+        return rows, codes.astype(np.int64).reshape(-1), len(uniques)
+
+    def take(self, indices: np.ndarray) -> "DictEncodedColumnValues":
+        ok = indices >= 0
+        if len(self.codes) == 0:
+            return DictEncodedColumnValues(
+                np.full(len(indices), -1, dtype=self.codes.dtype), self.dictionary
+            )
+        safe = np.where(ok, indices, 0)
+        return DictEncodedColumnValues(
+            np.where(ok, self.codes[safe], -1).astype(self.codes.dtype),
+            self.dictionary,
+        )
+
+    def induce_schema(self) -> JsonSchema | None:
+        used = self.used_codes()
+        if len(used) == 0:
+            return None
+        lengths = np.array([len(self.dictionary[code]) for code in used.tolist()])
+        return JsonSchema.new_str(
+            can_null=self.null_count() > 0,
+            len_min=int(lengths.min()),
+            len_max=int(lengths.max()),
+            is_unique=not self.has_duplicates(),
+        )
+
+
+def pack_primitive(values: list[DbValue], ty: type, dtype) -> Sequence[DbValue]:
+    valid = np.fromiter(
+        (value is not None for value in values), dtype=np.bool_, count=len(values)
+    )
+    for value in values:
+        if value is not None and type(value) is not ty:
+            return values
+    non_null = [value for value in values if value is not None]
+    if ty is int and len(non_null) > 0:
+        if min(non_null) < INT64_MIN or max(non_null) > INT64_MAX:
+            return values
+    data = np.zeros(len(values), dtype=dtype)
+    data[valid] = np.array(non_null, dtype=dtype)
+    return PrimitiveColumnValues(data, valid)
+
+
+def pack_str(values: list[DbValue]) -> Sequence[DbValue]:
+    mapping = {}
+    codes = np.empty(len(values), dtype=np.int32)
+    for i, value in enumerate(values):
+        if value is None:
+            codes[i] = -1
+        elif type(value) is not str:
+            return values
+        else:
+            codes[i] = mapping.setdefault(value, len(mapping))
+    return DictEncodedColumnValues(codes, list(mapping))
+
+
+def pack_values(schema: JsonSchema, values: Sequence[DbValue]) -> Sequence[DbValue]:
+    if not isinstance(values, list) or len(values) == 0:
+        return values
+    if schema.ty == JsonSchemaTypes.Int:
+        return pack_primitive(values, int, np.int64)
+    if schema.ty == JsonSchemaTypes.Float:
+        return pack_primitive(values, float, np.float64)
+    if schema.ty == JsonSchemaTypes.Bool:
+        return pack_primitive(values, bool, np.bool_)
+    if schema.ty == JsonSchemaTypes.Str:
+        if schema.len_max is not None and schema.len_max <= STR_DICT_LEN_MAX:
+            return pack_str(values)
+    # unknown, object, array, ... stay as python lists
+    return values
+
+
+def pack_table(table: DbTable):
+    # a root expanded column shares its values with the column it came from,
+    # keep them shared after packing
+    packed = {}
+
+    def pack(column):
+        key = id(column.values)
+        if key not in packed:
+            packed[key] = (column.values, pack_values(column.schema, column.values))
+        column.values = packed[key][1]
+
+    for column in table.columns:
+        pack(column)
+    for column in table.expanded_columns:
+        pack(column)
+
+
+def pack_dump(dump: DbDump):
+    for table in dump.tables:
+        pack_table(table)
+
+
+def take_values(values: Sequence[DbValue], indices: np.ndarray) -> Sequence[DbValue]:
+    if isinstance(values, TypedColumnValues):
+        return values.take(indices)
+    return [None if i < 0 else values[i] for i in indices.tolist()]
+
+
+def distinct_non_null(values: Sequence[DbValue]) -> set[DbValue]:
+    if isinstance(values, TypedColumnValues):
+        return values.distinct()
+    return {value for value in values if value is not None}
+
+
+def has_duplicate_non_null(values: Sequence[DbValue]) -> bool:
+    if isinstance(values, TypedColumnValues):
+        return values.has_duplicates()
+    non_null = [value for value in values if value is not None]
+    return len(non_null) != len(set(non_null))
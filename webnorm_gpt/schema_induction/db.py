@@ -27,6 +27,9 @@ class DbTable:
     columns: list[DbColumn]
     expanded_columns: list["ExpandedColumn"]
     join_info: Any = None
+    # group of every row (e.g. the attack window it came from), nearest
+    # related joins only pair rows of the same group
+    row_groups: list[int] | None = None
 
     def find_column(self, name: str) -> DbColumn:
         for column in self.columns:
@@ -44,11 +47,13 @@ class DbTable:
         )
 
     def copy(self):
-        return DbTable(
+        table = DbTable(
             name=self.name,
             columns=self.columns.copy(),
             expanded_columns=self.expanded_columns.copy(),
         )
+        table.row_groups = self.row_groups
+        return table
 
     def __init__(
         self,
@@ -167,11 +172,23 @@ def db_merge_logs_and_db(logs: DbDump, db: DbDump):
 
 
 def shallow_copy_table(table: DbTable) -> DbTable:
-    return DbTable(
+    table_copy = DbTable(
         name=table.name,
         columns=table.columns.copy(),
         expanded_columns=table.expanded_columns.copy(),
     )
+    table_copy.row_groups = table.row_groups
+    return table_copy
+
+
+def db_prefix_tables(dump: DbDump, prefix: str) -> DbDump:
+    # like db_merge, but the renamed tables share their columns with `dump`
+    result = DbDump(tables=[])
+    for table in dump.tables:
+        table_copy = shallow_copy_table(table)
+        table_copy.name = prefix + table.name
+        result.tables.append(table_copy)
+    return result
 
 
 class DbSchema:
@@ -1,3 +1,5 @@
+from typing import Callable
+
 from .db import DbValue, ExpandOp, ExpandOps
 from .schema import JsonSchema, JsonSchemaTypes
 
@@ -136,6 +138,218 @@ EXPAND_DICT = {
 }
 
 
+# Compiled expand ops: one closure per op with the argument bound and no
+# dispatch. The fast path only checks the concrete container type and falls
+# back to the checked `expand_map_*` function (and its assertions) otherwise.
+
+
+def compile_array_idx(arg):
+    assert isinstance(arg, int)
+
+    def f(value):
+        if type(value) is not list:
+            return expand_map_array_idx(value, arg)
+        return value[arg] if arg < len(value) else None
+
+    return f
+
+
+def compile_array_len(arg):
+    def f(value):
+        if type(value) is not list:
+            return expand_map_array_len(value, arg)
+        return len(value)
+
+    return f
+
+
+def compile_array_flatten(arg):
+    def f(value):
+        if type(value) is not list:
+            return expand_map_array_flatten(value, arg)
+        results = []
+        for item in value:
+            if item is None:
+                results.append(None)
+            elif type(item) is list:
+                results.extend(item)
+            else:
+                return expand_map_array_flatten(value, arg)
+        return results
+
+    return f
+
+
+def compile_array_expand(arg):
+    assert isinstance(arg, str)
+
+    def f(value):
+        if type(value) is not list:
+            return expand_map_array_expand(value, arg)
+        try:
+            return [None if item is None else item.get(arg) for item in value]
+        except AttributeError:
+            return expand_map_array_expand(value, arg)
+
+    return f
+
+
+def compile_array_expand_exists(arg):
+    assert isinstance(arg, str)
+
+    def f(value):
+        if type(value) is not list:
+            return expand_map_array_expand_exists(value, arg)
+        result = []
+        for item in value:
+            if item is None:
+                result.append(None)
+            elif type(item) is dict:
+                result.append(arg in item)
+            else:
+                return expand_map_array_expand_exists(value, arg)
+        return result
+
+    return f
+
+
+def compile_object_expand(arg):
+    assert isinstance(arg, str)
+
+    def f(value):
+        if type(value) is not dict:
+            return expand_map_object_expand(value, arg)
+        return value.get(arg)
+
+    return f
+
+
+def compile_object_field_exists(arg):
+    assert isinstance(arg, str)
+
+    def f(value):
+        if type(value) is not dict:
+            return expand_map_object_field_exists(value, arg)
+        return arg in value
+
+    return f
+
+
+def compile_dict_key(arg):
+    def f(value):
+        if type(value) is not dict:
+            return expand_map_dict_key(value, arg)
+        return list(value)
+
+    return f
+
+
+def compile_dict_value(arg):
+    def f(value):
+        if type(value) is not dict:
+            return expand_map_dict_value(value, arg)
+        return list(value.values())
+
+    return f
+
+
+def compile_array_dict_key(arg):
+    def f(value):
+        if type(value) is not list:
+            return expand_map_array_dict_key(value, arg)
+        try:
+            return [None if item is None else list(item.keys()) for item in value]
+        except AttributeError:
+            return expand_map_array_dict_key(value, arg)
+
+    return f
+
+
+def compile_array_dict_value(arg):
+    def f(value):
+        if type(value) is not list:
+            return expand_map_array_dict_value(value, arg)
+        try:
+            return [None if item is None else list(item.values()) for item in value]
+        except AttributeError:
+            return expand_map_array_dict_value(value, arg)
+
+    return f
+
+
+COMPILE_DICT = {
+    ExpandOps.ArrayIdx: compile_array_idx,
+    ExpandOps.ArrayLen: compile_array_len,
+    ExpandOps.ArrayFlatten: compile_array_flatten,
+    ExpandOps.ArrayExpand: compile_array_expand,
+    ExpandOps.ArrayExpandExists: compile_array_expand_exists,
+    ExpandOps.ObjectExpand: compile_object_expand,
+    ExpandOps.ObjectFieldExists: compile_object_field_exists,
+    ExpandOps.DictKey: compile_dict_key,
+    ExpandOps.DictValue: compile_dict_value,
+    ExpandOps.ArrayDictKey: compile_array_dict_key,
+    ExpandOps.ArrayDictValue: compile_array_dict_value,
+}
+
+
+def compile_expand_op(expand_op: ExpandOp) -> Callable[[DbValue], DbValue]:
+    return COMPILE_DICT[expand_op.ty](expand_op.arg)
+
+
+def compile_expand_ops(expand_ops: list[ExpandOp]) -> Callable[[DbValue], DbValue]:
+    # fuse a whole op chain into one function, same as applying
+    # `expand_map_with_none` for every op in turn
+    funcs = [compile_expand_op(expand_op) for expand_op in expand_ops]
+
+    if len(funcs) == 1:
+        (f0,) = funcs
+
+        def fused(value):
+            if value is None:
+                return None
+            return f0(value)
+
+        return fused
+
+    def fused(value):
+        for f in funcs:
+            if value is None:
+                return None
+            value = f(value)
+        return value
+
+    return fused
+
+
+def expand_tree_values(
+    values: list[DbValue],
+    parents: list[int],
+    expand_ops: list[ExpandOp],
+) -> list[list[DbValue]]:
+    # Evaluates a tree of derived columns in a single traversal of the source
+    # values. Node 0 is the source column; node k + 1 applies expand_ops[k] to
+    # node parents[k], where every parent comes before its children.
+    assert len(parents) == len(expand_ops)
+    steps = [
+        (parent, k + 1, compile_expand_op(expand_op))
+        for k, (parent, expand_op) in enumerate(zip(parents, expand_ops))
+    ]
+    results: list[list[DbValue]] = [[] for _ in expand_ops]
+    appends = [result.append for result in results]
+
+    for value in values:
+        row = [value]
+        row_append = row.append
+        for parent, node, f in steps:
+            v = row[parent]
+            if v is not None:
+                v = f(v)
+            row_append(v)
+            appends[node - 1](v)
+
+    return results
+
+
 def expand_name(expand_op: ExpandOp) -> str:
     return EXPAND_NAME_DICT[expand_op.ty](expand_op, expand_op.arg)
 
@@ -1,14 +1,20 @@
 from dataclasses import dataclass
 
 from .db import DbTable, DbValue, ExpandedColumn, ExpandOp, ExpandOps
-from .expand_mapper import expand_map_with_none, expand_name, expand_schema
+from .expand_mapper import (
+    compile_expand_ops,
+    expand_name,
+    expand_schema,
+    expand_tree_values,
+)
 from .schema import JsonSchemaTypes
 from .induction import JsonSchemaInducer
 
 def derive_field_values(
     expanded_column: ExpandedColumn, expand_op: ExpandOp
 ) -> list[DbValue]:
-    return [expand_map_with_none(value, expand_op) for value in expanded_column.values]
+    f = compile_expand_ops([expand_op])
+    return [f(value) for value in expanded_column.values]
 
 
 def derive_column(
@@ -30,6 +36,42 @@ def derive_column(
     )
 
 
+# Derived columns of one source column, planned first and then filled in a
+# single traversal of the source values (see `expand_tree_values`).
+class ExpansionPlan:
+    def __init__(self, root: ExpandedColumn):
+        self.root = root
+        self.columns: list[ExpandedColumn] = []
+        self.parents: list[int] = []
+        self.expand_ops: list[ExpandOp] = []
+        self.node_idx = {id(root): 0}
+
+    def derive(
+        self, original: ExpandedColumn, ty: str, arg: int | str | None
+    ) -> ExpandedColumn:
+        expand_op = ExpandOp(ty=ty, arg=arg)
+        name_postfix = expand_name(expand_op)
+        new_schema = expand_schema(original.schema, expand_op)
+
+        column = ExpandedColumn(
+            name=original.name + name_postfix,
+            original_column=original.original_column,
+            expand_ops=original.expand_ops + [expand_op],
+            schema=new_schema,
+            values=[],
+        )
+        self.parents.append(self.node_idx[id(original)])
+        self.expand_ops.append(expand_op)
+        self.columns.append(column)
+        self.node_idx[id(column)] = len(self.columns)
+        return column
+
+    def fill(self):
+        all_values = expand_tree_values(self.root.values, self.parents, self.expand_ops)
+        for column, values in zip(self.columns, all_values):
+            column.values = values
+
+
 class DbExpander:
     def __init__(
         self,
@@ -60,7 +102,9 @@ class DbExpander:
                     table.add_expanded_column(expanded_column)
 
                 
-    def compress_uniform_array(self, array_column_values: list[DbValue]) -> list[DbValue]:
+    def compress_uniform_array(
+        self, array_column_values: list[DbValue]
+    ) -> list[DbValue]:
         values = []
         for array in array_column_values:
             if array == None:
@@ -89,56 +133,75 @@ class DbExpander:
             self.expand_add_column(table, expanded_column)
 
     def expand_add_column(self, table: DbTable, column: ExpandedColumn):
+        plan = ExpansionPlan(column)
+        self.expand_one_column(plan, column)
+        plan.fill()
+
         table.add_expanded_column(column)
-        self.expand_one_column(table, column)
+        for derived in plan.columns:
+            table.add_expanded_column(derived)
 
-    def expand_one_column(self, table: DbTable, expanded_column: ExpandedColumn):
+    def expand_derive_column(
+        self,
+        plan: ExpansionPlan,
+        expanded_column: ExpandedColumn,
+        ty: str,
+        arg: int | str | None,
+    ) -> ExpandedColumn:
+        column = plan.derive(expanded_column, ty, arg)
+        self.expand_one_column(plan, column)
+        return column
+
+    def expand_one_column(self, plan: ExpansionPlan, expanded_column: ExpandedColumn):
         schema = expanded_column.schema
 
         if schema.ty == JsonSchemaTypes.Object:
-            self.expand_one_column_object(table, expanded_column)
+            self.expand_one_column_object(plan, expanded_column)
         elif schema.ty == JsonSchemaTypes.Array:
-            self.expand_one_column_array(table, expanded_column)
+            self.expand_one_column_array(plan, expanded_column)
         elif schema.ty == JsonSchemaTypes.Dict:
-            self.expand_one_column_dict(table, expanded_column)
+            self.expand_one_column_dict(plan, expanded_column)
 
-    def expand_one_column_object(self, table: DbTable, expanded_column: ExpandedColumn):
+    def expand_one_column_object(
+        self, plan: ExpansionPlan, expanded_column: ExpandedColumn
+    ):
         schema = expanded_column.schema
         assert schema.ty == JsonSchemaTypes.Object
         assert schema.fields is not None
 
         for field in schema.fields:
-            column = derive_column(expanded_column, ExpandOps.ObjectExpand, field.name)
-            self.expand_add_column(table, column)
+            self.expand_derive_column(
+                plan, expanded_column, ExpandOps.ObjectExpand, field.name
+            )
             if self.object_expand_exists and not field.always_exists:
-                column = derive_column(
-                    expanded_column, ExpandOps.ObjectFieldExists, field.name
+                self.expand_derive_column(
+                    plan, expanded_column, ExpandOps.ObjectFieldExists, field.name
                 )
-                self.expand_add_column(table, column)
 
-    def expand_one_column_array(self, table: DbTable, expanded_column: ExpandedColumn):
+    def expand_one_column_array(
+        self, plan: ExpansionPlan, expanded_column: ExpandedColumn
+    ):
         schema = expanded_column.schema
         assert schema.ty == JsonSchemaTypes.Array
         assert schema.array_element_schema is not None
 
         if self.array_expand_length:
-            self.expand_one_column_array_length(table, expanded_column)
-        self.expand_one_column_array_contents(table, expanded_column)
+            self.expand_one_column_array_length(plan, expanded_column)
+        self.expand_one_column_array_contents(plan, expanded_column)
         if schema.array_element_schema.ty == JsonSchemaTypes.Array:
-            self.expand_one_column_array_of_array(table, expanded_column)
+            self.expand_one_column_array_of_array(plan, expanded_column)
         elif schema.array_element_schema.ty == JsonSchemaTypes.Object:
-            self.expand_one_column_array_of_object(table, expanded_column)
+            self.expand_one_column_array_of_object(plan, expanded_column)
         elif schema.array_element_schema.ty == JsonSchemaTypes.Dict:
-            self.expand_one_column_array_of_dict(table, expanded_column)
+            self.expand_one_column_array_of_dict(plan, expanded_column)
 
     def expand_one_column_array_length(
-        self, table: DbTable, expanded_column: ExpandedColumn
+        self, plan: ExpansionPlan, expanded_column: ExpandedColumn
     ):
-        column = derive_column(expanded_column, ExpandOps.ArrayLen, None)
-        self.expand_add_column(table, column)
+        self.expand_derive_column(plan, expanded_column, ExpandOps.ArrayLen, None)
 
     def expand_one_column_array_contents(
-        self, table: DbTable, expanded_column: ExpandedColumn
+        self, plan: ExpansionPlan, expanded_column: ExpandedColumn
     ):
         schema = expanded_column.schema
 
@@ -146,11 +209,10 @@ class DbExpander:
         assert schema.ty == JsonSchemaTypes.Array
 
         for idx in range(min(self.array_expand_max, schema.len_max)):
-            column = derive_column(expanded_column, ExpandOps.ArrayIdx, idx)
-            self.expand_add_column(table, column)
+            self.expand_derive_column(plan, expanded_column, ExpandOps.ArrayIdx, idx)
 
     def expand_one_column_array_of_array(
-        self, table: DbTable, expanded_column: ExpandedColumn
+        self, plan: ExpansionPlan, expanded_column: ExpandedColumn
     ):
         schema = expanded_column.schema
 
@@ -158,11 +220,10 @@ class DbExpander:
         assert schema.array_element_schema is not None
         assert schema.array_element_schema.ty == JsonSchemaTypes.Array
 
-        column = derive_column(expanded_column, ExpandOps.ArrayFlatten, None)
-        self.expand_add_column(table, column)
+        self.expand_derive_column(plan, expanded_column, ExpandOps.ArrayFlatten, None)
 
     def expand_one_column_array_of_object(
-        self, table: DbTable, expanded_column: ExpandedColumn
+        self, plan: ExpansionPlan, expanded_column: ExpandedColumn
     ):
         schema = expanded_column.schema
 
@@ -172,35 +233,33 @@ class DbExpander:
 
         assert schema.array_element_schema.fields is not None
         for field in schema.array_element_schema.fields:
-            column = derive_column(expanded_column, ExpandOps.ArrayExpand, field.name)
-            self.expand_add_column(table, column)
+            self.expand_derive_column(
+                plan, expanded_column, ExpandOps.ArrayExpand, field.name
+            )
             if self.array_of_object_expand_exists and not field.always_exists:
-                column = derive_column(
-                    expanded_column, ExpandOps.ArrayExpandExists, field.name
+                self.expand_derive_column(
+                    plan, expanded_column, ExpandOps.ArrayExpandExists, field.name
                 )
-                self.expand_add_column(table, column)
 
     def expand_one_column_array_of_dict(
-        self, table: DbTable, expanded_column: ExpandedColumn
+        self, plan: ExpansionPlan, expanded_column: ExpandedColumn
     ):
         schema = expanded_column.schema
         assert schema.ty == JsonSchemaTypes.Array
         assert schema.array_element_schema is not None
         assert schema.array_element_schema.ty == JsonSchemaTypes.Dict
 
-        key_column = derive_column(expanded_column, ExpandOps.ArrayDictKey, None)
-        self.expand_add_column(table, key_column)
+        self.expand_derive_column(plan, expanded_column, ExpandOps.ArrayDictKey, None)
 
-        value_column = derive_column(expanded_column, ExpandOps.ArrayDictValue, None)
-        self.expand_add_column(table, value_column)
+        self.expand_derive_column(plan, expanded_column, ExpandOps.ArrayDictValue, None)
 
-    def expand_one_column_dict(self, table: DbTable, expanded_column: ExpandedColumn):
+    def expand_one_column_dict(
+        self, plan: ExpansionPlan, expanded_column: ExpandedColumn
+    ):
         schema = expanded_column.schema
         assert schema.ty == JsonSchemaTypes.Dict
         assert schema.array_element_schema is not None
 
-        key_column = derive_column(expanded_column, ExpandOps.DictKey, None)
-        self.expand_add_column(table, key_column)
+        self.expand_derive_column(plan, expanded_column, ExpandOps.DictKey, None)
 
-        value_column = derive_column(expanded_column, ExpandOps.DictValue, None)
-        self.expand_add_column(table, value_column)
+        self.expand_derive_column(plan, expanded_column, ExpandOps.DictValue, None)
@@ -1,9 +1,8 @@
 from collections import defaultdict
 
-import tqdm
-
 from ..gpt_invoker import GPTInvoker
-from .db import DbDump, DbTable, ExpandedColumn
+from .column_store import distinct_non_null
+from .db import DbDump, DbTable, DbValue, ExpandedColumn
 from .foreign_key_prompt import (
     EXTRACT_RELATED_TABLE_SYSTEM,
     FILTER_COLUMNS_SYSTEM,
@@ -21,7 +20,7 @@ def is_non_null(x):
 
 
 def set_filter_non_null(x):
-    return set(filter(is_non_null, x))
+    return distinct_non_null(x)
 
 
 LOG_META_DATA_COLUMNS = {
@@ -41,10 +40,9 @@ LOG_DATA_EXPANDED_META_DATA = {"#length", "#exists"}
 def filter_columns(
     gpt_invoker: GPTInvoker, db: DbDump
 ) -> list[tuple[DbTable, list[ExpandedColumn], list[ExpandedColumn]]]:
-    result = []
-    for table in tqdm.tqdm(
-        db.tables, total=len(db.tables), desc="Extracting Possible Foreign Key"
-    ):
+    candidate_columns = []
+    prompts = []
+    for table in db.tables:
         table_columns = []
         for column in table.expanded_columns:
             if (
@@ -73,7 +71,17 @@ def filter_columns(
                 ),
             },
         ]
-        filter_columns_response = gpt_invoker.generate(filter_columns_inputs)
+        candidate_columns.append(table_columns)
+        prompts.append(filter_columns_inputs)
+
+    responses = gpt_invoker.generate_many(
+        prompts, desc="Extracting Possible Foreign Key"
+    )
+
+    result = []
+    for table, table_columns, filter_columns_response in zip(
+        db.tables, candidate_columns, responses
+    ):
         filter_columns_response = gpt_invoker.extract_json(filter_columns_response)
 
         foreign_keys_column = [
@@ -104,13 +112,9 @@ def extract_relavant_tables(
         table for table, _ in table_column_pairs if table.name.startswith("db::")
     ]
     db_list_name = [table.name.split("::")[1] for table in db_list]
-    for table, columns in tqdm.tqdm(
-        table_column_pairs,
-        total=len(table_column_pairs),
-        desc="Extracting Related Tables",
-    ):
+    prompts = {}
+    for table, columns in table_column_pairs:
         related_entity_list = []
-        related_tables = []
         if len(columns) > 0:
             if table.name.startswith("log::"):
                 api_name = table.name.split("::")[1]
@@ -132,11 +136,17 @@ def extract_relavant_tables(
                     ),
                 },
             ]
-            extract_related_table_response = gpt_invoker.generate(
-                extract_related_table_inputs
-            )
+            prompts[table.name] = extract_related_table_inputs
+
+    responses = gpt_invoker.generate_many(
+        list(prompts.values()), desc="Extracting Related Tables"
+    )
+    response_by_table = dict(zip(prompts, responses))
+    for table, _ in table_column_pairs:
+        related_tables = []
+        if table.name in response_by_table:
             extract_related_table_response = gpt_invoker.extract_json(
-                extract_related_table_response
+                response_by_table[table.name]
             )
             related_tables = [
                 table.name
@@ -147,47 +157,72 @@ def extract_relavant_tables(
     return related_tables_dict
 
 
+def build_value_column_index(
+    table_column_triplets: list[
+        tuple[DbTable, list[ExpandedColumn], list[ExpandedColumn]]
+    ],
+) -> dict[DbValue, list[int]]:
+    # value -> indices (into the flattened candidate to-column list) of the
+    # columns containing that value, built once over the whole dump
+    value_index = defaultdict(list)
+    column_idx = 0
+    for to_table, _, to_columns in table_column_triplets:
+        if to_table.name.startswith("log::"):
+            continue
+        for to_column in to_columns:
+            for value in set_filter_non_null(to_column.values):
+                value_index[value].append(column_idx)
+            column_idx += 1
+    return value_index
+
+
 def infer_foreign_key(
     table_column_triplets: list[
         tuple[DbTable, list[ExpandedColumn], list[ExpandedColumn]]
     ],
     related_tables_dict: dict[str, list[str]],
+    threshold: float = 0.2,
 ) -> list[tuple[str, str, str, str]]:
+    to_candidates: list[tuple[DbTable, ExpandedColumn]] = []
+    for to_table, _, to_columns in table_column_triplets:
+        if to_table.name.startswith("log::"):
+            continue
+        for to_column in to_columns:
+            to_candidates.append((to_table, to_column))
+
+    value_index = build_value_column_index(table_column_triplets)
+
     foreign_keys = []
     # table_column_triplet: [table, foreign_keys_columns, primary_keys_columns]
     for from_table, from_columns, _ in table_column_triplets:
+        related_tables = set(related_tables_dict[from_table.name])
         for from_column in from_columns:
-            # if not from_column.schema.is_primary():
-            #     continue
             from_values = set_filter_non_null(from_column.values)
             from_values_length = len(from_values)
             if from_values_length == 0:
                 continue
-            for to_table, _, to_columns in table_column_triplets:
-                if to_table.name not in related_tables_dict[from_table.name]:
+
+            # exact intersection sizes with every to-column sharing a value
+            intersection_lengths = defaultdict(int)
+            for value in from_values:
+                for column_idx in value_index.get(value, ()):
+                    intersection_lengths[column_idx] += 1
+
+            for column_idx in sorted(intersection_lengths):
+                to_table, to_column = to_candidates[column_idx]
+                if to_table.name not in related_tables:
                     continue
                 if from_table.name == to_table.name:
                     continue
-                if to_table.name.startswith("log::"):
-                    continue
-
-                for to_column in to_columns:
-                    # if not to_column.schema.is_primary():
-                    #     continue
-
-                    to_values = set_filter_non_null(to_column.values)
-                    if len(to_values) == 0:
-                        continue
-                    intersection_length = len(from_values.intersection(to_values))
-                    if intersection_length / from_values_length > 0.2:
-                        foreign_keys.append(
-                            (
-                                from_table.name,
-                                from_column.name,
-                                to_table.name,
-                                to_column.name,
-                            )
+                if intersection_lengths[column_idx] / from_values_length > threshold:
+                    foreign_keys.append(
+                        (
+                            from_table.name,
+                            from_column.name,
+                            to_table.name,
+                            to_column.name,
                         )
+                    )
 
     return foreign_keys
 
@@ -201,9 +236,8 @@ def gpt_foreign_key_filter(
 
     foreign_key_results = []
 
-    for (from_table, from_column), to_list in tqdm.tqdm(
-        src_target_map.items(), total=len(src_target_map), desc="GPT Foreign Key Filter"
-    ):
+    prompts = []
+    for (from_table, from_column), to_list in src_target_map.items():
         from_table_prefix, from_table_name = from_table.split("::", 1)
 
         candidates = []
@@ -222,11 +256,15 @@ def gpt_foreign_key_filter(
             candidate_table_field_pairs=candidates,
         )
 
-        prompts = [
-            {"role": "system", "content": prompt_system},
-            {"role": "user", "content": prompt_user},
-        ]
-        response = gpt_invoker.generate(prompts)
+        prompts.append(
+            [
+                {"role": "system", "content": prompt_system},
+                {"role": "user", "content": prompt_user},
+            ]
+        )
+
+    responses = gpt_invoker.generate_many(prompts, desc="GPT Foreign Key Filter")
+    for (from_table, from_column), response in zip(src_target_map, responses):
         response = gpt_invoker.extract_json(response)
 
         foreign_keys_gpt = response["foreign_keys"]
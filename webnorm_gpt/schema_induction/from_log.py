@@ -72,3 +72,29 @@ def dump_log_with_schema(logs: LogFile, db_schema: DbSchema) -> DbDump:
         db_dump.tables.append(table)
 
     return db_dump
+
+
+def dump_log_groups_with_schema(
+    log_groups: list[LogFile], db_schema: DbSchema
+) -> DbDump:
+    # several log files in one dump, each row tagged with the index of the
+    # file it came from; `seq` stays the position inside its own file
+    db_dump = DbDump(tables=[])
+    log_by_api = defaultdict(list)
+    groups_by_api = defaultdict(list)
+    for group, logs in enumerate(log_groups):
+        for api, log_contents in _log_to_log_by_api(logs).items():
+            log_by_api[api].extend(log_contents)
+            groups_by_api[api].extend([group] * len(log_contents))
+
+    for api, table_schemas in db_schema.schemas.items():
+        column = DbColumn(
+            name="log_data",
+            schema=table_schemas["log_data"],
+            values=log_by_api.get(api, []),
+        )
+        table = DbTable(name=api, columns=[column], expanded_columns=[])
+        table.row_groups = groups_by_api.get(api, [])
+        db_dump.tables.append(table)
+
+    return db_dump
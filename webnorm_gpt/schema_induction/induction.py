@@ -1,3 +1,4 @@
+from .column_store import TypedColumnValues
 from .db import DbValue
 from .schema import JsonSchema, JsonSchemaField
 
@@ -29,6 +30,12 @@ class JsonSchemaInducer:
         if len(data) == 0:
             raise ValueError("Cannot induce schema from empty data")
 
+        if isinstance(data, TypedColumnValues):
+            schema = data.induce_schema()
+            if schema is not None:
+                return schema
+            data = data.to_list()
+
         has_null = False
         has_str = False
         has_int = False
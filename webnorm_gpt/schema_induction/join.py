@@ -2,9 +2,13 @@
 # nearest related before join
 # nearest related after join
 
+from collections import defaultdict
 from dataclasses import dataclass
 
+import numpy as np
+
 from ..file_types.binlog_file import DbTableBinlog
+from .column_store import take_values
 from .db import DbDump, DbTable
 
 
@@ -34,18 +38,8 @@ def do_join(
     pass
 
 
-def do_join_foreign_key(
-    left: DbTable,
-    left_column_name: str,
-    db: DbDump,
-    relation: ColumnRelation,
-    right_prefix: str,
-    binlog: DbTableBinlog | None,
-) -> DbTable:
-    assert relation.ty == ColumnRelationTypes.ForeignKey
-
-    right_table = db.find_table(relation.right_table)
-    right_column = right_table.find_expanded_column(relation.right_column)
+def build_foreign_key_index(right_table: DbTable, right_column_name: str) -> dict:
+    right_column = right_table.find_expanded_column(right_column_name)
 
     right_idx_mapping = {}
 
@@ -60,6 +54,24 @@ def do_join_foreign_key(
             )
         right_idx_mapping[value] = i
 
+    return right_idx_mapping
+
+
+def do_join_foreign_key(
+    left: DbTable,
+    left_column_name: str,
+    db: DbDump,
+    relation: ColumnRelation,
+    right_prefix: str,
+    binlog: DbTableBinlog | None,
+    right_idx_mapping: dict | None = None,
+) -> DbTable:
+    assert relation.ty == ColumnRelationTypes.ForeignKey
+
+    right_table = db.find_table(relation.right_table)
+    if right_idx_mapping is None:
+        right_idx_mapping = build_foreign_key_index(right_table, relation.right_column)
+
     left_column = left.find_expanded_column(left_column_name)
     values = []
 
@@ -76,18 +88,14 @@ def do_join_foreign_key(
             else:
                 values.append(right_idx_mapping[value])
 
+    take_indices = np.array([-1 if v is None else v for v in values], dtype=np.int64)
     for column in right_table.expanded_columns:
         new_column = column.copy()
         new_column.name = right_prefix + column.name
         if has_null:
             new_column.schema = new_column.schema.copy()
             new_column.schema.can_null = True
-        new_column.values = []
-        for v in values:
-            if v is None:
-                new_column.values.append(None)
-            else:
-                new_column.values.append(column.values[v])
+        new_column.values = take_values(column.values, take_indices)
 
         left.add_expanded_column(new_column)
 
@@ -106,6 +114,10 @@ def do_join_foreign_key(
         all_columns = []
         for column_name in all_columns_binlog:
             all_columns.append(left.find_expanded_column(right_prefix + column_name))
+        # binlog replay writes cells in place
+        for column in all_columns:
+            if not isinstance(column.values, list):
+                column.values = list(column.values)
 
         for idx_left in range(left.value_length()):
             time_parsed = time_parsed_column.values[idx_left]
@@ -132,45 +144,36 @@ def do_join_foreign_key(
     return left
 
 
-def do_join_nearest_related_before(
-    left: DbTable,
-    left_column_name: str,
-    db: DbDump,
-    relation: ColumnRelation,
-    right_prefix: str,
-) -> DbTable:
-    right_table = db.find_table(relation.right_table)
+# A row is only related to one of the last NEAREST_RELATED_MAX_ROWS rows of the
+# other table before it, at most NEAREST_RELATED_MAX_SECONDS older.
+NEAREST_RELATED_MAX_ROWS = 20
+NEAREST_RELATED_MAX_SECONDS = 600
 
+
+def nearest_related_before_rows(
+    left_rows: list[int],
+    right_rows: list[int],
+    left_time_values: list[float],
+    right_time_values: list[float],
+    left_header_values: list[dict[str, str]],
+    right_header_values: list[dict[str, str]],
+) -> list[int | None]:
     left_idx = -1
     right_idx = 0
 
-    left_length = left.value_length()
-    right_length = right_table.value_length()
-
-    left_time_values: list[float] = left.find_expanded_column(
-        "log_data.time_parsed"
-    ).values  # type: ignore
-    right_time_values: list[float] = right_table.find_expanded_column(
-        "log_data.time_parsed"
-    ).values  # type: ignore
-
-    left_header_values: list[dict[str, str]] = left.find_expanded_column(
-        "log_data.headers"
-    ).values  # type: ignore
-    right_header_values: list[dict[str, str]] = right_table.find_expanded_column(
-        "log_data.headers"
-    ).values  # type: ignore
+    left_length = len(left_rows)
+    right_length = len(right_rows)
 
     values = []
-    has_null = False
 
     while True:
         left_idx += 1
         if left_idx >= left_length:
             break
 
-        left_time = left_time_values[left_idx]
-        left_header = left_header_values[left_idx]
+        left_row = left_rows[left_idx]
+        left_time = left_time_values[left_row]
+        left_header = left_header_values[left_row]
         left_auth = left_header.get("authorization")
 
         right_idx_to_take = None
@@ -178,37 +181,92 @@ def do_join_nearest_related_before(
         while True:
             if right_idx >= right_length:
                 break
-            right_time = right_time_values[right_idx]
+            right_time = right_time_values[right_rows[right_idx]]
             if right_time > left_time:
                 break
             right_idx += 1
 
-        for right_to_check in range(right_idx - 1, max(-1, right_idx - 1 - 20), -1):
-            right_time = right_time_values[right_to_check]
-            if left_time - right_time > 600:
+        for right_to_check in range(
+            right_idx - 1, max(-1, right_idx - 1 - NEAREST_RELATED_MAX_ROWS), -1
+        ):
+            right_row = right_rows[right_to_check]
+            right_time = right_time_values[right_row]
+            if left_time - right_time > NEAREST_RELATED_MAX_SECONDS:
                 break
-            right_header = right_header_values[right_to_check]
+            right_header = right_header_values[right_row]
             right_auth = right_header.get("authorization")
             if left_auth == right_auth:
-                right_idx_to_take = right_to_check
+                right_idx_to_take = right_row
                 break
 
-        if right_idx_to_take is None:
-            has_null = True
         values.append(right_idx_to_take)
 
+    return values
+
+
+def do_join_nearest_related_before(
+    left: DbTable,
+    left_column_name: str,
+    db: DbDump,
+    relation: ColumnRelation,
+    right_prefix: str,
+) -> DbTable:
+    right_table = db.find_table(relation.right_table)
+
+    left_length = left.value_length()
+    right_length = right_table.value_length()
+
+    left_time_values: list[float] = list(
+        left.find_expanded_column("log_data.time_parsed").values
+    )  # type: ignore
+    right_time_values: list[float] = list(
+        right_table.find_expanded_column("log_data.time_parsed").values
+    )  # type: ignore
+
+    left_header_values: list[dict[str, str]] = left.find_expanded_column(
+        "log_data.headers"
+    ).values  # type: ignore
+    right_header_values: list[dict[str, str]] = right_table.find_expanded_column(
+        "log_data.headers"
+    ).values  # type: ignore
+
+    def nearest(left_rows, right_rows):
+        return nearest_related_before_rows(
+            left_rows,
+            right_rows,
+            left_time_values,
+            right_time_values,
+            left_header_values,
+            right_header_values,
+        )
+
+    if left.row_groups is None or right_table.row_groups is None:
+        values = nearest(range(left_length), range(right_length))
+    else:
+        # rows only relate to rows of the same group
+        left_rows_by_group = defaultdict(list)
+        for row, group in enumerate(left.row_groups):
+            left_rows_by_group[group].append(row)
+        right_rows_by_group = defaultdict(list)
+        for row, group in enumerate(right_table.row_groups):
+            right_rows_by_group[group].append(row)
+
+        values = [None] * left_length
+        for group, left_rows in left_rows_by_group.items():
+            group_values = nearest(left_rows, right_rows_by_group[group])
+            for row, value in zip(left_rows, group_values):
+                values[row] = value
+
+    has_null = any(v is None for v in values)
+
+    take_indices = np.array([-1 if v is None else v for v in values], dtype=np.int64)
     for column in right_table.expanded_columns:
         new_column = column.copy()
         new_column.name = right_prefix + column.name
         if has_null:
             new_column.schema = new_column.schema.copy()
             new_column.schema.can_null = True
-        new_column.values = []
-        for v in values:
-            if v is None:
-                new_column.values.append(None)
-            else:
-                new_column.values.append(column.values[v])
+        new_column.values = take_values(column.values, take_indices)
 
         left.add_expanded_column(new_column)
 
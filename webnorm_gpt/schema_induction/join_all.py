@@ -1,128 +1,230 @@
+import typing
 from collections import defaultdict
 
 from .. import logger
 from ..file_types.binlog_file import DbTableBinlog
 from ..file_types.log_file import LogFile
 from .back_to_log import db_table_to_log
+from .column_store import has_duplicate_non_null
 from .db import DbDump, DbTable
 from .join import (
     ColumnRelation,
     ColumnRelationTypes,
+    build_foreign_key_index,
     do_join_foreign_key,
     do_join_nearest_related_before,
 )
 
+# names of the `db_info` tables and `related_events` the predicates of an api
+# may read, None when they may read all of them
+ReachedJoins = tuple[typing.Optional[set[str]], typing.Optional[set[str]]]
+
+
+# join_all split in two: the tables of `static_db` (the `db::` side) are
+# shared by every call, so their foreign key indexes and duplicate checks are
+# computed once and each `join_all` call only pays for its own log rows.
+# With `reached_by_api` (when checking invariants) only the joins some predicate
+# of the api may read through `db_info` / `related_events` are done, the joined
+# logs then lack every other related table and event; apis missing from it get
+# no joins at all.
+class PreparedJoinAll:
+    def __init__(
+        self,
+        static_db: DbDump,
+        foreign_key_results: list,
+        dataflow_map: dict[str, list[str]],
+        binlog: dict[str, DbTableBinlog],
+        reached_by_api: dict[str, ReachedJoins] | None = None,
+    ):
+        self.static_db = static_db
+        self.reached_by_api = reached_by_api
+        self.static_table_names = {table.name for table in static_db.tables}
+        self.dataflow_map = dataflow_map
+        self.binlog = binlog
+
+        self.foreign_key_map = defaultdict(list)
+        for from_table, from_column, to_table, to_column in foreign_key_results:
+            if "log_data.response." in from_column:
+                continue
+            self.foreign_key_map[from_table].append((from_column, to_table, to_column))
+
+        self.static_has_dups: dict[tuple[str, str], bool] = {}
+        self.static_indexes: dict[tuple[str, str], dict | Exception] = {}
+
+    def column_has_dups(self, db: DbDump, to_table: str, to_column: str) -> bool:
+        to_values = db.find_table(to_table).find_expanded_column(to_column).values
+        return all(v is None for v in to_values) or has_duplicate_non_null(to_values)
+
+    def static_column_has_dups(self, to_table: str, to_column: str) -> bool:
+        key = (to_table, to_column)
+        if key not in self.static_has_dups:
+            self.static_has_dups[key] = self.column_has_dups(
+                self.static_db, to_table, to_column
+            )
+        return self.static_has_dups[key]
+
+    def static_index(self, to_table: str, to_column: str) -> dict:
+        key = (to_table, to_column)
+        if key not in self.static_indexes:
+            try:
+                self.static_indexes[key] = build_foreign_key_index(
+                    self.static_db.find_table(to_table), to_column
+                )
+            except Exception as e:
+                self.static_indexes[key] = e
+        index = self.static_indexes[key]
+        if isinstance(index, Exception):
+            raise index.with_traceback(None)
+        return index
 
-def join_all(
-    db: DbDump,
-    foreign_key_results: list,
-    dataflow_map: dict[str, list[str]],
-    binlog: dict[str, DbTableBinlog],
-) -> tuple[dict[str, LogFile], dict[str, DbTable]]:
-    foreign_key_map = defaultdict(list)
-    for from_table, from_column, to_table, to_column in foreign_key_results:
-        foreign_key_map[from_table].append((from_column, to_table, to_column))
-
-    log_tables = list()
-    for table in db.tables:
-        if table.name.startswith("log::"):
-            log_tables.append(table)
-
-    has_dups = set()
+    def reached_joins(self, api: str) -> ReachedJoins:
+        if self.reached_by_api is None:
+            return None, None
+        return self.reached_by_api.get(api, (set(), set()))
 
-    log_results = {}
-    table_results = {}
+    def join_all(self, log_db: DbDump) -> tuple[dict[str, LogFile], dict[str, DbTable]]:
+        log_tables = list()
+        for table in log_db.tables:
+            if table.name.startswith("log::"):
+                log_tables.append(table)
 
-    for i, table in enumerate(log_tables):
-        table_prefix, real_table_name = table.name.split("::", 1)
-        if table_prefix != "log":
-            continue
+        db = DbDump(tables=log_tables + self.static_db.tables)
 
-        joins = foreign_key_map[table.name]
-        table_joined = table.copy()
+        has_dups = set()
 
-        dup_table_names = set()
-        visited_tables = set()
+        log_results = {}
+        table_results = {}
 
-        new_joins = []
-        for from_column, to_table, to_column in joins:
-            if "log_data.response." in from_column:
+        for i, table in enumerate(log_tables):
+            table_prefix, real_table_name = table.name.split("::", 1)
+            if table_prefix != "log":
                 continue
-            new_joins.append((from_column, to_table, to_column))
 
-        for _, to_table, _ in new_joins:
-            if to_table in visited_tables:
-                dup_table_names.add(to_table)
-            visited_tables.add(to_table)
+            new_joins = self.foreign_key_map[table.name]
+            table_joined = table.copy()
 
-        dup_table_name_counter = defaultdict(int)
+            dup_table_names = set()
+            visited_tables = set()
 
-        for from_column, to_table, to_column in new_joins:
+            for _, to_table, _ in new_joins:
+                if to_table in visited_tables:
+                    dup_table_names.add(to_table)
+                visited_tables.add(to_table)
 
-            if (to_table, to_column) in has_dups:
-                continue
+            dup_table_name_counter = defaultdict(int)
 
-            to_values = db.find_table(to_table).find_expanded_column(to_column).values
-            to_values_non_null = [v for v in to_values if v is not None]
-            if len(to_values_non_null) == 0 or len(to_values_non_null) != len(
-                set(to_values_non_null)
-            ):
-                has_dups.add((to_table, to_column))
-                continue
+            reached_tables, reached_events = self.reached_joins(real_table_name)
 
-            to_table_original_name = to_table.split("::", 1)[1]
-            to_name = to_table_original_name
-            if to_table in dup_table_names:
-                # to_name = f"{to_table_original_name}_join_on_{from_column}_{to_column}"
-                counter = dup_table_name_counter[to_table]
-                dup_table_name_counter[to_table] += 1
-                to_name = f"{to_table_original_name}#{counter}"
-            try:
-                relation = ColumnRelation(
-                    ColumnRelationTypes.ForeignKey,
-                    table_joined.name,
-                    from_column,
-                    to_table,
-                    to_column,
-                    to_name,
-                )
-                do_join_foreign_key(
-                    table_joined,
-                    from_column,
-                    db,
-                    relation,
-                    f"{to_name}@",
-                    binlog.get(to_table_original_name, None) if binlog is not None else None,
-                )
-            except Exception as e:
-                logger.warning(
-                    "Failed to join %s to %s", table_joined.name, to_table, exc_info=e
+            for from_column, to_table, to_column in new_joins:
+                is_static = to_table in self.static_table_names
+                to_table_original_name = to_table.split("::", 1)[1]
+                # joined log tables end up in `related_events`
+                reached = (
+                    reached_events if to_table.startswith("log::") else reached_tables
                 )
 
-        d_flows = dataflow_map[real_table_name]
-        for d_flow in set(d_flows):
-            try:
-                relation = ColumnRelation(
-                    ColumnRelationTypes.NearestRelatedBefore,
-                    table_joined.name,
-                    "",
-                    f"log::{d_flow}",
-                    "",
-                    d_flow,
-                )
-                do_join_nearest_related_before(
-                    table_joined, "", db, relation, f"log::{d_flow}@"
-                )
-            except Exception as e:
-                logger.warning(
-                    "Failed to join %s to log::%s",
-                    table_joined.name,
-                    d_flow,
-                    exc_info=e,
-                )
+                # the `#n` names of duplicated tables depend on the joins
+                # before, those are only known after the duplicate checks
+                if (
+                    reached is not None
+                    and to_table not in dup_table_names
+                    and to_table_original_name not in reached
+                ):
+                    continue
+
+                if is_static:
+                    if self.static_column_has_dups(to_table, to_column):
+                        continue
+                else:
+                    if (to_table, to_column) in has_dups:
+                        continue
+                    if self.column_has_dups(db, to_table, to_column):
+                        has_dups.add((to_table, to_column))
+                        continue
+
+                to_name = to_table_original_name
+                if to_table in dup_table_names:
+                    # to_name = f"{to_table_original_name}_join_on_{from_column}_{to_column}"
+                    counter = dup_table_name_counter[to_table]
+                    dup_table_name_counter[to_table] += 1
+                    to_name = f"{to_table_original_name}#{counter}"
+                if reached is not None and to_name not in reached:
+                    continue
+                try:
+                    relation = ColumnRelation(
+                        ColumnRelationTypes.ForeignKey,
+                        table_joined.name,
+                        from_column,
+                        to_table,
+                        to_column,
+                        to_name,
+                    )
+                    do_join_foreign_key(
+                        table_joined,
+                        from_column,
+                        db,
+                        relation,
+                        f"{to_name}@",
+                        (
+                            self.binlog.get(to_table_original_name, None)
+                            if self.binlog is not None
+                            else None
+                        ),
+                        self.static_index(to_table, to_column) if is_static else None,
+                    )
+                except Exception as e:
+                    logger.warning(
+                        "Failed to join %s to %s",
+                        table_joined.name,
+                        to_table,
+                        exc_info=e,
+                    )
+
+            d_flows = self.dataflow_map[real_table_name]
+            for d_flow in set(d_flows):
+                if reached_events is not None and d_flow not in reached_events:
+                    continue
+                try:
+                    relation = ColumnRelation(
+                        ColumnRelationTypes.NearestRelatedBefore,
+                        table_joined.name,
+                        "",
+                        f"log::{d_flow}",
+                        "",
+                        d_flow,
+                    )
+                    do_join_nearest_related_before(
+                        table_joined, "", db, relation, f"log::{d_flow}@"
+                    )
+                except Exception as e:
+                    logger.warning(
+                        "Failed to join %s to log::%s",
+                        table_joined.name,
+                        d_flow,
+                        exc_info=e,
+                    )
+
+            log_file = db_table_to_log(table_joined)
+
+            log_results[real_table_name] = log_file
+            table_results[table.name] = table_joined
+        return log_results, table_results
 
-        log_file = db_table_to_log(table_joined)
 
-        log_results[real_table_name] = log_file
-        table_results[table.name] = table_joined
-    return log_results, table_results
+def join_all(
+    db: DbDump,
+    foreign_key_results: list,
+    dataflow_map: dict[str, list[str]],
+    binlog: dict[str, DbTableBinlog],
+    reached_by_api: dict[str, ReachedJoins] | None = None,
+) -> tuple[dict[str, LogFile], dict[str, DbTable]]:
+    static_db = DbDump(
+        tables=[table for table in db.tables if not table.name.startswith("log::")]
+    )
+    log_db = DbDump(
+        tables=[table for table in db.tables if table.name.startswith("log::")]
+    )
+    prepared = PreparedJoinAll(
+        static_db, foreign_key_results, dataflow_map, binlog, reached_by_api
+    )
+    return prepared.join_all(log_db)
@@ -0,0 +1,77 @@
+import typing
+
+from ..file_types.compute_context import compute_context_train_ticket_log
+from ..file_types.log_file import LogFile, LogItem
+from .column_store import pack_dump
+from .db import DbDump, DbSchema, db_prefix_tables
+from .expansion import DbExpander
+from .from_log import dump_log_groups_with_schema
+from .join_all import PreparedJoinAll, ReachedJoins
+
+# fills the `env` of a log from its headers, e.g. the user of its token
+ComputeContext = typing.Callable[[LogItem], None]
+
+
+def load_log_files(
+    log_files: list[LogFile],
+    schema: DbSchema,
+    compute_context: ComputeContext | None = compute_context_train_ticket_log,
+) -> DbDump:
+    if compute_context is not None:
+        for logs in log_files:
+            for log in logs.log_items:
+                compute_context(log)
+
+    db = dump_log_groups_with_schema(log_files, schema)
+
+    expander = DbExpander()
+    for table in db.tables:
+        expander.expand_table(table)
+    pack_dump(db)
+
+    return db
+
+
+# Everything check_inv_in needs that does not depend on the checked logs: the
+# db side is expanded, packed and indexed once and shared by all windows.
+# Only the joins in `reached_by_api` are done, see PreparedJoinAll.
+class PreparedCheck:
+    def __init__(
+        self,
+        db_dump: DbDump,
+        log_schema: DbSchema,
+        foreign_key_results,
+        dataflow_map,
+        binlog_file,
+        reached_by_api: dict[str, ReachedJoins] | None = None,
+        compute_context: ComputeContext | None = compute_context_train_ticket_log,
+    ):
+        self.log_schema = log_schema
+        self.compute_context = compute_context
+
+        expander = DbExpander()
+        for table in db_dump.tables:
+            expander.expand_table(table)
+        pack_dump(db_dump)
+
+        self.joiner = PreparedJoinAll(
+            db_prefix_tables(db_dump, "db::"),
+            foreign_key_results,
+            dataflow_map,
+            binlog_file,
+            reached_by_api,
+        )
+        # foreign keys into log tables would join rows across windows
+        self.can_batch = all(
+            not to_table.startswith("log::")
+            for _, _, to_table, _ in foreign_key_results
+        )
+
+    def join_logs(
+        self, log_files: list[LogFile]
+    ) -> tuple[dict[str, LogFile], dict[str, list[int]]]:
+        # joined logs of all windows, and the window of every joined log
+        log_db = load_log_files(log_files, self.log_schema, self.compute_context)
+        logs, tables = self.joiner.join_all(db_prefix_tables(log_db, "log::"))
+        windows = {api: tables[f"log::{api}"].row_groups for api in logs}
+        return logs, windows  # type: ignore
@@ -1,5 +1,11 @@
+from dataclasses import dataclass
+
+import numpy as np
+
+from .column_store import TypedColumnValues
 from .db import DbTable, DbValue, ExpandedColumn
 
+
 def fk1_to_fk2_mapping(fk1_col: ExpandedColumn, fk2_col: ExpandedColumn) -> dict[str, set[DbValue]]:
     fk1_to_fk2 = {}
     for fk1, fk2 in zip(fk1_col.values, fk2_col.values):
@@ -23,23 +29,147 @@ def fk1_to_fk2_mapping(fk1_col: ExpandedColumn, fk2_col: ExpandedColumn) -> dict
                     fk1_to_fk2[fk1].add(fk2)
     return fk1_to_fk2
 
-def infer_relation(right_column: ExpandedColumn, left_columns: list[ExpandedColumn]) -> dict[str, str]:
+
+# A column factorized to integer codes, with array-valued cells exploded:
+# entry k says row `rows[k]` holds the value with code `codes[k]`.
+# Null cells produce no entries. `rows` is sorted.
+@dataclass
+class ColumnCodes:
+    rows: np.ndarray
+    codes: np.ndarray
+    num_codes: int
+
+
+def factorize_column(column: ExpandedColumn) -> ColumnCodes:
+    if isinstance(column.values, TypedColumnValues):
+        rows, codes, num_codes = column.values.factorize()
+        return ColumnCodes(rows=rows, codes=codes, num_codes=num_codes)
+    mapping = {}
+    rows = []
+    codes = []
+    is_array = column.schema.is_array()
+    for row, value in enumerate(column.values):
+        if value is None:
+            continue
+        if is_array:
+            for v in value:
+                rows.append(row)
+                codes.append(mapping.setdefault(v, len(mapping)))
+        else:
+            rows.append(row)
+            codes.append(mapping.setdefault(value, len(mapping)))
+    return ColumnCodes(
+        rows=np.array(rows, dtype=np.int64),
+        codes=np.array(codes, dtype=np.int64),
+        num_codes=len(mapping),
+    )
+
+
+def concat_column_codes(
+    columns: list[ColumnCodes],
+) -> tuple[ColumnCodes, np.ndarray]:
+    # stack several columns into one code space, returning the owning column
+    # index of every global code
+    offset = 0
+    rows = []
+    codes = []
+    owners = []
+    for column_idx, column in enumerate(columns):
+        rows.append(column.rows)
+        codes.append(column.codes + offset)
+        owners.append(np.full(column.num_codes, column_idx, dtype=np.int64))
+        offset += column.num_codes
+    if len(columns) == 0:
+        empty = np.zeros(0, dtype=np.int64)
+        return ColumnCodes(empty, empty, 0), empty
+    rows = np.concatenate(rows)
+    codes = np.concatenate(codes)
+    order = np.argsort(rows, kind="stable")
+    return (
+        ColumnCodes(rows=rows[order], codes=codes[order], num_codes=offset),
+        np.concatenate(owners),
+    )
+
+
+def join_codes_on_row(
+    left: ColumnCodes, right: ColumnCodes, num_rows: int
+) -> tuple[np.ndarray, np.ndarray]:
+    # all (left code, right code) pairs sharing a row
+    right_counts = np.bincount(right.rows, minlength=num_rows)
+    right_starts = np.cumsum(right_counts) - right_counts
+
+    repeats = right_counts[left.rows]
+    total = int(repeats.sum())
+    left_codes = np.repeat(left.codes, repeats)
+
+    repeat_starts = np.cumsum(repeats) - repeats
+    right_idx = np.repeat(right_starts[left.rows] - repeat_starts, repeats) + np.arange(
+        total, dtype=np.int64
+    )
+    return left_codes, right.codes[right_idx]
+
+
+def infer_relation_codes(
+    key: ColumnCodes,
+    left_names: list[str],
+    left_codes: ColumnCodes,
+    left_owners: np.ndarray,
+    num_rows: int,
+) -> dict[str, str]:
+    key_codes, partner_codes = join_codes_on_row(key, left_codes, num_rows)
+
+    num_partner = max(left_codes.num_codes, 1)
+    pairs = np.unique(key_codes * num_partner + partner_codes)
+    key_u = pairs // num_partner
+    partner_u = pairs % num_partner
+    owner_u = left_owners[partner_u]
+
+    # key value linked to more than one distinct value of the left column
+    per_key = np.unique(owner_u * max(key.num_codes, 1) + key_u, return_counts=True)
+    fk_multiple = np.zeros(len(left_names), dtype=bool)
+    fk_multiple[per_key[0][per_key[1] > 1] // max(key.num_codes, 1)] = True
+
+    # left value linked to more than one distinct key value
+    per_partner = np.bincount(partner_u, minlength=left_codes.num_codes)
+    left_multiple = np.zeros(len(left_names), dtype=bool)
+    left_multiple[left_owners[per_partner > 1]] = True
+
     relation_dict = {}
+    for i, column_name in enumerate(left_names):
+        if not fk_multiple[i] and not left_multiple[i]:
+            relation_dict[column_name] = "one_to_one"
+        elif fk_multiple[i] and not left_multiple[i]:
+            relation_dict[column_name] = "one_to_many"
+        elif not fk_multiple[i] and left_multiple[i]:
+            relation_dict[column_name] = "many_to_one"
+        else:
+            relation_dict[column_name] = "many_to_many"
+    return relation_dict
+
+
+def factorize_left_columns(
+    left_columns: dict[str, ExpandedColumn],
+) -> tuple[list[str], ColumnCodes, np.ndarray]:
+    left_names = []
+    left_factorized = []
     for column_name, left_column in left_columns.items():
         if left_column.schema.is_basic():
-            fk_to_left = fk1_to_fk2_mapping(right_column, left_column)
-            left_to_fk = fk1_to_fk2_mapping(left_column, right_column)
-            fk_has_multiple = any(len(v) > 1 for v in fk_to_left.values())
-            left_has_multiple = any(len(v) > 1 for v in left_to_fk.values())
-            if not fk_has_multiple and not left_has_multiple:
-                relation_dict[column_name] = "one_to_one"
-            elif fk_has_multiple and not left_has_multiple:
-                relation_dict[column_name] = "one_to_many"
-            elif not fk_has_multiple and left_has_multiple:
-                relation_dict[column_name] = "many_to_one"
-            else:
-                relation_dict[column_name] = "many_to_many"
-    return relation_dict
+            left_names.append(column_name)
+            left_factorized.append(factorize_column(left_column))
+    left_codes, left_owners = concat_column_codes(left_factorized)
+    return left_names, left_codes, left_owners
+
+
+def infer_relation(right_column: ExpandedColumn, left_columns: dict[str, ExpandedColumn]) -> dict[str, str]:
+    left_names, left_codes, left_owners = factorize_left_columns(left_columns)
+    return infer_relation_codes(
+        factorize_column(right_column),
+        left_names,
+        left_codes,
+        left_owners,
+        len(right_column.values),
+    )
+
 
 def infer_relations_in_table(table: DbTable) -> dict[str, dict[str, str]]:
     if len(table.join_info) == 0:
@@ -55,12 +185,25 @@ def infer_relations_in_table(table: DbTable) -> dict[str, dict[str, str]]:
         else:
             left_columns[column.name] = column
 
+    # factorize every basic left column once and share it across all keys
+    left_names, left_codes, left_owners = factorize_left_columns(left_columns)
+    num_rows = table.value_length()
+
+    def infer(right_column: ExpandedColumn) -> dict[str, str]:
+        return infer_relation_codes(
+            factorize_column(right_column),
+            left_names,
+            left_codes,
+            left_owners,
+            num_rows,
+        )
+
     for relation, right_prefix in table.join_info:
         if relation.ty == "foreign_key":
             foreign_key_name = f'{right_prefix}{relation.right_column}'
             foreign_key = right_columns[foreign_key_name]
             relation_dict[foreign_key_name] = {}
-            column_relation_dict = infer_relation(foreign_key, left_columns)
+            column_relation_dict = infer(foreign_key)
             relation_dict[foreign_key_name] = column_relation_dict
         else:
             for right_column_name in right_columns:
@@ -68,7 +211,7 @@ def infer_relations_in_table(table: DbTable) -> dict[str, dict[str, str]]:
                     right_column = right_columns[right_column_name]
                     relation_dict[right_column_name] = {}
                     if right_column.schema.is_basic():
-                        column_relation_dict = infer_relation(right_column, left_columns)
+                        column_relation_dict = infer(right_column)
                         relation_dict[right_column_name] = column_relation_dict
                         
-    return relation_dict
\ No newline at end of file
+    return relation_dict
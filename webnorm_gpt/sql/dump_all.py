@@ -1,54 +1,307 @@
-from ..schema_induction.db import DbDump
+import datetime
+import decimal
+import heapq
+import math
+import os
+import pickle
+import tempfile
+from collections.abc import Iterable
+from dataclasses import dataclass, field
+from fractions import Fraction
 
+from ..schema_induction.column_store import TypedColumnValues
+from ..schema_induction.db import DbDump, DbValue
 
-def infer_not_null(dump: DbDump) -> list[tuple[str, str]]:
-    results = []
+# distinct values of a column held in memory at once, beyond that they are
+# sorted in runs spilled to disk
+SPILL_THRESHOLD = 1_000_000
+RUN_BATCH_SIZE = 4096
+
+
+@dataclass
+class ColumnProfile:
+    table: str
+    column: str
+    row_count: int = 0
+    null_count: int = 0
+    distinct_count: int = 0
+
+    def is_not_null(self) -> bool:
+        return self.null_count == 0
+
+    def is_unique(self) -> bool:
+        return self.null_count <= 1 and (
+            self.distinct_count + self.null_count == self.row_count
+        )
+
+
+@dataclass
+class InclusionDependency:
+    from_table: str
+    from_column: str
+    to_table: str
+    to_column: str
+    overlap: int
+    coverage: float
+
+    def is_exact(self) -> bool:
+        return self.coverage >= 1.0
+
+
+@dataclass
+class DumpProfile:
+    columns: list[ColumnProfile] = field(default_factory=list)
+    inclusion_dependencies: list[InclusionDependency] = field(default_factory=list)
+
+
+def _number_key(value) -> tuple:
+    # numbers equal in python (1 == 1.0 == Decimal("1.00") == True) get the
+    # same key; finite ones are compared exactly, as int or Fraction
+    if isinstance(value, (bool, int)):
+        return (0, 1, int(value))
+    if isinstance(value, decimal.Decimal):
+        if value.is_nan():
+            return (0, 3, 0)
+        if value.is_infinite():
+            return (0, 0 if value < 0 else 2, 0)
+    elif math.isnan(value):
+        return (0, 3, 0)
+    elif math.isinf(value):
+        return (0, 0 if value < 0 else 2, 0)
+    number = Fraction(value)
+    if number.denominator == 1:
+        return (0, 1, number.numerator)
+    return (0, 1, number)
+
+
+def _sort_key(value: DbValue) -> tuple:
+    # a total order over mixed-type columns in which two keys are equal iff
+    # their values are equal in python
+    if isinstance(value, (bool, int, float, decimal.Decimal, Fraction)):
+        return _number_key(value)
+    if isinstance(value, str):
+        return (1, value)
+    if isinstance(value, bytes):
+        return (2, value)
+    # temporal types, tagged as datetime and date are never equal; aware
+    # datetimes are equal at the same instant, in whatever zone
+    if isinstance(value, datetime.datetime):
+        if value.utcoffset() is not None:
+            return (
+                3,
+                "datetime-utc",
+                value.astimezone(datetime.timezone.utc).isoformat(),
+            )
+        return (3, "datetime", value.isoformat())
+    if isinstance(value, datetime.date):
+        return (3, "date", value.isoformat())
+    if isinstance(value, datetime.time):
+        return (3, "time", value.isoformat())
+    if isinstance(value, datetime.timedelta):
+        return (3, "timedelta", (value.days, value.seconds, value.microseconds))
+    return (4, type(value).__name__, repr(value))
+
+
+def _write_run(keys: list[tuple], spill_dir: str | None) -> str:
+    fd, path = tempfile.mkstemp(suffix=".run", dir=spill_dir)
+    with os.fdopen(fd, "wb") as f:
+        for i in range(0, len(keys), RUN_BATCH_SIZE):
+            pickle.dump(keys[i : i + RUN_BATCH_SIZE], f)
+    return path
+
+
+def _read_run(path: str):
+    try:
+        with open(path, "rb") as f:
+            while True:
+                try:
+                    batch = pickle.load(f)
+                except EOFError:
+                    break
+                yield from batch
+    finally:
+        os.remove(path)
+
+
+def _dedup_sorted(keys):
+    has_last = False
+    last = None
+    for key in keys:
+        if has_last and key == last:
+            continue
+        has_last = True
+        last = key
+        yield key
+
+
+def _sorted_distinct(
+    values: Iterable[DbValue],
+    profile: ColumnProfile,
+    spill_threshold: int,
+    spill_dir: str | None,
+):
+    # the sorted distinct keys of `values`, which are read once; at most
+    # `spill_threshold` keys are kept in memory, each time that many are
+    # collected they are written out as a sorted run and merged back lazily
+    if isinstance(values, TypedColumnValues):
+        # distinct values come straight from the typed arrays
+        profile.row_count = len(values)
+        profile.null_count = values.null_count()
+        return iter(sorted({_sort_key(value) for value in values.distinct()}))
 
+    run_paths = []
+    keys = set()
+    for value in values:
+        profile.row_count += 1
+        if value is None:
+            profile.null_count += 1
+            continue
+        keys.add(_sort_key(value))
+        if len(keys) >= spill_threshold:
+            run_paths.append(_write_run(sorted(keys), spill_dir))
+            keys = set()
+    if len(run_paths) == 0:
+        return iter(sorted(keys))
+    if len(keys) > 0:
+        run_paths.append(_write_run(sorted(keys), spill_dir))
+    return _dedup_sorted(heapq.merge(*[_read_run(path) for path in run_paths]))
+
+
+def _tag_stream(keys, column_idx: int):
+    for key in keys:
+        yield key, column_idx
+
+
+def profile_dump(
+    dump: DbDump,
+    min_coverage: float = 1.0,
+    spill_threshold: int = SPILL_THRESHOLD,
+    spill_dir: str | None = None,
+) -> DumpProfile:
+    # SPIDER-style unary inclusion dependency discovery: every column's
+    # distinct values are sorted once, then a single multi-way merge over all
+    # columns finds the INDs and the uniqueness / not-null statistics.
+    profiles: list[ColumnProfile] = []
+    streams = []
     for table in dump.tables:
         for column in table.columns:
-            if None not in column.values:
-                results.append((table.name, column.name))
+            profile = ColumnProfile(table=table.name, column=column.name)
+            streams.append(
+                _tag_stream(
+                    _sorted_distinct(
+                        column.values, profile, spill_threshold, spill_dir
+                    ),
+                    len(profiles),
+                )
+            )
+            profiles.append(profile)
 
-    return results
+    num_columns = len(profiles)
+    all_columns = frozenset(range(num_columns))
+    refs: list[set[int]] = [set(all_columns - {i}) for i in range(num_columns)]
+    overlaps: dict[tuple[int, int], int] = {}
+    count_partial = min_coverage < 1.0
 
+    group: list[int] = []
+    group_key = None
 
-def infer_unique(dump: DbDump) -> list[tuple[str, str]]:
-    results = []
+    def flush_group():
+        group_set = set(group)
+        for i in group:
+            profiles[i].distinct_count += 1
+            if refs[i]:
+                refs[i].intersection_update(group_set)
+        if count_partial and len(group) > 1:
+            for i in group:
+                for j in group:
+                    if i != j:
+                        overlaps[(i, j)] = overlaps.get((i, j), 0) + 1
+
+    for key, column_idx in heapq.merge(*streams):
+        if group and key != group_key:
+            flush_group()
+            group = []
+        group_key = key
+        group.append(column_idx)
+    if group:
+        flush_group()
+
+    pairs: dict[tuple[int, int], int] = {}
+    for i in range(num_columns):
+        if profiles[i].distinct_count == 0:
+            continue
+        for j in refs[i]:
+            pairs[(i, j)] = profiles[i].distinct_count
+    if count_partial:
+        for (i, j), overlap in overlaps.items():
+            if overlap / profiles[i].distinct_count >= min_coverage:
+                pairs[(i, j)] = overlap
 
+    inclusion_dependencies = []
+    for i, j in sorted(pairs):
+        overlap = pairs[(i, j)]
+        inclusion_dependencies.append(
+            InclusionDependency(
+                from_table=profiles[i].table,
+                from_column=profiles[i].column,
+                to_table=profiles[j].table,
+                to_column=profiles[j].column,
+                overlap=overlap,
+                coverage=overlap / profiles[i].distinct_count,
+            )
+        )
+
+    return DumpProfile(columns=profiles, inclusion_dependencies=inclusion_dependencies)
+
+
+def infer_not_null(
+    dump: DbDump, profile: DumpProfile | None = None
+) -> list[tuple[str, str]]:
+    if profile is not None:
+        return [(c.table, c.column) for c in profile.columns if c.is_not_null()]
+
+    results = []
     for table in dump.tables:
         for column in table.columns:
-            if len(set(column.values)) == len(column.values):
+            if isinstance(column.values, TypedColumnValues):
+                not_null = column.values.null_count() == 0
+            else:
+                not_null = all(value is not None for value in column.values)
+            if not_null:
                 results.append((table.name, column.name))
-
     return results
 
 
-def infer_foreign_key(dump: DbDump) -> list[tuple[str, str, str, str]]:
-    results = []
+def infer_unique(
+    dump: DbDump, profile: DumpProfile | None = None
+) -> list[tuple[str, str]]:
+    profile = profile if profile is not None else profile_dump(dump)
+    return [(c.table, c.column) for c in profile.columns if c.is_unique()]
 
-    all_columns = []
-    for table in dump.tables:
-        for column in table.columns:
-            all_columns.append((table.name, column.name))
 
-    not_null_filter = lambda x: x is not None
+def infer_foreign_key(
+    dump: DbDump, min_coverage: float = 1.0, profile: DumpProfile | None = None
+) -> list[tuple[str, str, str, str]]:
+    # a given `profile` must have been made with the same min_coverage
+    profile = profile if profile is not None else profile_dump(dump, min_coverage)
+    return [
+        (ind.from_table, ind.from_column, ind.to_table, ind.to_column)
+        for ind in profile.inclusion_dependencies
+    ]
 
-    for i, (table_i, column_i) in enumerate(all_columns):
-        data_i = dump.find_table(table_i).find_column(column_i).values
-        data_i_set = set(filter(not_null_filter, data_i))
-        if len(data_i_set) == 0:
-            continue
-        for j, (table_j, column_j) in enumerate(all_columns):
-            data_j = dump.find_table(table_j).find_column(column_j).values
-            data_j_set = set(filter(not_null_filter, data_j))
-            if len(data_j_set) == 0:
-                continue
-            if i != j:
-                if data_i_set.issubset(data_j_set):
-                    # print(f"{table_i}.{column_i} -> {table_j}.{column_j}")
-                    results.append((table_i, column_i, table_j, column_j))
 
-    return results
+def infer_constraints(
+    dump: DbDump, min_coverage: float = 1.0
+) -> tuple[
+    list[tuple[str, str]], list[tuple[str, str]], list[tuple[str, str, str, str]]
+]:
+    # not null columns, unique columns and foreign keys, from one profile
+    profile = profile_dump(dump, min_coverage)
+    return (
+        infer_not_null(dump, profile),
+        infer_unique(dump, profile),
+        infer_foreign_key(dump, min_coverage, profile),
+    )
 
     # not_null = infer_not_null(db_dump)
     # pprint.pprint(not_null)
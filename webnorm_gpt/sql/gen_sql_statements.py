@@ -1,3 +1,4 @@
+import asyncio
 import json
 import os
 import pickle
@@ -5,7 +6,6 @@ import ast
 import zstandard
 import copy
 import traceback
-from tqdm import tqdm
 from ..file_types.log_file import LogFile, LogItem
 from ..file_types.proj_desc_file import ProjDescFile
 from ..gpt_invoker import GPTInvoker
@@ -25,9 +25,8 @@ def generate_sql_statements(
     logs: LogFile, proj_desc: ProjDescFile, gpt_invoker: GPTInvoker, entity_dict
 ) -> dict[str, dict[str, str]]:
 
-    sql_statements = {}
-    for api in tqdm(proj_desc.apis):
-        api_name = api.to_json()["name"]
+    # the apis are independent of each other, and generated concurrently
+    async def generate_for_api(api) -> dict[str, str]:
         try:
             function_header = api.to_json()["def_req"].split("class")[0]
             # extract entity from function header
@@ -46,15 +45,19 @@ def generate_sql_statements(
                 },
             ]
 
-            entity_response = gpt_invoker.generate(extract_entity_inputs)
+            entity_response = await gpt_invoker.agenerate(extract_entity_inputs)
             related_entity_list = ast.literal_eval(entity_response)
             final_entity_list = set(copy.deepcopy(related_entity_list))
 
-            if len(related_entity_list) > 0:
-                # extract foreign key entity for each entity
-                for entity in related_entity_list:
-                    class_ = {entity: entity_dict[entity]}
-                    extract_foreign_key_entity_inputs = [
+            if len(related_entity_list) == 0:
+                return None
+
+            # extract foreign key entity for each entity
+            extract_foreign_key_entity_inputs = []
+            for entity in related_entity_list:
+                class_ = {entity: entity_dict[entity]}
+                extract_foreign_key_entity_inputs.append(
+                    [
                         {
                             "role": "system",
                             "content": EXTRACT_FOREIGN_KEY_ENTITY_SYSTEM.format(
@@ -68,49 +71,63 @@ def generate_sql_statements(
                             ),
                         },
                     ]
-                    entity_response = gpt_invoker.generate(
-                        extract_foreign_key_entity_inputs
-                    )
-                    foreign_key_entity_list = ast.literal_eval(entity_response)
-                    final_entity_list.update(foreign_key_entity_list)
-                final_entites = {
-                    entity: entity_dict[entity] for entity in final_entity_list
-                }
-                # decide whether to extract current login user information
-                user_context_inputs = [
-                    {"role": "system", "content": USER_CONTEXT_SYSTEM},
-                    {
-                        "role": "user",
-                        "content": USER_CONTEXT_USER.format(
-                            function_header=function_header,
-                            entities=final_entites,
-                        ),
-                    },
-                ]
-                user_context_response = gpt_invoker.generate(user_context_inputs)
-                if user_context_response == "Yes":
-                    user_context = "userId, username"
-                else:
-                    user_context = "Not available"
-
-                # generate sql query
-                generate_sql_inputs = [
-                    {"role": "system", "content": GENERATE_SQL_SYSTEM},
-                    {
-                        "role": "user",
-                        "content": GENERATE_SQL_USER.format(
-                            function_header=function_header,
-                            entities=final_entites,
-                            user_context=user_context,
-                        ),
-                    },
+                )
+            # the first failing request cancels the others
+            async with asyncio.TaskGroup() as group:
+                entity_tasks = [
+                    group.create_task(gpt_invoker.agenerate(inputs))
+                    for inputs in extract_foreign_key_entity_inputs
                 ]
-                sql_response = gpt_invoker.generate(generate_sql_inputs)
-                sql_dict = ast.literal_eval(sql_response)
-                sql_statements[api_name] = sql_dict
+            for entity_task in entity_tasks:
+                foreign_key_entity_list = ast.literal_eval(entity_task.result())
+                final_entity_list.update(foreign_key_entity_list)
+            final_entites = {
+                entity: entity_dict[entity] for entity in final_entity_list
+            }
+            # decide whether to extract current login user information
+            user_context_inputs = [
+                {"role": "system", "content": USER_CONTEXT_SYSTEM},
+                {
+                    "role": "user",
+                    "content": USER_CONTEXT_USER.format(
+                        function_header=function_header,
+                        entities=final_entites,
+                    ),
+                },
+            ]
+            user_context_response = await gpt_invoker.agenerate(user_context_inputs)
+            if user_context_response == "Yes":
+                user_context = "userId, username"
+            else:
+                user_context = "Not available"
+
+            # generate sql query
+            generate_sql_inputs = [
+                {"role": "system", "content": GENERATE_SQL_SYSTEM},
+                {
+                    "role": "user",
+                    "content": GENERATE_SQL_USER.format(
+                        function_header=function_header,
+                        entities=final_entites,
+                        user_context=user_context,
+                    ),
+                },
+            ]
+            sql_response = await gpt_invoker.agenerate(generate_sql_inputs)
+            sql_dict = ast.literal_eval(sql_response)
+            return sql_dict
         except Exception as e:
             traceback.print_exc()
-            sql_statements[api_name] = {}
+            return {}
+
+    results = gpt_invoker.run_many(
+        [generate_for_api(api) for api in proj_desc.apis],
+        desc="Generating SQL Statements",
+    )
+    sql_statements = {}
+    for api, sql_dict in zip(proj_desc.apis, results):
+        if sql_dict is not None:
+            sql_statements[api.to_json()["name"]] = sql_dict
 
     # Example result
     return sql_statements